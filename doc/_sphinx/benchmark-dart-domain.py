@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks for the `dart` domain extension (extensions/dart_domain.py).
+
+The benchmark generates synthetic declarations in the same format as the output of
+`dartdoc_json`, and documents them with the {dartdoc} directive in a temporary Sphinx project.
+Neither network access nor a Dart SDK is needed: the API data is injected into the domain's table
+of files before the documents are read, so the tool is never invoked.
+
+The following stages are timed: `_locate_symbol`, `_extract_symbol`, `_augment_comment`, the
+`_generate_*` node builders, the parsing of descriptions, `resolve_xref`, and the pickling of the
+environment.
+
+Usage:
+
+    python3 benchmark-dart-domain.py --members 10,100,1000 --output results.json
+    python3 benchmark-dart-domain.py --members 10,100,1000 --compare results.json
+
+In the comparison mode, the results are checked against a previously stored baseline, and the
+script exits with a non-zero status if any stage became slower than the given threshold.
+"""
+import argparse
+import functools
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import docutils
+import sphinx
+from docutils import nodes
+from sphinx.addnodes import pending_xref
+from sphinx.application import Sphinx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from extensions.dart_domain import (  # noqa: E402
+    DartdocDirective, augment_comment, tokenize_comment,
+)
+
+# Methods of DartdocDirective that are timed. Recursive calls are attributed to the outermost
+# invocation only.
+TIMED_METHODS = [
+    '_locate_symbol',
+    '_extract_symbol',
+    '_augment_comment',
+    '_group_class_members',
+    '_generate_node_for_declaration',
+    '_generate_class_signature_node',
+    '_generate_function_signature_node',
+    '_generate_field_signature_node',
+    '_generate_description',
+    '_parse_descriptions',
+]
+
+WORDS = (
+    'the component is added to the game tree and its position size angle anchor priority are '
+    'updated every tick when mounted onto parent while children render after this one'
+).split()
+
+
+# ------------------------------------------------------------------------------
+# Synthetic API data
+# ------------------------------------------------------------------------------
+
+def generate_description(rng: random.Random, length: int, density: float,
+                         references: List[str]) -> str:
+    """
+    Generates a description of approximately `length` characters, where a fraction `density` of
+    the words are bracketed references to the names in `references`, and some other words are
+    code spans.
+    """
+    words = []
+    size = 0
+    while size < length:
+        roll = rng.random()
+        if roll < density:
+            word = f'[{rng.choice(references)}]'
+        elif roll < density * 1.5:
+            word = f'`{rng.choice(WORDS)}()`'
+        else:
+            word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return ' '.join(words) + '.'
+
+
+def generate_declaration(name: str, n_members: int, n_parameters: int, description_length: int,
+                         density: float, seed: int) -> Dict:
+    """
+    Generates a class declaration in the format of `dartdoc_json`, with `n_members` members
+    evenly split between constructors, fields, getter/setter pairs and methods.
+    """
+    rng = random.Random(seed)
+    member_names = [f'member{i}' for i in range(n_members)]
+    parameter_names = [f'param{i}' for i in range(n_parameters)]
+    other_names = ['Component', 'Vector2', 'FlameGame', 'Anchor']
+
+    def parameters() -> Dict:
+        return {
+            'all': [
+                {'name': param, 'type': 'double', 'required': True}
+                if i % 2 else {'name': param, 'type': 'int', 'default': '0'}
+                for i, param in enumerate(parameter_names)
+            ],
+            'named': n_parameters // 2,
+        }
+
+    members = []
+    for i, member_name in enumerate(member_names):
+        references = member_names[max(0, i - 5):i + 5] + other_names
+        kind = ['constructor', 'field', 'getter', 'setter', 'method'][i % 5]
+        member = {'kind': kind, 'name': member_name}
+        if kind == 'constructor':
+            member['name'] = f'{name}.{member_name}'
+            member['parameters'] = parameters()
+        elif kind == 'field':
+            member['type'] = 'double'
+        elif kind == 'getter':
+            member['returns'] = 'Vector2'
+        elif kind == 'setter':
+            # Pairs with the getter declared right before
+            member['name'] = member_names[i - 1]
+            member['parameters'] = {'all': [{'name': 'value', 'type': 'Vector2'}]}
+        elif kind == 'method':
+            member['returns'] = 'void'
+            member['parameters'] = parameters()
+            references = references + parameter_names
+            if i % 3 == 0:
+                member['annotations'] = [{'name': '@override'}]
+        member['description'] = generate_description(
+            rng, description_length, density, references
+        )
+        members.append(member)
+    return {
+        'kind': 'class',
+        'name': name,
+        'typeParameters': [{'name': 'T', 'extends': 'Component'}],
+        'extends': 'PositionComponent',
+        'implements': ['SizeProvider', 'AnchorProvider'],
+        'description': generate_description(
+            rng, description_length * 4, density, member_names[:20] + other_names
+        ),
+        'members': members,
+    }
+
+
+# ------------------------------------------------------------------------------
+# Timing
+# ------------------------------------------------------------------------------
+
+class Timings:
+    """
+    Accumulates the time spent in each stage, separately for each document (repetition).
+    """
+
+    def __init__(self):
+        self.current: Dict[str, List[float]] = {}
+        self.samples: Dict[str, List[Dict[str, float]]] = {}
+        self._depth: Dict[str, int] = {}
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            depth = self._depth.get(name, 0)
+            self._depth[name] = depth + 1
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._depth[name] = depth
+                if depth == 0:
+                    self.add(name, time.perf_counter() - start_time)
+        return wrapper
+
+    def add(self, name: str, duration: float) -> None:
+        entry = self.current.setdefault(name, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+
+    def end_sample(self) -> None:
+        for name, (total, calls) in self.current.items():
+            self.samples.setdefault(name, []).append({'time': total, 'calls': calls})
+        self.current = {}
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for name, samples in self.samples.items():
+            times = [sample['time'] for sample in samples]
+            result[name] = {
+                'min': min(times),
+                'median': statistics.median(times),
+                'calls': samples[0]['calls'],
+            }
+        return result
+
+
+def run_case(n_members: int, args: argparse.Namespace, timings: Timings) -> Dict:
+    """
+    Builds a temporary project with `args.repeat` documents, each documenting one synthetic class
+    with `n_members` members, and returns the timings of all stages.
+    """
+    clear_memos()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src_dir = os.path.join(temp_dir, 'src')
+        lib_dir = os.path.join(temp_dir, 'lib')
+        os.makedirs(src_dir)
+        os.makedirs(lib_dir)
+        dart_file = os.path.join(lib_dir, 'synthetic.dart')
+        with open(dart_file, 'wt') as f:
+            f.write('// synthetic\n')
+        symbols = [f'Synthetic{i}' for i in range(args.repeat)]
+        file_json = {
+            'source': dart_file,
+            'declarations': [
+                generate_declaration(
+                    symbol, n_members, args.parameters, args.description_length,
+                    args.reference_density, seed=i,
+                )
+                for i, symbol in enumerate(symbols)
+            ],
+        }
+        with open(os.path.join(src_dir, 'index.md'), 'wt') as f:
+            f.write('# Benchmark\n\n```{toctree}\n' + '\n'.join(symbols) + '\n```\n')
+        for symbol in symbols:
+            with open(os.path.join(src_dir, symbol + '.md'), 'wt') as f:
+                f.write(
+                    f'# {symbol}\n\n```{{dartdoc}}\n:package: synthetic\n:symbol: {symbol}\n'
+                    f':file: synthetic.dart\n```\n'
+                )
+
+        def inject_api_data(_, env, __):
+            timestamp = os.path.getmtime(dart_file)
+            start_time = time.perf_counter()
+            env.get_domain('dart').store_file_data(dart_file, file_json, timestamp)
+            timings.add('store_file_data', time.perf_counter() - start_time)
+
+        def end_document(*_):
+            timings.end_sample()
+            clear_memos()
+
+        app = Sphinx(
+            srcdir=src_dir,
+            confdir=None,
+            outdir=os.path.join(temp_dir, 'html'),
+            doctreedir=os.path.join(temp_dir, 'doctrees'),
+            buildername='html',
+            confoverrides={
+                'extensions': ['myst_parser', 'extensions.dart_domain'],
+                'primary_domain': 'dart',
+                'dartdoc_roots': {'synthetic': lib_dir},
+                'dartdoc_cache_dir': '',
+            },
+            status=None,
+            warning=io.StringIO(),
+            freshenv=True,
+        )
+        app.connect('env-before-read-docs', inject_api_data, priority=100)
+        app.connect('doctree-read', end_document)
+        app.build()
+
+        # Cross-reference resolution
+        domain = app.env.get_domain('dart')
+        targets = list(domain.data['xrefs'])
+        start_time = time.perf_counter()
+        for target in targets:
+            node = pending_xref('', refdomain='dart', reftype='ref', reftarget=target)
+            domain.resolve_xref(app.env, 'index', app.builder, 'ref', target, node,
+                                nodes.Text(target))
+        resolve_time = time.perf_counter() - start_time
+
+        # Environment pickling
+        start_time = time.perf_counter()
+        pickled_env = pickle.dumps(app.env, pickle.HIGHEST_PROTOCOL)
+        pickle_time = time.perf_counter() - start_time
+        store_size = domain.store.size()
+        domain.store.close()
+
+    result = timings.summary()
+    result['resolve_xref'] = {'min': resolve_time, 'median': resolve_time, 'calls': len(targets)}
+    result['env_pickle'] = {'min': pickle_time, 'median': pickle_time, 'calls': 1}
+    result['env_pickle_bytes'] = {'size': len(pickled_env)}
+    result['declaration_store_bytes'] = {'size': store_size}
+    return result
+
+
+def clear_memos() -> None:
+    """
+    Forgets the memoised results of the doc comment conversion, so that every document (sample)
+    does the full amount of work, instead of reusing the results of the previous documents.
+    """
+    augment_comment.cache_clear()
+    tokenize_comment.cache_clear()
+
+
+def instrument(timings: Timings) -> None:
+    for name in TIMED_METHODS:
+        setattr(DartdocDirective, name, timings.wrap(name, getattr(DartdocDirective, name)))
+
+
+# ------------------------------------------------------------------------------
+# Reporting
+# ------------------------------------------------------------------------------
+
+def print_results(results: Dict) -> None:
+    for case, stages in results['cases'].items():
+        print(f'\n{case}')
+        for stage, data in stages.items():
+            if 'size' in data:
+                print(f'  {stage:<36} {data["size"]:>12,} bytes')
+            else:
+                print(f'  {stage:<36} {data["min"] * 1000:>12.3f} ms  ({data["calls"]} calls)')
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Returns the list of stages that became slower (or larger) than in the `baseline` by more
+    than the `threshold` fraction.
+    """
+    regressions = []
+    for case, stages in results['cases'].items():
+        baseline_stages = baseline['cases'].get(case, {})
+        for stage, data in stages.items():
+            if stage not in baseline_stages:
+                continue
+            key = 'size' if 'size' in data else 'min'
+            old_value = baseline_stages[stage][key]
+            new_value = data[key]
+            if old_value > 0 and new_value > old_value * (1 + threshold):
+                regressions.append(
+                    f'{case} / {stage}: {old_value:.6g} -> {new_value:.6g} '
+                    f'(+{100 * (new_value / old_value - 1):.0f}%)'
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--members', default='10,100,1000',
+                        help='comma-separated list of class sizes to benchmark')
+    parser.add_argument('--parameters', type=int, default=4,
+                        help='number of parameters of each method and constructor')
+    parser.add_argument('--description-length', type=int, default=300,
+                        help='approximate length of each member description, in characters')
+    parser.add_argument('--reference-density', type=float, default=0.1,
+                        help='fraction of description words that are [references]')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of documents rendered for each case')
+    parser.add_argument('--output', help='file to save the results into, in JSON format')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown that is reported as a regression')
+    args = parser.parse_args()
+
+    timings = Timings()
+    instrument(timings)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'sphinx': sphinx.__version__,
+            'docutils': docutils.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'cases': {},
+    }
+    for n_members in [int(n) for n in args.members.split(',')]:
+        case = f'members={n_members}'
+        results['cases'][case] = run_case(n_members, args, timings)
+        timings.samples = {}
+    print_results(results)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'rt') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\nRegressions compared to the baseline:')
+            for line in regressions:
+                print('  ' + line)
+            sys.exit(1)
+        print('\nNo regressions compared to the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,8 @@ import os
 import sys
 sys.path.insert(0, os.path.abspath('.'))
 
+from extensions.profiler import span  # noqa: E402
+
 root_dir = os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..', '..')
 )
@@ -30,12 +32,14 @@ primary_domain = 'dart'
 # extensions coming with Sphinx (named 'sphinx.ext.*') or your custom
 # ones.
 extensions = [
+    'extensions.profiler',  # Build profiling, see `profiler_enabled` below
     'myst_parser',  # Markdown support
     'sphinxcontrib.mermaid',
     'extensions.dart_domain',
     'extensions.flutter_app',
     'extensions.package',
     'extensions.yarn_lexer',
+    'extensions.precompress',  # Writes .gz/.br versions of the output files
     'sphinxcontrib.jquery',
     'sphinx_copybutton'
 ]
@@ -76,6 +80,26 @@ dartdoc_roots = {
     'jenny': os.path.join(root_dir, 'packages/flame_jenny/jenny/lib'),
 }
 
+# -- Options for flutter-app extension ---------------------------------------
+# Embedded apps start only when they are scrolled into view, and at most 3 of
+# them run at the same time on a page.
+flutter_app_boot = 'visible'
+flutter_app_max_active = 3
+# The assets that several apps have in common are published only once.
+flutter_app_shared_assets = True
+
+# -- Options for the profiler extension -------------------------------------
+# Set the environment variable DOCS_PROFILE=1 (or run `melos doc-profile`) in
+# order to save the timings of the build into `_build/profile.json` and
+# `_build/profile-trace.json`.
+profiler_enabled = bool(os.environ.get('DOCS_PROFILE'))
+
+# -- Options for the precompress extension -----------------------------------
+# The .gz/.br versions of the output files are only needed for the published
+# site, so they are written only if the environment variable DOCS_PRECOMPRESS
+# is set (as done by `melos doc-publish`).
+precompress_enabled = bool(os.environ.get('DOCS_PRECOMPRESS'))
+
 # -- Options for HTML output -------------------------------------------------
 
 # The theme to use for HTML and HTML Help pages.
@@ -144,7 +168,11 @@ def get_local_toc(document):
 # Emitted when the HTML builder has created a context dictionary to render
 # a template with – this can be used to add custom elements to the context.
 def on_html_page_context(app, pagename, templatename, context, doctree):
-    context["get_local_toc"] = lambda: get_local_toc(doctree)
+    def local_toc():
+        with span('conf', 'get_local_toc', doc=pagename):
+            return get_local_toc(doctree)
+
+    context["get_local_toc"] = local_toc
 
 
 def setup(app):
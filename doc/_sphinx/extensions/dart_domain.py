@@ -1,10 +1,22 @@
+import abc
+import concurrent.futures
+import contextlib
+import functools
+import hashlib
 import json
+import logging
+import mmap
 import os
+import pickle
 import re
+import shutil
 import subprocess
-import tempfile
-from typing import List, Tuple, Dict, Optional, Set, Any
+import time
+from typing import List, Tuple, Dict, Optional, Set, Any, FrozenSet
 
+import docutils
+import myst_parser
+import sphinx
 from docutils import nodes
 from docutils.nodes import Element
 from docutils.parsers.rst import directives
@@ -17,8 +29,20 @@ from sphinx.environment import BuildEnvironment
 from sphinx.roles import XRefRole
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.fileutil import copy_asset_file
+from sphinx.util import logging as sphinx_logging
+from sphinx.util.logging import getLogger
 from sphinx.util.nodes import make_refnode
 
+from .filelock import FileLock
+from .profiler import span
+
+logger = getLogger('dart-domain')
+
+with open(__file__, 'rb') as _f:
+    # Digest of this extension's source code, the rendering caches are invalidated whenever it
+    # changes.
+    EXTENSION_DIGEST = hashlib.sha1(_f.read()).hexdigest()
+
 
 class DartdocDirective(SphinxDirective):
     """
@@ -38,6 +62,10 @@ class DartdocDirective(SphinxDirective):
         [LinkN]: urlN
         ```
 
+    The :file: option may be omitted, in which case the symbol is looked up in
+    the index of all Dart files of the package. This only works if the name of
+    the symbol is unique within the package.
+
     We recommend documenting only one such symbol per page; however, it is
     possible to add extra content on the page after the {dartdoc} directive.
     Such content may include additional examples, see-also section, etc.
@@ -46,11 +74,10 @@ class DartdocDirective(SphinxDirective):
     required_arguments = 0
     optional_arguments = 0
     option_spec = {
-        "file": directives.unchanged_required,
+        "file": directives.unchanged,
         "symbol": directives.unchanged_required,
         "package": directives.unchanged,
     }
-
     def __init__(self, name, arguments, options, content, lineno, content_offset, block_text, state,
                  state_machine):
         super().__init__(name, arguments, options, content, lineno, content_offset, block_text,
@@ -60,6 +87,10 @@ class DartdocDirective(SphinxDirective):
         self.source_file = None
         self.symbol = None
         self.record = None
+        # Entry `(hash, offset, length)` for the symbol in the domain's table of files. The
+        # declaration itself is loaded from the declaration store only if it needs to be rendered.
+        self.entry = None
+        self.declaration = None
         # Explicit reference targets provided to the directive within its content. These are
         # references in double-square brackets.
         self.links: Dict[str, str] = {}
@@ -72,23 +103,94 @@ class DartdocDirective(SphinxDirective):
         # of these parameters can be mentioned in square brackets, which will be converted into a
         # special :param: role.
         self.param_set: Set[str] = set()
+        # Ids of all signature nodes generated for the current symbol, these are the targets that
+        # can be referenced from other documents.
+        self.anchors: List[str] = []
+        # Description containers that are waiting to be filled by `_parse_descriptions()`,
+        # together with the markdown text to be parsed into them.
+        self.pending_descriptions: List[Tuple[Element, str]] = []
+        # The arguments of `augment_comment()` that stay the same for all the descriptions
+        # within the directive.
+        self._augment_context: Optional[Tuple] = None
 
     def run(self):
         self.package = self._parse_option_package()
         self.root = self._get_root_from_config()
-        self.source_file = self._parse_option_file()
         self.symbol = self._parse_option_symbol()
+        if self.options.get('file'):
+            self.source_file = self._parse_option_file()
+        else:
+            self.source_file = self._find_source_file()
         self.record = self._get_data_record()
         self.links = self._parse_links()
-        self._scan_source_file_if_needed()
-        for member in self.record['json'].get('members', {}):
+        with span('dart_domain', f'dartdoc {self.package}:{self.symbol}', doc=self.env.docname,
+                  line=self.lineno):
+            self.entry = self._locate_symbol(self._get_file_data())
+            self.record['hash'] = self.entry[0]
+            result = self._render_with_cache()
+            self._register_anchors()
+        return [result]
+
+    def _render(self) -> Element:
+        self.declaration = self._extract_symbol()
+        for member in self.declaration.get('members', {}):
             self.member_set.add(member['name'])
         result = nodes.container(
             '',
-            self._generate_node_for_declaration(self.record['json'], 1),
+            self._generate_node_for_declaration(self.declaration, 1),
             classes=['dartdoc']
         )
-        return [result]
+        self._parse_descriptions()
+        return result
+
+    def _render_with_cache(self) -> Element:
+        """
+        Renders the current declaration, or restores its rendered tree from the render cache if
+        an identical declaration was rendered before with the same settings.
+
+        Descriptions that define document-level targets of their own (headings, labels,
+        footnotes, etc.) register them with the document while being parsed. These registrations
+        cannot be replayed from a cached tree, so such declarations are always rendered anew.
+        The same goes for declarations that produced warnings, so that the warnings are reported
+        by every build, and not only by the one that rendered the declaration first.
+        """
+        cache = self.env.get_domain('dart').render_cache
+        if cache is None:
+            return self._render()
+        key = cache.key(
+            self.record['hash'],
+            self.symbol,
+            json.dumps(self.links, sort_keys=True),
+            str(self.env.config.dartdoc_show_overrides),
+            str(getattr(self.env.config, 'myst_enable_extensions', '')),
+            sphinx.__version__,
+            docutils.__version__,
+            myst_parser.__version__,
+        )
+        entry = cache.get(key)
+        if entry is not None:
+            result, self.anchors, render_time = entry
+            self._restore_rendered(result)
+            cache.time_saved += render_time
+            return result
+        start_time = time.perf_counter()
+        with count_warnings() as warnings:
+            result = self._render()
+        render_time = time.perf_counter() - start_time
+        if not warnings.count and \
+                not any(node['names'] for node in result.findall(nodes.Element)):
+            cache.put(key, (result, self.anchors, render_time))
+        return result
+
+    def _restore_rendered(self, result: Element):
+        """
+        Re-applies to the current document the side effects of rendering the tree `result`.
+        """
+        for node in result.findall(pending_xref):
+            node['refdoc'] = self.env.docname
+        for node in result.findall(nodes.container):
+            if 'signature' in node['classes']:
+                self.state.document.note_explicit_target(node)
 
     def _parse_option_package(self) -> str:
         package = self.options['package']
@@ -119,6 +221,25 @@ class DartdocDirective(SphinxDirective):
             raise ValueError(f'Path `{path}` is not a file')
         return path
 
+    def _find_source_file(self) -> str:
+        """
+        Locates the file where `self.symbol` is declared, using the index of the whole package.
+        """
+        index = self.env.get_domain('dart').get_package_index(self.package, self.root)
+        files = index['symbols'].get(self.symbol, [])
+        if not files:
+            raise ValueError(
+                f'Symbol {self.symbol} was not found in package `{self.package}`; please '
+                f'check the name of the symbol, or specify the :file: option'
+            )
+        if len(files) > 1:
+            candidates = ', '.join(os.path.relpath(file, self.root) for file in files)
+            raise ValueError(
+                f'Symbol {self.symbol} is declared in several files of package '
+                f'`{self.package}` ({candidates}); please specify the :file: option'
+            )
+        return files[0]
+
     def _parse_option_symbol(self):
         symbol = self.options['symbol']
         if not re.fullmatch(r'[a-zA-Z_][a-zA-Z0-9_]*', symbol):
@@ -148,76 +269,76 @@ class DartdocDirective(SphinxDirective):
             objects[self.package] = {}
         if self.symbol not in objects[self.package]:
             objects[self.package][self.symbol] = {
-                'json': None,
                 'filename': self.source_file,
-                'timestamp': 0,
                 'docname': self.env.docname,
+                'anchors': [],
+                'hash': None,
             }
+        doc_data = self.env.domaindata['dart']['docs'].setdefault(
+            self.env.docname, {'symbols': [], 'files': []}
+        )
+        if (self.package, self.symbol) not in doc_data['symbols']:
+            doc_data['symbols'].append((self.package, self.symbol))
+        if self.source_file not in doc_data['files']:
+            doc_data['files'].append(self.source_file)
         return objects[self.package][self.symbol]
 
-    def _scan_source_file_if_needed(self):
-        last_scan_time = self.record['timestamp']
-        source_last_modified_time = os.path.getmtime(self.source_file)
-        if last_scan_time >= source_last_modified_time:
-            assert self.record['json']
-            return
-        json_result = self._scan_source_file()
-        self.record['json'] = json_result
-        self.record['timestamp'] = source_last_modified_time
-
-    def _scan_source_file(self):
-        with tempfile.NamedTemporaryFile(mode='rt', suffix='.json', delete=False) as temp_file:
-            # Note: on Windows, a temporary file cannot be opened in another
-            # process if it is already open in this process. Thus, we need to
-            # close the file handle first before handing the file name to
-            # `subprocess.run()`.
-            temp_file.close()
-            try:
-                executable = 'dartdoc_json'
-                if os.name == 'nt':  # Windows
-                    executable = 'dartdoc_json.bat'
-                subprocess.run(
-                    [executable, self.source_file, '--output', temp_file.name],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    check=True,
-                )
-                with open(temp_file.name, 'r') as t:
-                    json_string = t.read()
-                return self._extract_symbol(json_string)
-            except subprocess.CalledProcessError as e:
-                cmd = ' '.join(e.cmd)
-                raise RuntimeError(
-                    f'Command `{cmd}` returned with exit status'
-                    f' {e.returncode}\n{e.output.decode("utf-8")}'
-                )
-            finally:
-                os.remove(temp_file.name)
+    def _register_anchors(self):
+        """
+        Adds the anchors generated for the current symbol into the domain's cross-reference index.
+        """
+        xrefs = self.env.domaindata['dart']['xrefs']
+        self.record['anchors'] = self.anchors
+        for anchor in self.anchors:
+            xrefs[anchor] = (self.env.docname, anchor)
 
-    def _extract_symbol(self, json_string: str) -> Dict:
+    def _get_file_data(self) -> Dict:
         """
-        Locates the definition of `self.symbol` within the `json_string` output.
+        Returns the entry for `self.source_file` in the domain's table of files, re-scanning the
+        file if it was modified since the last time it was scanned.
         """
-        json_obj = json.loads(json_string)
-        if type(json_obj) != list or len(json_obj) != 1:
-            string = str(json_obj)
-            if len(string) > 100:
-                string = string[:97] + '...'
-            raise TypeError(
-                f'Invalid JSON output: a list of length 1 was expected, '
-                f'instead received `{string}`'
+        files = self.env.domaindata['dart']['files']
+        file_data = files.get(self.source_file)
+        domain = self.env.get_domain('dart')
+        source_last_modified_time = domain.get_mtime(self.source_file)
+        if file_data is None or file_data['timestamp'] < source_last_modified_time:
+            file_json = domain.extract_api_data([self.source_file])[self.source_file]
+            file_data = domain.store_file_data(
+                self.source_file, file_json, source_last_modified_time
             )
-        declared_symbols = []
-        for declaration in json_obj[0]['declarations']:
-            if declaration['name'] == self.symbol:
-                return declaration
-            declared_symbols.append(declaration['name'])
-        file = self.options['file']
+        return file_data
+
+    def _locate_symbol(self, file_data: Dict) -> Tuple[str, int, int]:
+        """
+        Locates the entry of `self.symbol` within the `file_data` entry.
+        """
+        symbols = file_data['symbols']
+        if self.symbol in symbols:
+            return symbols[self.symbol]
+        file = os.path.relpath(self.source_file, self.root)
         raise ValueError(
             f'Symbol {self.symbol} was not found in file {file}; available '
-            f'symbols were: {declared_symbols}'
+            f'symbols were: {list(symbols)}'
         )
 
+    def _extract_symbol(self) -> Dict:
+        """
+        Loads the definition of `self.symbol` from the declaration store. If the store does not
+        contain the expected declaration (for example, because it was deleted together with some
+        of the doctrees), the source file is scanned again.
+        """
+        domain = self.env.get_domain('dart')
+        declaration = domain.load_declaration(self.entry)
+        if declaration is None:
+            file_json = domain.extract_api_data([self.source_file])[self.source_file]
+            file_data = domain.store_file_data(
+                self.source_file, file_json, domain.get_mtime(self.source_file)
+            )
+            self.entry = self._locate_symbol(file_data)
+            self.record['hash'] = self.entry[0]
+            declaration = domain.load_declaration(self.entry)
+        return declaration
+
     # ----------------------------------------------------------------------------------------------
     # Generate documentation nodes
     # ----------------------------------------------------------------------------------------------
@@ -230,11 +351,12 @@ class DartdocDirective(SphinxDirective):
         kind = data['kind']
         result = nodes.container(classes=[kind])
         if kind in {'class', 'mixin', 'extension'}:
+            members = self._group_class_members(data)
             result += self._generate_class_signature_node(data, level)
             result += self._generate_description(data, level)
-            result += self._generate_constructors_section(data, level)
-            result += self._generate_properties_section(data, level)
-            result += self._generate_methods_section(data, level)
+            result += self._generate_constructors_section(members['constructors'], level)
+            result += self._generate_properties_section(members['properties'], level)
+            result += self._generate_methods_section(members['methods'], level)
         elif kind in {'constructor', 'method', 'function'}:
             for param in data.get('parameters', {}).get('all', []):
                 self.param_set.add(param['name'])
@@ -251,6 +373,7 @@ class DartdocDirective(SphinxDirective):
 
     def _generate_class_signature_node(self, data: Dict, level: int) -> Element:
         result = nodes.container(classes=['signature', f'sig{level}'], ids=[data['name']])
+        self.anchors.append(data['name'])
         first_line = nodes.container(
             '',  # rawsource
             nodes.inline(text=data['kind'] + ' ', classes=['keyword']),
@@ -282,6 +405,7 @@ class DartdocDirective(SphinxDirective):
         if level >= 2:
             node_id = f'{self.symbol}-{node_id}'
         result = nodes.container(classes=['signature', f'sig{level}'], ids=[node_id])
+        self.anchors.append(node_id)
         first_line = nodes.container()
         first_line += nodes.inline(text=data['name'], classes=['name'])
         first_line += self._generate_type_parameters_node(data)
@@ -329,6 +453,7 @@ class DartdocDirective(SphinxDirective):
         if level >= 2:
             node_id = f'{self.symbol}-{node_id}'
         result = nodes.container(classes=['signature', f'sig{level}'], ids=[node_id])
+        self.anchors.append(node_id)
         result += nodes.inline(text=data['name'], classes=['name'])
         if data['kind'] == 'field':
             arrow = ':'
@@ -366,15 +491,51 @@ class DartdocDirective(SphinxDirective):
         return result
 
     def _generate_description(self, data: Dict, level: int) -> Optional[Element]:
+        """
+        Creates the container for the description of `data`. The container is filled later by
+        `_parse_descriptions()`, which parses all descriptions of the symbol at once.
+        """
         if not data.get('description'):
             return None
-        lines = self._augment_comment(data['description']).split('\n')
+        text = self._augment_comment(data['description'])
         result = nodes.container(classes=['description', f'doc{level}'])
-        self.state.nested_parse(lines, 0, result)
+        self.pending_descriptions.append((result, text))
         return result
 
-    def _generate_constructors_section(self, data: Dict, level: int) -> Optional[Element]:
-        constructors = self._select_class_members(data, ['constructor'])
+    def _parse_descriptions(self):
+        """
+        Parses the markdown of all descriptions collected by `_generate_description()` in a single
+        MyST pass, and moves the results into their containers.
+
+        Each description is wrapped into its own {container} block, fenced with more backticks
+        than any code block within the description, so that the parsed output can be split back
+        into the individual descriptions afterwards. The empty options block at the start of each
+        container prevents MyST from interpreting the first lines of the description as options.
+        """
+        rx_backticks = re.compile(r'`{3,}')
+        lines = []
+        for i, (_, text) in enumerate(self.pending_descriptions):
+            longest_fence = max((len(m) for m in re.findall(rx_backticks, text)), default=2)
+            fence = '`' * (longest_fence + 1)
+            lines.append(f'{fence}{{container}}')
+            lines.append('---')
+            lines.append('---')
+            lines.extend(text.split('\n'))
+            lines.append(fence)
+            lines.append('')
+        batch = nodes.container()
+        self.state.nested_parse(lines, 0, batch)
+        if len(batch.children) == len(self.pending_descriptions):
+            for (container, _), parsed in zip(self.pending_descriptions, batch.children):
+                container.extend(parsed.children)
+        else:
+            # Some description has escaped its fence: fall back to parsing them one by one
+            for container, text in self.pending_descriptions:
+                self.state.nested_parse(text.split('\n'), 0, container)
+        self.pending_descriptions.clear()
+
+    def _generate_constructors_section(self, constructors: List[Dict], level: int) \
+            -> Optional[Element]:
         if not constructors:
             return None
         # A section needs an id, otherwise Sphinx breaks
@@ -384,8 +545,7 @@ class DartdocDirective(SphinxDirective):
             result += self._generate_node_for_declaration(constructor, level + 1)
         return result
 
-    def _generate_methods_section(self, data: Dict, level: int) -> Optional[Element]:
-        methods = self._select_class_members(data, ['method'])
+    def _generate_methods_section(self, methods: List[Dict], level: int) -> Optional[Element]:
         if not methods:
             return None
         # A section needs an id, otherwise Sphinx breaks
@@ -395,121 +555,680 @@ class DartdocDirective(SphinxDirective):
             result += self._generate_node_for_declaration(method, level + 1)
         return result
 
-    def _generate_properties_section(self, data: Dict, level: int) -> Optional[Element]:
-        fields = self._select_class_members(data, ['field', 'getter', 'setter'])
+    def _generate_properties_section(self, fields: List[Dict], level: int) -> Optional[Element]:
         if not fields:
             return None
-        for i, field in enumerate(fields):
-            if field is None:
-                continue
-            if field['kind'] == 'setter':
-                name = field['name']
-                for j, field2 in enumerate(fields):
-                    if field2 is None:
-                        continue
-                    if field2['kind'] == 'getter' and field2['name'] == name:
-                        fields[j]['has_setter'] = True
-                        fields[i] = None
         result = nodes.section(ids=['properties'])
         result += nodes.title(text='Properties')
-        for i, field in enumerate(fields):
-            if field is not None:
-                result += self._generate_node_for_declaration(field, level + 1)
+        for field in fields:
+            result += self._generate_node_for_declaration(field, level + 1)
         return result
 
-    def _select_class_members(self, data: Dict, kinds: List[str]) -> List[Dict]:
+    def _group_class_members(self, data: Dict) -> Dict[str, List[Dict]]:
         """
         Given the JSON object [data] which describes a single Dart object such
-        as class/mixin/etc, this method returns all entries in `data.members`
-        whose "kind" property is among the provided [kinds].
+        as class/mixin/etc, this method splits the entries in `data.members`
+        into 'constructors', 'properties' and 'methods', in a single pass.
+
+        Overrides are skipped unless `dartdoc_show_overrides` is set. Among
+        the properties, a setter that has a matching getter is merged into
+        that getter, which is marked with the `has_setter` flag.
         """
         filter_overrides = not self.env.config.dartdoc_show_overrides
-        result = []
+        groups: Dict[str, List[Dict]] = {'constructors': [], 'properties': [], 'methods': []}
+        getter_names = set()
+        setter_names = set()
         for entry in data.get('members', []):
-            if entry['kind'] not in kinds:
+            kind = entry['kind']
+            if filter_overrides and any(
+                annotation['name'] == '@override'
+                for annotation in entry.get('annotations', [])
+            ):
                 continue
-            if filter_overrides:
-                annotations = [
-                    annotation['name']
-                    for annotation in entry.get('annotations', [])
-                ]
-                if '@override' in annotations:
-                    continue
-            result.append(entry)
-        return result
+            if kind == 'constructor':
+                groups['constructors'].append(entry)
+            elif kind == 'method':
+                groups['methods'].append(entry)
+            elif kind in {'field', 'getter', 'setter'}:
+                groups['properties'].append(entry)
+                if kind == 'getter':
+                    getter_names.add(entry['name'])
+                elif kind == 'setter':
+                    setter_names.add(entry['name'])
+        paired_names = getter_names & setter_names
+        if paired_names:
+            groups['properties'] = [
+                dict(entry, has_setter=True)
+                if entry['kind'] == 'getter' and entry['name'] in paired_names
+                else entry
+                for entry in groups['properties']
+                if entry['name'] not in paired_names or entry['kind'] != 'setter'
+            ]
+        return groups
 
     def _augment_comment(self, text: str) -> str:
-        rx_escape = re.compile(r'([<>`*])')
+        """
+        Converts the references in square brackets within the doc comment `text` into markdown
+        links and roles, see `augment_comment()`.
+        """
+        if self._augment_context is None:
+            self._augment_context = (
+                self.symbol,
+                frozenset(self.member_set),
+                tuple(sorted(self.links.items())),
+            )
+        try:
+            return augment_comment(text, frozenset(self.param_set), *self._augment_context)
+        except UnknownLinkError as e:
+            raise self.error(
+                f'Unexpected link {e.args[0]}, please specify its target URL within the '
+                f'content section of the directive.'
+            )
 
-        def escape(text: str) -> str:
-            return re.sub(rx_escape, r'\\\1', text)
 
-        def count(char, text, j):
-            n = 0
-            while j < len(text):
-                if text[j] == char:
-                    n += 1
-                else:
-                    break
-                j += 1
-            return n
-
-        parts: List[str] = []
-        i = 0
-        i0 = 0
-        while i < len(text):
-            ch = text[i]
-            if ch == '`':
-                # Skip any backtick-escaped text
-                num_backticks = count('`', text, i)
-                i += num_backticks
-                assert num_backticks > 0
-                while i < len(text):
-                    if count('`', text, i) >= num_backticks:
-                        i += num_backticks
-                        break
-                    i += 1
-            elif ch == '[':
-                parts.append(text[i0:i])
-                num_brackets = count('[', text, i)
-                i += num_brackets
-                assert num_brackets > 0
-                start = i
-                while i < len(text):
-                    if count(']', text, i) >= num_brackets:
-                        i += num_brackets
-                        break
-                    i += 1
-                target = text[start:i - num_brackets]
-                i0 = i
-                if num_brackets >= 2:
-                    # Links of the form `[[NAME]]` are converted into `[NAME](URL)`. The
-                    # `NAME` must be listed beforehand within the directive's content.
-                    if target in self.links:
-                        url = self.links[target]
-                        parts.append(f'[{escape(target)}]({url})')
-                    else:
-                        raise self.error(
-                            f'Unexpected link {target}, please specify its '
-                            f'target URL within the content section of the '
-                            f'directive.'
-                        )
-                else:
-                    # Links of the form `[NAME]` are converted into "{ref}`NAME`", so that
-                    # they can be resolved later by the domain.
-                    if target in self.param_set:
-                        parts.append(f'{{param}}`{target}`')
-                    elif target in self.member_set:
-                        parts.append(f'{{ref}}`{target} <{self.symbol}-{target}>`')
-                    elif target in self.links:
-                        url = self.links[target]
-                        parts.append(f'[{escape(target)}]({url})')
-                    else:
-                        parts.append(f'{{ref}}`{escape(target)}`')
+class UnknownLinkError(KeyError):
+    """
+    A doc comment has a `[[NAME]]` link, but the directive does not define the URL for `NAME`.
+    """
+
+
+@functools.lru_cache(maxsize=4096)
+def augment_comment(text: str, params: FrozenSet[str], symbol: str, members: FrozenSet[str],
+                    links: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Converts the references in square brackets within the doc comment `text` into markdown
+    links and roles, given the names known within a {dartdoc} directive: the `params` of the
+    commented declaration, the `symbol` being documented and its `members`, and the `links`
+    listed in the directive's content. The result is memoised, so that descriptions that
+    repeat (for example, inherited docs) are converted only once.
+    """
+    link_urls = dict(links)
+    parts: List[str] = []
+    for num_brackets, target in tokenize_comment(text):
+        if num_brackets == 0:
+            parts.append(target)
+        elif num_brackets >= 2:
+            # Links of the form `[[NAME]]` are converted into `[NAME](URL)`. The
+            # `NAME` must be listed beforehand within the directive's content.
+            if target in link_urls:
+                url = link_urls[target]
+                parts.append(f'[{escape_markdown(target)}]({url})')
             else:
-                i += 1
-        parts.append(text[i0:])
-        return ''.join(parts)
+                raise UnknownLinkError(target)
+        else:
+            # Links of the form `[NAME]` are converted into "{ref}`NAME`", so that
+            # they can be resolved later by the domain.
+            if target in params:
+                parts.append(f'{{param}}`{target}`')
+            elif target in members:
+                parts.append(f'{{ref}}`{target} <{symbol}-{target}>`')
+            elif target in link_urls:
+                url = link_urls[target]
+                parts.append(f'[{escape_markdown(target)}]({url})')
+            else:
+                parts.append(f'{{ref}}`{escape_markdown(target)}`')
+    return ''.join(parts)
+
+
+rx_comment_special = re.compile(r'[`\[]')
+rx_backticks = re.compile(r'`+')
+rx_brackets = re.compile(r'\[+')
+rx_markdown_escape = re.compile(r'([<>`*])')
+
+
+def escape_markdown(text: str) -> str:
+    return rx_markdown_escape.sub(r'\\\1', text)
+
+
+@functools.lru_cache(maxsize=4096)
+def tokenize_comment(text: str) -> Tuple[Tuple[int, str], ...]:
+    """
+    Splits the doc comment `text` into plain text and references in square brackets, skipping
+    over code spans in backticks. Returns a tuple of `(num_brackets, text)` pairs, where
+    `num_brackets` is 0 for plain text, 1 for `[NAME]` references, and 2 or more for `[[NAME]]`
+    links.
+
+    A code span or reference that is not terminated extends until the end of the text.
+    """
+    tokens = []
+    i = 0
+    i0 = 0
+    while True:
+        match = rx_comment_special.search(text, i)
+        if match is None:
+            break
+        i = match.start()
+        if text[i] == '`':
+            num_backticks = rx_backticks.match(text, i).end() - i
+            end = text.find('`' * num_backticks, i + num_backticks)
+            if end < 0:
+                break
+            i = end + num_backticks
+        else:
+            tokens.append((0, text[i0:i]))
+            num_brackets = rx_brackets.match(text, i).end() - i
+            start = i + num_brackets
+            end = text.find(']' * num_brackets, start)
+            if end < 0:
+                # The closing brackets are assumed to be at the end of the text
+                tokens.append((num_brackets, text[start:len(text) - num_brackets]))
+                i0 = len(text)
+                break
+            i = end + num_brackets
+            tokens.append((num_brackets, text[start:end]))
+            i0 = i
+    tokens.append((0, text[i0:]))
+    return tuple(tokens)
+
+
+# Longest command line for running `dartdoc_json`, in characters. On Windows the tool is a batch
+# file, and the command line of a batch file cannot exceed 8191 characters.
+MAX_COMMAND_LENGTH = 8000
+
+
+def run_dartdoc_json(files: List[str]) -> Dict[str, Dict]:
+    """
+    Extracts the API data from all the given Dart `files` with as few invocations of the
+    `dartdoc_json` tool as the limit on the length of the command line allows. The output is
+    received via a pipe, and returned as a dictionary keyed by the file name.
+    """
+    executable = 'dartdoc_json'
+    if os.name == 'nt':  # Windows
+        executable = 'dartdoc_json.bat'
+    result = {}
+    for chunk in split_command_line(files, MAX_COMMAND_LENGTH - len(executable)):
+        try:
+            with span('dart_domain', 'dartdoc_json', subprocess=True, files=len(chunk)):
+                process = subprocess.run(
+                    [executable, *chunk],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=True,
+                )
+        except subprocess.CalledProcessError as e:
+            cmd = ' '.join(e.cmd)
+            raise RuntimeError(
+                f'Command `{cmd}` returned with exit status'
+                f' {e.returncode}\n{e.stderr.decode("utf-8")}'
+            )
+        result.update(match_dartdoc_json_output(chunk, json.loads(process.stdout)))
+    return result
+
+
+def split_command_line(args: List[str], max_length: int) -> List[List[str]]:
+    """
+    Splits the `args` into consecutive chunks, such that each chunk fits into `max_length`
+    characters when the arguments are separated (and possibly quoted) on a command line. An
+    argument that is longer than `max_length` by itself forms a chunk of its own.
+    """
+    chunks = []
+    chunk: List[str] = []
+    length = 0
+    for arg in args:
+        # A separating space and a pair of quotes
+        arg_length = len(arg) + 3
+        if chunk and length + arg_length > max_length:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(arg)
+        length += arg_length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def run_dartdoc_json_parallel(files: List[str], jobs: int) -> Dict[str, Dict]:
+    """
+    Same as `run_dartdoc_json()`, but the `files` are split between up to `jobs` processes that
+    run concurrently.
+    """
+    n_chunks = max(1, min(jobs, len(files)))
+    if n_chunks == 1:
+        return run_dartdoc_json(files)
+    chunks = [files[i::n_chunks] for i in range(n_chunks)]
+    result = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_chunks) as executor:
+        for chunk_result in executor.map(run_dartdoc_json, chunks):
+            result.update(chunk_result)
+    return result
+
+
+def match_dartdoc_json_output(files: List[str], json_obj: Any) -> Dict[str, Dict]:
+    """
+    Validates the `dartdoc_json` output `json_obj` produced for the given `files`, and returns
+    it as a dictionary keyed by the file name.
+    """
+    if type(json_obj) != list or len(json_obj) != len(files):
+        string = str(json_obj)
+        if len(string) > 100:
+            string = string[:97] + '...'
+        raise TypeError(
+            f'Invalid JSON output: a list of length {len(files)} was expected, '
+            f'instead received `{string}`'
+        )
+    by_source = {}
+    for entry in json_obj:
+        if type(entry) != dict or 'source' not in entry:
+            raise TypeError('Invalid JSON output: an entry without the `source` file was received')
+        by_source[os.path.abspath(entry['source'])] = entry
+    missing = [file for file in files if file not in by_source]
+    if missing:
+        raise TypeError(f'Invalid JSON output: no entry for the file `{missing[0]}`')
+    return {file: by_source[file] for file in files}
+
+
+def get_dartdoc_json_version() -> str:
+    """
+    Returns a string that identifies the installed version of `dartdoc_json`. If the tool cannot
+    report its version, then the location and modification time of the executable are used as a
+    substitute.
+    """
+    executable = 'dartdoc_json'
+    if os.name == 'nt':  # Windows
+        executable = 'dartdoc_json.bat'
+    try:
+        process = subprocess.run(
+            [executable, '--version'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=True,
+        )
+        return process.stdout.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        path = shutil.which(executable)
+        if path is None:
+            return 'unknown'
+        return f'{path}@{os.path.getmtime(path)}'
+
+
+class DiskCache(abc.ABC):
+    """
+    Persistent on-disk key-value cache, where each entry is stored in its own file.
+
+    The cache does not depend on Sphinx's environment: it survives `make clean` and `-E` builds,
+    and can be shared between CI jobs. The total size of the cache is bounded, with the least
+    recently used entries evicted first.
+    """
+    suffix = ''
+    binary = False
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, count: bool = True) -> Optional[Any]:
+        """
+        Returns the value stored under `key`, or None. If `count` is False, the lookup is not
+        included in the hit/miss statistics.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb' if self.binary else 'rt') as f:
+                value = self._load(f)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            self.misses += count
+            return None
+        try:
+            # Touch the entry, so that its modification time reflects the last use
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            self.misses += count
+            return None
+        self.hits += count
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb' if self.binary else 'wt') as f:
+            self._dump(value, f)
+        os.replace(temp_path, path)
+
+    def lock(self, key: str) -> FileLock:
+        """
+        Returns the lock that guards the creation of the entry `key` across processes.
+        """
+        return FileLock(self._path(key) + '.lock')
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits within `max_size`.
+        """
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.lock'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # removed by another process
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            total_size -= size
+
+    @abc.abstractmethod
+    def _load(self, f) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def _dump(self, value: Any, f) -> None:
+        ...
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+
+class DartdocCache(DiskCache):
+    """
+    Cache for the output of `dartdoc_json`.
+
+    Each entry holds the API data of a single Dart file, and is keyed by the SHA-256 of the file's
+    content together with the version of the tool.
+    """
+    suffix = '.json'
+
+    def __init__(self, directory: str, max_size: int):
+        super().__init__(directory, max_size)
+        self._version: Optional[str] = None
+
+    def key(self, filename: str) -> str:
+        if self._version is None:
+            self._version = get_dartdoc_json_version()
+        sha = hashlib.sha256(self._version.encode('utf-8'))
+        with open(filename, 'rb') as f:
+            sha.update(f.read())
+        return sha.hexdigest()
+
+    def _load(self, f) -> Dict:
+        return json.load(f)
+
+    def _dump(self, value: Dict, f) -> None:
+        json.dump(value, f)
+
+
+class RenderCache(DiskCache):
+    """
+    Cache for the docutils trees generated by the {dartdoc} directive.
+
+    Each entry holds the rendered tree of a single symbol together with its anchors, and is keyed
+    by everything that the rendering depends upon: the digest of the declaration, the directive's
+    link table, the relevant configuration, and the version of this extension. The time that it
+    took to render an entry originally is stored too, so that the time saved by the cache can be
+    reported.
+    """
+    suffix = '.pickle'
+    binary = True
+
+    def __init__(self, directory: str, max_size: int):
+        super().__init__(directory, max_size)
+        self.time_saved = 0.0
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        sha = hashlib.sha256(EXTENSION_DIGEST.encode('utf-8'))
+        for part in parts:
+            sha.update(b'\0' + part.encode('utf-8'))
+        return sha.hexdigest()
+
+    def _load(self, f) -> Tuple[Element, List[str], float]:
+        return pickle.load(f)
+
+    def _dump(self, value: Tuple[Element, List[str], float], f) -> None:
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+
+
+class WarningCounter(logging.Handler):
+    """
+    Logging handler that counts the warnings logged by Sphinx and its extensions.
+    """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.count += 1
+
+
+@contextlib.contextmanager
+def count_warnings():
+    """
+    Counts the warnings logged within the context, including those of docutils' reporter.
+    """
+    counter = WarningCounter()
+    sphinx_logger = logging.getLogger(sphinx_logging.NAMESPACE)
+    sphinx_logger.addHandler(counter)
+    try:
+        yield counter
+    finally:
+        sphinx_logger.removeHandler(counter)
+
+
+class DeclarationStore:
+    """
+    Append-only file with the API data of all scanned declarations, kept next to the pickled
+    environment. The domain data holds only the position of each declaration within this file,
+    so that the environment stays small no matter how large the API is, and the declarations are
+    read (through a memory map) only by the directives that actually need to render them.
+
+    Readers running in parallel processes append to the same file: each write is a single
+    `O_APPEND` write, and so it never interleaves with the writes of other processes.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+
+    def append(self, payload: bytes) -> int:
+        """
+        Appends `payload` at the end of the store, and returns its offset within the file.
+        """
+        if self._pid != os.getpid():
+            # The file offset of a descriptor inherited from the parent process is shared with
+            # the parent, so each process needs to open the file on its own.
+            self._fd = os.open(
+                self.filename,
+                os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0),
+                0o644,
+            )
+            self._pid = os.getpid()
+        written = os.write(self._fd, payload)
+        if written != len(payload):
+            raise OSError(f'Short write to `{self.filename}`')
+        return os.lseek(self._fd, 0, os.SEEK_CUR) - len(payload)
+
+    def read(self, offset: int, length: int) -> Optional[bytes]:
+        """
+        Returns the `length` bytes at `offset`, or None if the store is shorter than that.
+        """
+        end = offset + length
+        if offset < 0:
+            return None
+        if self._map is None or len(self._map) < end:
+            self._remap()
+            if self._map is None or len(self._map) < end:
+                return None
+        return self._map[offset:end]
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return 0
+
+    def reset(self) -> None:
+        """
+        Removes all declarations from the store.
+        """
+        self.close()
+        with open(self.filename, 'wb'):
+            pass
+
+    def compact(self, entries: Set[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+        """
+        Rewrites the store so that it only contains the given `(offset, length)` entries, and
+        returns the new offset of each entry.
+        """
+        result = {}
+        temp_file = f'{self.filename}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as f:
+            for offset, length in sorted(entries):
+                payload = self.read(offset, length)
+                if payload is None:
+                    continue
+                result[(offset, length)] = f.tell()
+                f.write(payload)
+        self.close()
+        os.replace(temp_file, self.filename)
+        return result
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._pid = None
+
+    def _remap(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self.size() == 0:
+            return  # empty files cannot be mapped
+        with open(self.filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def encode_declaration(declaration: Dict) -> bytes:
+    """
+    Returns the canonical JSON encoding of the API data of a single declaration. The digest of
+    this encoding changes only when the declaration itself changes.
+    """
+    return json.dumps(declaration, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def list_dart_files(root: str) -> List[str]:
+    """
+    Returns the absolute paths of all Dart files within the directory `root`, in sorted order.
+    """
+    result = []
+    for directory, subdirs, files in os.walk(os.path.abspath(os.path.expanduser(root))):
+        subdirs[:] = sorted(subdir for subdir in subdirs if not subdir.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.dart'):
+                result.append(os.path.join(directory, name))
+    return result
+
+
+def hash_file(filename: str) -> str:
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def find_dartdoc_directives(filename: str) -> List[Dict[str, str]]:
+    """
+    Returns the options of all {dartdoc} directives found in the markdown file `filename`. This
+    is a quick textual scan, which allows us to know which Dart files will be needed before the
+    document is actually parsed.
+    """
+    rx_directive_start = re.compile(r'\s*(`{3,}|~{3,})\{dartdoc\}\s*')
+    rx_option = re.compile(r'\s*:(\w+):\s*(.*?)\s*')
+    result = []
+    options = None
+    with open(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if options is not None:
+                match = re.fullmatch(rx_option, line)
+                if match:
+                    options[match.group(1)] = match.group(2)
+                    continue
+                result.append(options)
+                options = None
+            if re.fullmatch(rx_directive_start, line):
+                options = {}
+    if options is not None:
+        result.append(options)
+    return result
+
+
+def prefetch_source_files(env: BuildEnvironment, docnames: List[str]) -> None:
+    """
+    Extracts the API data for all Dart files referenced by the documents `docnames`, using a
+    single `dartdoc_json` process. The results are stored in the domain's table of files, where
+    the directives will look them up instead of running the tool on their own. Files that are
+    present in the persistent cache are not extracted at all.
+
+    The indices of the packages are brought up to date here as well: those of all packages that
+    were indexed before, or whose symbols are documented without the :file: option, or all of
+    them if `dartdoc_external_url` is configured.
+    """
+    roots = env.config.dartdoc_roots
+    data = env.domaindata['dart']
+    default_package = data['default_package']
+    domain = env.get_domain('dart')
+    files = {}
+    packages = set(data['packages'])
+    if env.config.dartdoc_external_url:
+        packages.update(roots)
+    for docname in docnames:
+        filename = env.doc2path(docname)
+        if not filename.endswith('.md'):
+            continue
+        for options in find_dartdoc_directives(filename):
+            package = options.get('package') or default_package
+            root = roots.get(package) if package else env.config.dartdoc_root
+            if root is None:
+                continue
+            if not options.get('file'):
+                packages.add(package)
+                continue
+            path = os.path.abspath(os.path.expanduser(os.path.join(root, options['file'])))
+            if path not in files and os.path.isfile(path):
+                files[path] = domain.get_mtime(path)
+    for package in sorted(packages):
+        root = roots.get(package) if package else env.config.dartdoc_root
+        if root:
+            domain.get_package_index(package, root)
+    files_table = data['files']
+    files = {
+        path: mtime
+        for path, mtime in files.items()
+        if path not in files_table or files_table[path]['timestamp'] < mtime
+    }
+    if not files:
+        return
+    for path, file_json in domain.extract_api_data(list(files)).items():
+        domain.store_file_data(path, file_json, files[path])
+
+
+def copy_asset_files(app, exc):
+    assert __file__.endswith('dart_domain.py')
+    css_file = __file__[:-2] + 'css'
+    if not os.path.isfile(css_file):
+        raise FileNotFoundError(f'Missing file `{css_file}`')
+    if app.builder.format == 'html' and not exc:
+        static_dir = os.path.join(app.builder.outdir, '_static')
+        copy_asset_file(css_file, static_dir)
 
 
 def ParamRole(name: str, rawtext: str, text: str, lineno: int, inliner: Inliner,
@@ -540,26 +1259,278 @@ class DartDomain(Domain):
             # package: str
             # -> symbol: str
             #    -> object_data: Dict = {
-            #         'json': Dict,  # object's raw API data, in JSON format
-            #         'source': str,  # file name where the API data came from
-            #         'timestamp': float,  # last modified time of [source]
+            #         'filename': str,  # file name where the API data came from
             #         'docname': str,  # doc where the symbol is documented
+            #         'anchors': List[str],  # ids of the symbol and its members
+            #         'hash': str,  # digest of the declaration that was rendered
             #       }
         },
+        # Flat index of all reference targets: the ids of symbols and their
+        # members (`Symbol-member`). This allows resolving references in
+        # constant time.
+        'xrefs': {
+            # target: str -> (docname: str, anchor: str)
+        },
+        # Dictionary of all Dart files that were scanned, keyed by the file
+        # name. Each file is scanned only once per version, no matter how many
+        # symbols are documented from it. The declarations themselves are kept
+        # outside of the environment, in the `DeclarationStore`.
+        'files': {
+            # filename: str
+            # -> file_data: Dict = {
+            #      'timestamp': float,  # last modified time of the file when scanned
+            #      'symbols': Dict[str, Tuple[str, int, int]],  # symbol name ->
+            #                 (digest, offset, length) of its declaration in the store
+            #      'kinds': Dict[str, str],  # symbol name -> kind of its declaration
+            #    }
+        },
         # Dictionary that provides for each document name the references to
         # all objects that are declared within that document.
         'docs': {
             # docname: str
             # -> doc_data: Dict = {
-            #   'symbols': List[str], # names of symbols documented on the page
-            #   'package': str  # package declared for that page
+            #   'symbols': List[Tuple[str, str]], # (package, symbol) documented on the page
+            #   'files': List[str],  # Dart files the page's symbols come from
             # }
         },
+        # Index of all symbols declared within each package, built on demand
+        # from all Dart files under the package's root. The API data of all
+        # these files is kept in the table of files above.
+        'packages': {
+            # package: str
+            # -> index: Dict = {
+            #      'root': str,  # root directory of the package
+            #      'timestamp': float,  # time when the index was built
+            #      'files': Dict[str, str],  # Dart file -> digest of its content
+            #      'symbols': Dict[str, List[str]],  # symbol name -> Dart files
+            #    }
+        },
         # The name of the package that should be used if a directive does not
         # specify any.
         'default_package': '',
     }
-    data_version = 1
+    data_version = 9
+
+    def __init__(self, env: BuildEnvironment):
+        super().__init__(env)
+        self._cache: Optional[DartdocCache] = None
+        self._render_cache: Optional[RenderCache] = None
+        self._store: Optional[DeclarationStore] = None
+        self._mtimes: Dict[str, Optional[float]] = {}
+        # Packages whose index was brought up to date during the current build
+        self._indexed: Set[str] = set()
+
+    @property
+    def cache(self) -> Optional[DartdocCache]:
+        """
+        The persistent cache of `dartdoc_json` output, or None if the cache was disabled by
+        setting `dartdoc_cache_dir` to an empty string.
+        """
+        if self._cache is None and self.env.config.dartdoc_cache_dir:
+            self._cache = DartdocCache(
+                directory=os.path.join(self.env.config.dartdoc_cache_dir, 'json'),
+                max_size=self.env.config.dartdoc_cache_size,
+            )
+        return self._cache
+
+    @property
+    def render_cache(self) -> Optional[RenderCache]:
+        """
+        The persistent cache of rendered {dartdoc} trees, or None if the cache was disabled. The
+        rendered trees depend on the project (such as the links between its documents), so
+        unlike the cache of `dartdoc_json` output this cache is kept in the doctrees directory.
+        """
+        if self._render_cache is None and self.env.config.dartdoc_cache_dir:
+            self._render_cache = RenderCache(
+                directory=os.path.join(self.env.doctreedir, 'dartdoc-render'),
+                max_size=self.env.config.dartdoc_cache_size,
+            )
+        return self._render_cache
+
+    @property
+    def store(self) -> DeclarationStore:
+        """
+        The store of raw API data for all declarations in the table of files.
+        """
+        if self._store is None:
+            self._store = DeclarationStore(
+                os.path.join(self.env.doctreedir, 'dartdoc-declarations.bin')
+            )
+        return self._store
+
+    def get_mtime(self, filename: str) -> Optional[float]:
+        """
+        Returns the modification time of `filename`, or None if the file does not exist. The
+        result is memoised for the duration of the build, so that each file is checked only
+        once.
+        """
+        if filename not in self._mtimes:
+            try:
+                self._mtimes[filename] = os.path.getmtime(filename)
+            except OSError:
+                self._mtimes[filename] = None
+        return self._mtimes[filename]
+
+    def extract_api_data(self, files: List[str]) -> Dict[str, Dict]:
+        """
+        Returns the API data for each of the Dart `files`, taking them from the cache when
+        possible, and running `dartdoc_json` for the rest.
+        """
+        result = {}
+        keys = {}
+        missing = []
+        for file in files:
+            if self.cache:
+                keys[file] = self.cache.key(file)
+                file_json = self.cache.get(keys[file])
+                if file_json is not None:
+                    result[file] = file_json
+                    continue
+            missing.append(file)
+        with contextlib.ExitStack() as locks:
+            if self.cache and missing:
+                # In a parallel build, other reader processes may be extracting the same files
+                # right now. Only one process extracts each file version, while the others wait
+                # for the lock and then take the result from the cache. The locks are always
+                # taken in the same order, so that processes cannot deadlock.
+                for key in sorted({keys[file] for file in missing}):
+                    locks.enter_context(self.cache.lock(key))
+                waited_for = missing
+                missing = []
+                for file in waited_for:
+                    file_json = self.cache.get(keys[file], count=False)
+                    if file_json is None:
+                        missing.append(file)
+                    else:
+                        result[file] = file_json
+            if missing:
+                logger.info(f'extracting API data from {len(missing)} Dart files...')
+                extracted = run_dartdoc_json_parallel(missing, self.env.config.dartdoc_jobs)
+                for file, file_json in extracted.items():
+                    if self.cache:
+                        self.cache.put(keys[file], file_json)
+                    result[file] = file_json
+        return result
+
+    def get_package_index(self, package: str, root: str) -> Dict:
+        """
+        Returns the index of all symbols declared in the Dart files under `root`. The index is
+        built on first use, and then refreshed once per build: only the files whose content has
+        changed since the last build are scanned again.
+        """
+        index = self.data['packages'].get(package)
+        if package in self._indexed and index is not None:
+            return index
+        if index is None or index['root'] != root:
+            index = {'root': root, 'files': {}, 'symbols': {}}
+        files_table = self.data['files']
+        hashes = {}
+        touched_files = {}
+        for path in list_dart_files(root):
+            mtime = self.get_mtime(path)
+            file_data = files_table.get(path)
+            if file_data is not None and file_data['timestamp'] >= mtime and \
+                    path in index['files']:
+                hashes[path] = index['files'][path]
+                continue
+            hashes[path] = hash_file(path)
+            if file_data is not None and index['files'].get(path) == hashes[path]:
+                file_data['timestamp'] = mtime  # the file was touched, but not modified
+            else:
+                touched_files[path] = mtime
+        if touched_files:
+            with span('dart_domain', f'index package {package}'):
+                extracted = self.extract_api_data(list(touched_files))
+            for path, file_json in extracted.items():
+                self.store_file_data(path, file_json, touched_files[path])
+        symbols: Dict[str, List[str]] = {}
+        for path in hashes:
+            for name in files_table[path]['symbols']:
+                symbols.setdefault(name, []).append(path)
+        index = {'root': root, 'timestamp': time.time(), 'files': hashes, 'symbols': symbols}
+        self.data['packages'][package] = index
+        self._indexed.add(package)
+        return index
+
+    def store_file_data(self, filename: str, file_json: Dict, timestamp: float) -> Dict:
+        """
+        Saves the `dartdoc_json` output for a single file into the declaration store, and
+        updates the entry for the file in the domain's table of files.
+        """
+        payloads = {}
+        kinds = {}
+        for declaration in file_json['declarations']:
+            if declaration['name'] not in payloads:
+                payloads[declaration['name']] = encode_declaration(declaration)
+                kinds[declaration['name']] = declaration['kind']
+        offset = self.store.append(b''.join(payloads.values()))
+        symbols = {}
+        for name, payload in payloads.items():
+            symbols[name] = (hashlib.sha1(payload).hexdigest(), offset, len(payload))
+            offset += len(payload)
+        file_data = {'timestamp': timestamp, 'symbols': symbols, 'kinds': kinds}
+        self.data['files'][filename] = file_data
+        return file_data
+
+    def load_declaration(self, entry: Tuple[str, int, int]) -> Optional[Dict]:
+        """
+        Returns the declaration for the `entry` in the table of files, or None if the store does
+        not contain it.
+        """
+        digest, offset, length = entry
+        payload = self.store.read(offset, length)
+        if payload is None or hashlib.sha1(payload).hexdigest() != digest:
+            return None
+        return json.loads(payload)
+
+    def compact_store(self) -> None:
+        """
+        Rewrites the declaration store without the declarations that are no longer referenced
+        from the table of files, once they take up more space than the referenced ones.
+        """
+        entries = {
+            (offset, length)
+            for file_data in self.data['files'].values()
+            for _, offset, length in file_data['symbols'].values()
+        }
+        live_size = sum(length for _, length in entries)
+        if self.store.size() <= 2 * live_size:
+            return
+        offsets = self.store.compact(entries)
+        for file_data in self.data['files'].values():
+            file_data['symbols'] = {
+                name: (digest, offsets.get((offset, length), -1), length)
+                for name, (digest, offset, length) in file_data['symbols'].items()
+            }
+
+    def purge_deleted_files(self) -> None:
+        """
+        Removes the Dart files that no longer exist from the table of files and from the
+        package indices, so that no symbol can be resolved to them anymore.
+        """
+        deleted = {
+            filename
+            for filename in self.data['files']
+            if self.get_mtime(filename) is None
+        }
+        for index in self.data['packages'].values():
+            deleted.update(path for path in index['files'] if self.get_mtime(path) is None)
+        if not deleted:
+            return
+        for filename in deleted:
+            self.data['files'].pop(filename, None)
+        for index in self.data['packages'].values():
+            index['files'] = {
+                path: digest
+                for path, digest in index['files'].items()
+                if path not in deleted
+            }
+            symbols = {}
+            for name, paths in index['symbols'].items():
+                paths = [path for path in paths if path not in deleted]
+                if paths:
+                    symbols[name] = paths
+            index['symbols'] = symbols
 
     def merge_domaindata(self, docnames: List[str], other_data: Dict) -> None:
         for package, package_data in other_data['objects'].items():
@@ -568,47 +1539,103 @@ class DartDomain(Domain):
                     if package not in self.data['objects']:
                         self.data['objects'][package] = {}
                     self.data['objects'][package][symbol] = object_data
+                    for anchor in object_data['anchors']:
+                        self.data['xrefs'][anchor] = (object_data['docname'], anchor)
         for docname, doc_data in other_data['docs'].items():
             if docname in docnames:
                 self.data['docs'][docname] = doc_data
+        for filename, file_data in other_data['files'].items():
+            own_data = self.data['files'].get(filename)
+            if own_data is None or own_data['timestamp'] < file_data['timestamp']:
+                self.data['files'][filename] = file_data
+        for package, index in other_data['packages'].items():
+            own_index = self.data['packages'].get(package)
+            if own_index is None or own_index['timestamp'] < index['timestamp']:
+                self.data['packages'][package] = index
 
     def resolve_any_xref(self, env: BuildEnvironment, fromdocname: str, builder: Builder,
                          target: str, node: pending_xref, contnode: Element) \
             -> List[Tuple[str, Element]]:
-        return []
+        refnode = self.resolve_xref(env, fromdocname, builder, 'ref', target, node, contnode)
+        if refnode is None:
+            return []
+        return [('dart:ref', refnode)]
 
     def resolve_xref(self, env: BuildEnvironment, fromdocname: str, builder: Builder,
                      typ: str, target: str, node: pending_xref, contnode: Element
                      ) \
             -> Optional[Element]:
-        target_id = target
-        if '-' in target:
-            target, suffix = target.split('-', 2)
-        symbol_data = None
-        for package, package_data in self.data['objects'].items():
-            if target in package_data:
-                symbol_data = package_data[target]
-                break
-        if not symbol_data:
-            return None
+        xrefs = self.data['xrefs']
+        entry = xrefs.get(target)
+        if entry is None and '-' in target:
+            # A member that was not rendered on the page (such as an override), link to the
+            # page of its owner.
+            owner = xrefs.get(target.split('-', 1)[0])
+            if owner is not None:
+                entry = (owner[0], target)
+        if entry is None:
+            return self._resolve_external_xref(target, contnode)
+        docname, anchor = entry
         return make_refnode(
             builder=builder,
             fromdocname=fromdocname,
-            todocname=symbol_data['docname'],
-            targetid=target_id,
+            todocname=docname,
+            targetid=anchor,
             child=contnode,
             title=None,
         )
 
+    def _resolve_external_xref(self, target: str, contnode: Element) -> Optional[Element]:
+        """
+        Resolves a reference to a symbol that is not documented on any page, but is declared in
+        one of the indexed packages, into a link built from the `dartdoc_external_url` template.
+        """
+        url_template = self.env.config.dartdoc_external_url
+        if not url_template:
+            return None
+        symbol, _, member = target.partition('-')
+        for package, index in self.data['packages'].items():
+            files = index['symbols'].get(symbol, [])
+            if len(files) != 1:
+                continue
+            url = url_template.format(
+                package=package,
+                symbol=symbol,
+                member=member,
+                kind=self.data['files'][files[0]]['kinds'][symbol],
+                file=os.path.relpath(files[0], index['root']),
+            )
+            return nodes.reference('', '', contnode, internal=False, refuri=url)
+        return None
+
 
-def copy_asset_files(app, exc):
-    assert __file__.endswith('dart_domain.py')
-    css_file = __file__[:-2] + 'css'
-    if not os.path.isfile(css_file):
-        raise FileNotFoundError(f'Missing file `{css_file}`')
-    if app.builder.format == 'html' and not exc:
-        static_dir = os.path.join(app.builder.outdir, '_static')
-        copy_asset_file(css_file, static_dir)
+def report_cache_statistics(app: Sphinx, exc) -> None:
+    domain = app.env.get_domain('dart')
+    cache = domain.cache
+    if cache:
+        if cache.hits or cache.misses:
+            logger.info(f'dartdoc cache: {cache.hits} hits, {cache.misses} misses')
+        if not exc:
+            cache.evict()
+    render_cache = domain.render_cache
+    if render_cache:
+        if render_cache.hits or render_cache.misses:
+            total = render_cache.hits + render_cache.misses
+            logger.info(
+                f'dartdoc render cache: {render_cache.hits} hits, {render_cache.misses} '
+                f'misses ({100 * render_cache.hits / total:.0f}% hit rate), '
+                f'{render_cache.time_saved:.2f}s saved'
+            )
+        if not exc:
+            render_cache.evict()
+
+
+def default_cache_dir() -> str:
+    directory = os.environ.get('DARTDOC_CACHE_DIR')
+    if directory is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        directory = os.path.join(cache_home, 'flame-docs', 'dartdoc')
+    return directory
 
 
 # Emitted when the environment determines which source files have changed and should be re-read.
@@ -616,19 +1643,54 @@ def copy_asset_files(app, exc):
 # can return a list of docnames to re-read in addition to these.
 #
 # https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-get-outdated
+#
+# A modification time of a Dart file newer than its last scan is only a hint that the file may have
+# changed: such files are re-scanned, and a doc is considered outdated only if the declaration of
+# one of its symbols is now different from the one that was rendered.
 def on_env_get_outdated(_: Sphinx, env: BuildEnvironment, added: Set[str], changed: Set[str],
                         removed: Set[str]) -> List[str]:
     existing = added | changed | removed
+    data = env.domaindata['dart']
+    domain = env.get_domain('dart')
+    docs_by_file: Dict[str, List[str]] = {}
+    for docname, doc_data in data['docs'].items():
+        if docname in existing:
+            continue
+        for filename in doc_data['files']:
+            docs_by_file.setdefault(filename, []).append(docname)
     modified = set()
-    for package, package_data in env.domaindata['dart']['objects'].items():
-        for symbol, record in package_data.items():
-            docname = record['docname']
-            if docname in existing or docname in modified:
+    touched_files = {}
+    for filename, docnames in docs_by_file.items():
+        file_data = data['files'].get(filename)
+        last_modified_time = domain.get_mtime(filename)
+        if file_data is None or last_modified_time is None:
+            modified.update(docnames)
+        elif file_data['timestamp'] < last_modified_time:
+            touched_files[filename] = last_modified_time
+    domain.purge_deleted_files()
+    if not touched_files:
+        return list(modified)
+    try:
+        with span('dart_domain', 'check outdated files'):
+            extracted = domain.extract_api_data(list(touched_files))
+    except (RuntimeError, TypeError, ValueError):
+        # Let the directives report the error when the docs are re-read
+        for filename in touched_files:
+            modified.update(docs_by_file[filename])
+        return list(modified)
+    for filename, file_json in extracted.items():
+        file_data = domain.store_file_data(filename, file_json, touched_files[filename])
+        symbols = file_data['symbols']
+        for docname in docs_by_file[filename]:
+            if docname in modified:
                 continue
-            last_scan_time = record['timestamp']
-            last_modified_time = os.path.getmtime(record['filename'])
-            if last_scan_time < last_modified_time:
-                modified.add(docname)
+            for package, symbol in data['docs'][docname]['symbols']:
+                record = data['objects'].get(package, {}).get(symbol)
+                if record is not None and record['filename'] != filename:
+                    continue
+                if record is None or record['hash'] != symbols.get(symbol, (None,))[0]:
+                    modified.add(docname)
+                    break
     return list(modified)
 
 
@@ -638,13 +1700,19 @@ def on_env_get_outdated(_: Sphinx, env: BuildEnvironment, added: Set[str], chang
 #
 # https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-purge-doc
 def on_env_purge_doc(_: Sphinx, env: BuildEnvironment, docname: str) -> None:
-    for package, package_data in env.domaindata['dart']['objects'].items():
-        symbols_to_remove = []
-        for symbol, record in package_data.items():
-            if record['docname'] == docname:
-                symbols_to_remove.append(symbol)
-        for symbol in symbols_to_remove:
-            del package_data[symbol]
+    data = env.domaindata['dart']
+    doc_data = data['docs'].pop(docname, None)
+    if doc_data is None:
+        return
+    for package, symbol in doc_data['symbols']:
+        package_data = data['objects'].get(package, {})
+        record = package_data.get(symbol)
+        if record is None or record['docname'] != docname:
+            continue
+        for anchor in record['anchors']:
+            if data['xrefs'].get(anchor, (None,))[0] == docname:
+                del data['xrefs'][anchor]
+        del package_data[symbol]
 
 
 # Emitted after the environment has determined the list of all added and changed files and just
@@ -652,7 +1720,7 @@ def on_env_purge_doc(_: Sphinx, env: BuildEnvironment, docname: str) -> None:
 # before processing, or add more docnames that Sphinx did not consider changed.
 #
 # https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-before-read-docs
-def on_env_before_read_docs(_: Sphinx, __: BuildEnvironment, docnames: List[str]) -> None:
+def on_env_before_read_docs(_: Sphinx, env: BuildEnvironment, docnames: List[str]) -> None:
     # This ensures that within each directory, the 'index.md' document is processed first.
     def key(docname: str) -> str:
         basename = os.path.basename(docname)
@@ -661,6 +1729,20 @@ def on_env_before_read_docs(_: Sphinx, __: BuildEnvironment, docnames: List[str]
         return basename
 
     docnames.sort(key=key)
+    if not env.domaindata['dart']['files']:
+        # Fresh environment: the declarations saved by previous builds are no longer referenced
+        env.get_domain('dart').store.reset()
+    with span('dart_domain', 'prefetch source files'):
+        prefetch_source_files(env, docnames)
+
+
+# Emitted after reading all documents, when the environment and all doctrees are now up-to-date.
+#
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-updated
+def on_env_updated(_: Sphinx, env: BuildEnvironment) -> List[str]:
+    with span('dart_domain', 'compact declaration store'):
+        env.get_domain('dart').compact_store()
+    return []
 
 
 def setup(app: Sphinx):
@@ -668,11 +1750,20 @@ def setup(app: Sphinx):
     app.add_config_value('dartdoc_root', '', 'env', str)
     app.add_config_value('dartdoc_roots', {}, 'env', Dict[str, str])
     app.add_config_value('dartdoc_show_overrides', False, 'env', bool)
+    # Template of the URL for references to symbols that are not documented on any page, for
+    # example 'https://pub.dev/documentation/{package}/latest/index.html?search={symbol}'. The
+    # other available fields are {member}, {kind} and {file}.
+    app.add_config_value('dartdoc_external_url', '', 'env', str)
+    app.add_config_value('dartdoc_cache_dir', default_cache_dir(), '', str)
+    app.add_config_value('dartdoc_cache_size', 256 * 1024 * 1024, '', int)
+    app.add_config_value('dartdoc_jobs', os.cpu_count() or 1, '', int)
     app.add_domain(DartDomain)
     app.connect('build-finished', copy_asset_files)
+    app.connect('build-finished', report_cache_statistics)
     app.connect('env-get-outdated', on_env_get_outdated)
     app.connect('env-purge-doc', on_env_purge_doc)
     app.connect('env-before-read-docs', on_env_before_read_docs)
+    app.connect('env-updated', on_env_updated)
     return {
         'version': '1.0.0',
         'parallel_read_safe': True,
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+import os
+
+if os.name == 'nt':  # Windows
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """
+    Exclusive lock shared between processes, backed by the file `filename`.
+
+    The lock is held by at most one process at a time (other processes wait in `acquire()`), and
+    is released automatically by the OS if the process holding it dies. The lock file is removed
+    when the lock is released, so that locks for short-lived keys do not pile up on disk.
+
+    Example of usage:
+
+        with FileLock(path + '.lock'):
+            if not os.path.exists(path):
+                create(path)
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._fd = None
+
+    def acquire(self) -> None:
+        assert self._fd is None, 'The lock is not reentrant'
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        while True:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                _lock(fd)
+                # The previous holder of the lock may have removed the file after we opened it,
+                # in which case we hold a lock on a file that nobody else can see anymore.
+                if os.path.samestat(os.fstat(fd), os.stat(self.filename)):
+                    self._fd = fd
+                    return
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+
+    def release(self) -> None:
+        fd = self._fd
+        if fd is None:
+            return
+        self._fd = None
+        if os.name != 'nt':  # open files cannot be removed on Windows
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+        _unlock(fd)
+        os.close(fd)
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.release()
+
+
+def _lock(fd: int) -> None:
+    if os.name == 'nt':
+        while True:
+            try:
+                # LK_LOCK only retries for 10 seconds before giving up
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    else:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _unlock(fd: int) -> None:
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
@@ -12,15 +12,139 @@ function run_flutter_app(url) {
   }
   $('#flutter-app-overlay').addClass('active');
   $('#' + id).addClass('active');
+  register_running_app($('#' + id)[0]);
 }
 
-function open_code_listings(id) {
+/// Apps in the page that are currently running, least recently used first.
+const running_apps = [];
+
+/// URLs of the scripts that were already prefetched.
+const prefetched_apps = new Set();
+
+/// Set up the placeholders of the apps that are not booted eagerly: each of
+/// them is replaced with the app when clicked, or when scrolled into view if
+/// its boot mode is "visible".
+document.addEventListener('DOMContentLoaded', () => {
+  let observer = null;
+  if ('IntersectionObserver' in window) {
+    observer = new IntersectionObserver((entries) => {
+      for (const entry of entries) {
+        if (entry.isIntersecting) {
+          observer.unobserve(entry.target);
+          boot_flutter_app(entry.target);
+        }
+      }
+    }, {rootMargin: '200px'});
+  }
+  document.querySelectorAll('.flutter-app-placeholder').forEach((placeholder) => {
+    placeholder.addEventListener('click', () => boot_flutter_app(placeholder));
+    placeholder.addEventListener(
+      'mouseenter', () => prefetch_flutter_app(placeholder.dataset.src),
+    );
+    if (placeholder.dataset.boot === 'visible') {
+      if (observer) {
+        observer.observe(placeholder);
+      } else {
+        boot_flutter_app(placeholder);
+      }
+    }
+  });
+});
+
+/// Replace the [placeholder] with the iframe of its app.
+function boot_flutter_app(placeholder) {
+  if (!placeholder.isConnected) {
+    return;
+  }
+  let iframe = $('<iframe></iframe>')
+    .attr('src', placeholder.dataset.src)
+    .attr('style', placeholder.getAttribute('style'))
+    .addClass(placeholder.className)
+    .removeClass('flutter-app-placeholder')
+    .data('placeholder', placeholder);
+  $(placeholder).replaceWith(iframe);
+  register_running_app(iframe[0]);
+}
+
+/// Record that the app in [iframe] is running, and stop the apps that were
+/// used least recently if there are more than `flutter_app_max_active` of them.
+/// The apps that boot eagerly are not recorded, so they are never stopped.
+function register_running_app(iframe) {
+  let index = running_apps.indexOf(iframe);
+  if (index >= 0) {
+    running_apps.splice(index, 1);
+  }
+  running_apps.push(iframe);
+  let max_active = window.flutter_app_max_active || 0;
+  while (max_active > 0 && running_apps.length > max_active) {
+    stop_flutter_app(running_apps.shift());
+  }
+}
+
+/// Stop the app in [iframe]: an embedded app is replaced back with its
+/// placeholder (which now waits for a click), and a popup app is removed.
+function stop_flutter_app(iframe) {
+  let placeholder = $(iframe).data('placeholder');
+  if (placeholder) {
+    placeholder.dataset.boot = 'click';
+    $(iframe).replaceWith(placeholder);
+  } else {
+    $(iframe).remove();
+  }
+}
+
+/// Ask the browser to download the script of the app at [url] in advance, so
+/// that the app starts faster once the user runs it.
+function prefetch_flutter_app(url) {
+  let script_url = url.substring(0, url.lastIndexOf('/') + 1) + 'main.dart.js';
+  if (!prefetched_apps.has(script_url)) {
+    prefetched_apps.add(script_url);
+    $('head').append($('<link rel="prefetch">').attr('href', script_url));
+  }
+}
+
+/// Code listings that were fetched (or are being fetched), keyed by the URL.
+const code_listings = new Map();
+
+/// Show the code listings with the given [id] in the overlay. If the listings
+/// are not embedded in the page, they are downloaded from [url] the first time
+/// they are opened.
+function open_code_listings(id, url) {
   create_overlay();
+  let listings = $('#' + id);
+  // The listings that failed to load are replaced, so that they are fetched again
+  if (listings.hasClass('failed')) {
+    listings.remove();
+    listings = $();
+  }
+  if (!listings.length) {
+    listings = $(`<div id="${id}" class="flutter-app-code"></div>`);
+    load_code_listings(url).then(
+      (html) => listings.html(html),
+      () => listings.addClass('failed').text('Failed to load the code from ' + url),
+    );
+  }
   if (!$('#flutter-app-overlay #' + id).length) {
-    $('#' + id).appendTo($('#flutter-app-overlay'));
+    listings.appendTo($('#flutter-app-overlay'));
   }
   $('#flutter-app-overlay').addClass('active');
-  $('#' + id).addClass('active');
+  listings.addClass('active');
+}
+
+/// Fetch the code listings from [url], at most once per page.
+function load_code_listings(url) {
+  if (!code_listings.has(url)) {
+    let request = fetch(url).then((response) => {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    });
+    // Failed requests are retried when the listings are opened again
+    request.catch(() => code_listings.delete(url));
+    code_listings.set(url, request);
+  }
+  return code_listings.get(url);
 }
 
 function create_overlay() {
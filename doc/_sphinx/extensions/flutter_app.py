@@ -1,15 +1,30 @@
 #!/usr/bin/env python
+import concurrent.futures
 import glob
+import hashlib
+import html
+import json
 import os
 import re
 import shutil
 import subprocess
 import sys
+import threading
+import time
 from docutils import nodes
 from docutils.parsers.rst import directives
+from sphinx.errors import ConfigError
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.logging import getLogger
 
+from .filelock import FileLock
+from .profiler import span
+
+try:
+    import yaml
+except ImportError:  # without yaml, the whole packages are fingerprinted
+    yaml = None
+
 
 # ------------------------------------------------------------------------------
 # `.. flutter-app::` directive
@@ -61,6 +76,11 @@ class FlutterAppDirective(SphinxDirective):
 
       :height: - override the default height of an iframe in widget/infobox
         modes.
+
+      :boot: - when the app in widget/infobox modes should start: "eager" (as
+        soon as the page loads), "visible" (when the app is scrolled into
+        view), or "click" (when the user clicks on the app's placeholder).
+        The default is given by the `flutter_app_boot` config value.
     """
     has_content = True
     required_arguments = 0
@@ -72,9 +92,16 @@ class FlutterAppDirective(SphinxDirective):
         'show': directives.unchanged,
         'width': directives.unchanged,
         'height': directives.unchanged,
+        'boot': directives.unchanged,
     }
-    # Static list of targets that were already compiled during the build
-    COMPILED = []
+    # Compilations started during the build, keyed by the source directory. In
+    # parallel builds they are finished before the reader processes are forked,
+    # so that the readers inherit the results.
+    COMPILING = {}
+    # Thread pool that runs the compilations, at most `flutter_app_jobs` at a time
+    EXECUTOR = None
+    # Id of the process that created the `EXECUTOR`
+    EXECUTOR_PID = None
 
     def __init__(self, *args, **kwds):
         super().__init__(*args, **kwds)
@@ -87,21 +114,27 @@ class FlutterAppDirective(SphinxDirective):
         self.html_dir = None
 
     def run(self):
+        with span('flutter_app', 'flutter-app ' + self.options.get('sources', ''),
+                  doc=self.env.docname, line=self.lineno):
+            return self._run()
+
+    def _run(self):
         self.logger = getLogger('flutter-app')
         self._process_show_option()
         self._process_sources_option()
-        self.source_build_dir = os.path.join(self.source_dir, 'build', 'web')
-        self.app_name = self._get_app_name()
-        self.html_dir = '_static/apps/' + self.app_name
-        self.target_dir = os.path.abspath(
-            os.path.join('..', '_build', 'html', self.html_dir))
+        boot = self._process_boot_option()
+        app = FlutterApp(self.source_dir, get_lock_dir(self.env))
+        self.source_build_dir = app.source_build_dir
+        self.app_name = app.name
+        self.html_dir = app.html_dir
+        self.target_dir = app.target_dir
         self._ensure_compiled()
 
         page = self.options.get('page', '')
         iframe_url = _doc_root() + self.html_dir + '/index.html?' + page
         result = []
         if 'widget' in self.modes:
-            iframe = IFrame(src=iframe_url, classes=['flutter-app-iframe'])
+            iframe = IFrame(src=iframe_url, boot=boot, classes=['flutter-app-iframe'])
             result.append(iframe)
             styles = []
             if self.options.get('width'):
@@ -122,15 +155,30 @@ class FlutterAppDirective(SphinxDirective):
                 nodes.Text('Run'),
                 classes=['flutter-app-button', 'popup'],
                 onclick=f'run_flutter_app("{iframe_url}")',
+                onmouseenter=f'prefetch_flutter_app("{iframe_url}")',
             ))
         if 'code' in self.modes:
-            code_id = self.app_name + "-source-" + page
-            result.append(self._generate_code_listings(code_id))
+            subfolder = self.options.get('subfolder', '')
+            if subfolder and not subfolder.endswith('/'):
+                subfolder += '/'
+            code_path = subfolder + page
+            code_name = '-'.join(re.findall(r'\w+', code_path)) or 'lib'
+            code_id = self.app_name + '-source-' + code_name
+            builder = self.env.app.builder
+            with span('flutter_app', 'code listings ' + code_id, doc=self.env.docname):
+                if builder.format == 'html' and hasattr(builder, 'highlighter'):
+                    # The listings are written into a separate file at the end of the
+                    # build, and are only fetched by the page when the user opens them.
+                    code_url = self._register_code_listings(code_path, code_name)
+                    onclick = f'open_code_listings("{code_id}", "{_doc_root()}{code_url}")'
+                else:
+                    result.append(self._generate_code_listings(code_path, code_id))
+                    onclick = f'open_code_listings("{code_id}")'
             result.append(Button(
                 '',
                 nodes.Text('Code'),
                 classes=['flutter-app-button', 'code'],
-                onclick=f'open_code_listings("{code_id}")',
+                onclick=onclick,
             ))
         if 'infobox' in self.modes:
             self.state.nested_parse(self.content, 0, result)
@@ -150,6 +198,12 @@ class FlutterAppDirective(SphinxDirective):
         else:
             self.modes = ['widget']
 
+    def _process_boot_option(self):
+        value = self.options.get('boot') or self.config.flutter_app_boot
+        if value not in BOOT_MODES:
+            raise self.error('Invalid :boot: value ' + value)
+        return value
+
     def _process_sources_option(self):
         argument = self.options.get('sources', '')
         abspath = os.path.abspath(argument)
@@ -161,98 +215,1096 @@ class FlutterAppDirective(SphinxDirective):
         assert not abspath.endswith('/')
         self.source_dir = abspath
 
-    def _get_app_name(self):
-        src = os.path.relpath(self.source_dir)
-        return '-'.join(word for word in re.split(r'\W', src) if word)
-
     def _ensure_compiled(self):
-        need_compiling = (
-            ('popup' in self.modes or 'widget' in self.modes) and
-            self.source_dir not in FlutterAppDirective.COMPILED
-        )
-        if not need_compiling:
+        if 'popup' not in self.modes and 'widget' not in self.modes:
             return
-        self.logger.info('Compiling Flutter app [%s]' % self.app_name)
-        self._compile_source()
-        self._copy_compiled()
+        # Usually the compilation was already started at the `env-before-read-docs` event,
+        # and may even be finished by now.
+        future = schedule_compilation(self.source_dir, self.env)
+        try:
+            entry = future.result()
+        except CompileError as e:
+            raise self.error(str(e))
+        # The deployed apps are recorded in the environment rather than in the
+        # directive, so that the records from parallel readers can be merged.
+        apps = self.env.flutter_apps
+        docnames = apps[self.app_name]['docnames'] if self.app_name in apps else set()
+        apps[self.app_name] = dict(entry, docnames=docnames | {self.env.docname})
+
+    def _find_code_files(self, code_path):
+        files = SourceTree.get_instance(self.source_dir).list_files(code_path)
+        if files is None:
+            code_dir = self.source_dir + '/lib/' + code_path
+            raise self.error(f'Cannot find source directory {code_dir} or '
+                             f'source file {code_dir}.dart')
+        return files
+
+    def _register_code_listings(self, code_path, code_name):
+        """
+        Records the code listings to be written by `write_code_listings()`, and
+        returns the URL of the file that will contain them.
+        """
+        self._find_code_files(code_path)
+        url = f'{self.html_dir}/code/{code_name}.html'
+        listings = self.env.flutter_app_code
+        docnames = listings[url]['docnames'] if url in listings else set()
+        listings[url] = {
+            'sources': self.source_dir,
+            'path': code_path,
+            'docnames': docnames | {self.env.docname},
+        }
+        return url
+
+    def _generate_code_listings(self, code_path, code_id):
+        tree = SourceTree.get_instance(self.source_dir)
+        result = nodes.container(classes=['flutter-app-code'], ids=[code_id])
+        for path, simple_filename in self._find_code_files(code_path):
+            result += nodes.container(
+                '', nodes.Text(simple_filename), classes=['filename']
+            )
+            text = tree.get_file(path).text
+            node = nodes.literal_block(
+                text, text, language='dart', linenos=True,
+                highlight_args={'linenostart': 1},
+            )
+            self.set_source_info(node)
+            result += node
+        return result
+
+
+# When an app embedded into the page starts running, see the :boot: option
+BOOT_MODES = ['eager', 'visible', 'click']
+
+
+# ------------------------------------------------------------------------------
+# Code listings
+# ------------------------------------------------------------------------------
+
+class SourceFile:
+    """
+    Source file of an app, as shown in the code listings: the lines are stripped
+    of trailing whitespace.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rt') as f:
+            self.text = '\n'.join(line.rstrip() for line in f)
+        self.digest = hashlib.sha256(self.text.encode('utf-8')).hexdigest()
+
+
+class SourceTree:
+    """
+    Index of the `lib` folder of an app, which is scanned at most once per build
+    no matter how many {flutter-app} directives show the code of that app. The
+    files are also read lazily, at most once per build.
+    """
+    # Instances keyed by the source directory of the app
+    INSTANCES = {}
+
+    @staticmethod
+    def get_instance(source_dir):
+        tree = SourceTree.INSTANCES.get(source_dir)
+        if tree is None:
+            tree = SourceTree(source_dir)
+            SourceTree.INSTANCES[source_dir] = tree
+        return tree
+
+    def __init__(self, source_dir):
+        self.lib_dir = os.path.join(source_dir, 'lib')
+        # Paths of all files within the `lib` folder relative to that folder,
+        # using '/' as the separator, and in sorted order.
+        self.paths = []
+        for root, dirs, files in os.walk(self.lib_dir):
+            # Hidden files are skipped, same as `glob()` does
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                if not name.startswith('.'):
+                    path = os.path.relpath(os.path.join(root, name), self.lib_dir)
+                    self.paths.append(path.replace(os.sep, '/'))
+        self.paths.sort()
+        self.files = {}
+
+    def list_files(self, code_path):
+        """
+        Returns the files to be shown for the `code_path` (relative to the `lib`
+        folder), which is either a directory or a dart file without the extension.
+        The result is a list of tuples (path, name to display), or None if there
+        is no such directory or file.
+        """
+        code_path = code_path.strip('/')
+        prefix = code_path + '/' if code_path else ''
+        files = [
+            (path, path[len(prefix):])
+            for path in self.paths
+            if path.startswith(prefix)
+        ]
+        if files:
+            return files
+        if code_path + '.dart' in self.paths:
+            return [(code_path + '.dart', os.path.basename(code_path) + '.dart')]
+        return None
+
+    def get_file(self, path):
+        source_file = self.files.get(path)
+        if source_file is None:
+            source_file = SourceFile(os.path.join(self.lib_dir, path))
+            self.files[path] = source_file
+        return source_file
+
+
+class CodeListings:
+    """
+    Cache of the highlighted code listings, keyed by the file path, the digest
+    of its content, and the lexer. The entries are kept in memory during the
+    build, and in the `flutter-app-listings` folder of the doctrees directory
+    between the builds, so that unchanged files are never highlighted again.
+    """
+    INSTANCE = None
+    # Entries that were not used for this long are removed from the disk
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    @staticmethod
+    def get_instance(env):
+        directory = os.path.join(env.doctreedir, 'flutter-app-listings')
+        if CodeListings.INSTANCE is None or CodeListings.INSTANCE.directory != directory:
+            CodeListings.INSTANCE = CodeListings(directory, env.app.builder)
+        return CodeListings.INSTANCE
+
+    def __init__(self, directory, builder):
+        self.directory = directory
+        self.builder = builder
+        self.entries = {}
+
+    def highlight(self, source_file, lexer, location=None):
+        """
+        Returns the HTML for the `source_file` with line numbers, in the same
+        form as the HTML builder produces for a `code-block` directive.
+        """
+        key = self._get_key(source_file, lexer)
+        result = self.entries.get(key)
+        if result is not None:
+            return result
+        path = os.path.join(self.directory, key + '.html')
+        try:
+            with open(path, 'rt', encoding='utf-8') as f:
+                result = f.read()
+            # Touch the entry, so that its modification time reflects the last use
+            os.utime(path)
+        except OSError:
+            with span('flutter_app', 'highlight ' + source_file.filename):
+                result = self._highlight(source_file.text, lexer, location)
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wt', encoding='utf-8') as f:
+                f.write(result)
+            os.replace(temp_path, path)
+        self.entries[key] = result
+        return result
+
+    def evict(self):
+        if not os.path.isdir(self.directory):
+            return
+        min_time = time.time() - CodeListings.MAX_AGE
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < min_time:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _get_key(self, source_file, lexer):
+        config = self.builder.config
+        key = '\0'.join([
+            source_file.filename,
+            source_file.digest,
+            lexer,
+            # These settings also affect the generated HTML
+            str(config.html_codeblock_linenos_style),
+            json.dumps(config.highlight_options.get(lexer, {}), sort_keys=True),
+        ])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _highlight(self, text, lexer, location):
+        config = self.builder.config
+        highlighted = self.builder.highlighter.highlight_block(
+            text, lexer,
+            opts=config.highlight_options.get(lexer, {}),
+            linenos=config.html_codeblock_linenos_style or True,
+            location=location,
+            force=False,
+            linenostart=1,
+        )
+        return f'<div class="highlight-{lexer} notranslate">{highlighted}</div>\n'
+
+
+def write_code_listings(app, listings):
+    """
+    Writes the code listings registered by the {flutter-app} directives into
+    the output folder, as HTML fragments that are fetched by the function
+    `open_code_listings()` in flutter_app.js. The files are regenerated in every
+    build (which is cheap thanks to `CodeListings`), so that they are up to date
+    even when the pages that show them have not changed.
+    """
+    code_listings = CodeListings.get_instance(app.env)
+    for url, entry in sorted(listings.items()):
+        tree = SourceTree.get_instance(entry['sources'])
+        files = tree.list_files(entry['path'])
+        location = (min(entry['docnames']), None)
+        if files is None:
+            getLogger('flutter-app').warning(
+                f'Cannot find the source code for {url}', location=location)
+            continue
+        parts = []
+        for path, simple_filename in files:
+            parts.append(
+                '<div class="filename docutils container">\n%s</div>\n'
+                % html.escape(simple_filename, quote=False)
+            )
+            parts.append(code_listings.highlight(
+                tree.get_file(path), 'dart', location=location))
+        write_if_changed(os.path.join(app.outdir, url), ''.join(parts))
+
+
+# ------------------------------------------------------------------------------
+# Compilation
+# ------------------------------------------------------------------------------
+
+class CompileError(Exception):
+    """
+    The command `flutter build web` has failed; the message contains its output.
+    """
+
+
+class FlutterApp:
+    """
+    Flutter app located in the `source_dir` directory, which is compiled in 'web'
+    mode and deployed into the `_static/apps/` folder of the generated site. The
+    lock that guards the deployment is kept in `lock_dir`, outside of the site.
+    """
+
+    def __init__(self, source_dir, lock_dir, cache=None, sync_mode='copy',
+                 shared_assets=False):
+        self.source_dir = source_dir
+        self.source_build_dir = os.path.join(source_dir, 'build', 'web')
+        self.name = get_app_name(source_dir)
+        self.html_dir = '_static/apps/' + self.name
+        self.target_dir = os.path.abspath(
+            os.path.join('..', '_build', 'html', self.html_dir))
+        self.lock_file = os.path.join(lock_dir, self.name + '.lock')
+        self.cache = cache
+        self.sync_mode = sync_mode
+        self.shared_assets = shared_assets
+        # Locations of the app's assets in the shared store, see `BlobStore`
+        self.asset_map = None
+        self.logger = getLogger('flutter-app')
+
+    def compile(self):
+        """
+        Compiles the app (unless a cached build is available), and deploys it
+        into the output folder. Returns the entry of the manifest of deployed
+        apps, see `write_manifest()`.
+        """
+        # Prevents other processes from deploying the same app at the same time
+        with FileLock(self.lock_file):
+            return self._compile()
+
+    def _compile(self):
+        fingerprint = compute_fingerprint(self.source_dir)
+        compiled = True
+        if self.cache is None or fingerprint is None:
+            if self.cache is not None:
+                self.logger.info(
+                    'Not caching Flutter app [%s]: its local dependencies are unknown'
+                    % self.name)
+            self.logger.info('Compiling Flutter app [%s]' % self.name)
+            self._compile_source()
+            with span('flutter_app', 'sync compiled ' + self.name):
+                self._copy_compiled(self.source_build_dir)
+        else:
+            # The lock prevents concurrent builds from compiling the same app
+            # version, and the entry from being evicted while it is copied
+            with self.cache.lock(fingerprint):
+                build_dir = self.cache.get(fingerprint)
+                if build_dir is None:
+                    self.logger.info('Compiling Flutter app [%s]' % self.name)
+                    self._compile_source()
+                    build_dir = self.cache.put(fingerprint, self.source_build_dir)
+                else:
+                    self.logger.info('Using cached build of Flutter app [%s]' % self.name)
+                    compiled = False
+                with span('flutter_app', 'sync compiled ' + self.name):
+                    self._copy_compiled(build_dir)
         self._create_index_html()
-        self.logger.info('  + copied into ' + self.target_dir)
         assert os.path.isfile(self.target_dir + '/main.dart.js')
         assert os.path.isfile(self.target_dir + '/index.html')
-        FlutterAppDirective.COMPILED.append(self.source_dir)
+        return {
+            'sources': os.path.relpath(self.source_dir),
+            'fingerprint': fingerprint,
+            'flutter_version': get_flutter_version(),
+            'compiled': compiled,
+            'deployed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        }
 
     def _compile_source(self):
         flutter_cmd = 'flutter'
         if sys.platform == 'win32':
             flutter_cmd = 'flutter.bat'
         try:
-            subprocess.run(
-                [flutter_cmd, 'build', 'web'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                cwd=self.source_dir,
-                check=True,
-            )
+            with span('flutter_app', 'flutter build web ' + self.name, subprocess=True):
+                subprocess.run(
+                    [flutter_cmd, 'build', 'web'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=self.source_dir,
+                    check=True,
+                )
         except subprocess.CalledProcessError as e:
             cmd = ' '.join(e.cmd)
-            raise self.error(
+            raise CompileError(
                 f'Command `{cmd}` returned with exit status {e.returncode}\n' +
                 e.output.decode('utf-8'),
             )
 
-    def _copy_compiled(self):
-        assert os.path.isdir(self.source_build_dir)
-        main_js = os.path.join(self.source_build_dir, 'main.dart.js')
-        assets_dir = os.path.join(self.source_build_dir, 'assets')
-        os.makedirs(self.target_dir, exist_ok=True)
-        shutil.copy2(main_js, self.target_dir)
-        if os.path.exists(assets_dir):
-            shutil.copytree(
-                src=assets_dir,
-                dst=os.path.join(self.target_dir, 'assets'),
-                dirs_exist_ok=True,
-            )
+    def _copy_compiled(self, build_dir):
+        assert os.path.isdir(build_dir)
+        stats = SyncStats()
+        sync_file(
+            os.path.join(build_dir, 'main.dart.js'),
+            os.path.join(self.target_dir, 'main.dart.js'),
+            self.sync_mode,
+            stats,
+        )
+        assets_dir = os.path.join(build_dir, 'assets')
+        asset_map_file = os.path.join(self.target_dir, ASSET_MAP_FILE)
+        if self.shared_assets:
+            blobs = BlobStore(os.path.join(os.path.dirname(self.target_dir), BLOBS_DIR))
+            self.asset_map = blobs.add_tree(assets_dir, 'assets', self.sync_mode, stats)
+            write_if_changed(
+                asset_map_file, json.dumps(self.asset_map, indent=2, sort_keys=True))
+            # The app reaches its assets only through the asset loader
+            shutil.rmtree(os.path.join(self.target_dir, 'assets'), ignore_errors=True)
+        else:
+            sync_tree(assets_dir, os.path.join(self.target_dir, 'assets'),
+                      self.sync_mode, stats)
+            if os.path.exists(asset_map_file):
+                os.remove(asset_map_file)
+        self.logger.info(f'  + {stats} in {self.target_dir}')
 
     def _create_index_html(self):
         target_file = os.path.join(self.target_dir, 'index.html')
-        with open(target_file, 'wt') as out:
-            out.write('<!DOCTYPE html>\n')
-            out.write('<html>\n<head>\n')
-            out.write('<base href="%s%s/">\n' % (_doc_root(), self.html_dir))
-            out.write('<title>%s</title>\n' % self.app_name)
-            out.write('<style>body { background: black; }</style>\n')
-            out.write('</head>\n<body>\n')
-            out.write('<script src="main.dart.js"></script>\n')
-            out.write('</body>\n</html>\n')
-
-    def _generate_code_listings(self, code_id):
-        subfolder = self.options.get('subfolder', '')
-        if subfolder and not subfolder.endswith('/'):
-            subfolder += '/'
-        code_dir = self.source_dir + '/lib/' +  subfolder + self.options.get('page', '')
-        if os.path.isdir(code_dir):
-            files = glob.glob(code_dir + '/**', recursive=True)
-        elif os.path.isfile(code_dir + '.dart'):
-            files = [code_dir + '.dart']
-            code_dir += '/..'
-        else:
-            raise self.error(f'Cannot find source directory {code_dir} or '
-                             f'source file {code_dir}.dart')
+        html = (
+            '<!DOCTYPE html>\n'
+            '<html>\n<head>\n'
+            '<base href="%s%s/">\n' % (_doc_root(), self.html_dir) +
+            '<title>%s</title>\n' % self.name +
+            '<style>body { background: black; }</style>\n' +
+            (make_asset_loader(self.asset_map) if self.asset_map else '') +
+            '</head>\n<body>\n'
+            '<script src="main.dart.js"></script>\n'
+            '</body>\n</html>\n'
+        )
+        write_if_changed(target_file, html)
 
-        result = nodes.container(classes=['flutter-app-code'], ids=[code_id])
-        for filename in sorted(files):
-            if os.path.isfile(filename):
-                simple_filename = os.path.relpath(filename, code_dir)
-                result += nodes.container(
-                    '', nodes.Text(simple_filename), classes=['filename']
+
+def get_app_name(source_dir):
+    src = os.path.relpath(source_dir)
+    return '-'.join(word for word in re.split(r'\W', src) if word)
+
+
+def get_lock_dir(env):
+    """
+    Returns the folder with the locks of the deployed apps. It is within the
+    doctrees directory, so that the locks do not get published with the site.
+    """
+    return os.path.join(env.doctreedir, 'flutter-app-locks')
+
+
+def schedule_compilation(source_dir, env):
+    """
+    Starts compiling the app in `source_dir` in the background, unless it was
+    started already, and returns the future for the result.
+    """
+    config = env.config
+    future = FlutterAppDirective.COMPILING.get(source_dir)
+    if future is None:
+        # A forked reader process does not inherit the threads of the pool
+        if FlutterAppDirective.EXECUTOR is None or \
+                FlutterAppDirective.EXECUTOR_PID != os.getpid():
+            FlutterAppDirective.EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, config.flutter_app_jobs),
+                thread_name_prefix='flutter-app')
+            FlutterAppDirective.EXECUTOR_PID = os.getpid()
+        app = FlutterApp(
+            source_dir,
+            lock_dir=get_lock_dir(env),
+            cache=AppCache.get_instance(config),
+            sync_mode=config.flutter_app_sync_mode,
+            shared_assets=config.flutter_app_shared_assets,
+        )
+        future = FlutterAppDirective.EXECUTOR.submit(app.compile)
+        FlutterAppDirective.COMPILING[source_dir] = future
+    return future
+
+
+# ------------------------------------------------------------------------------
+# Deployment
+# ------------------------------------------------------------------------------
+
+# `ioctl` request for cloning a file on Linux (copy-on-write filesystems only)
+FICLONE = 0x40049409
+
+
+class SyncStats:
+    """
+    Number of files and bytes processed while synchronizing a compiled app into
+    the output folder.
+    """
+
+    def __init__(self):
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.removed_files = 0
+
+    def __str__(self):
+        return (
+            f'synced {self.copied_files} files ({self.copied_bytes:,} bytes), '
+            f'skipped {self.skipped_files} unchanged files ({self.skipped_bytes:,} bytes), '
+            f'removed {self.removed_files} stale files'
+        )
+
+
+def sync_tree(source_dir, target_dir, mode, stats):
+    """
+    Makes the directory `target_dir` identical to `source_dir`: the new and
+    changed files are copied (or linked, depending on the `mode`), the
+    unchanged files are left alone, and the files that no longer exist in the
+    source are removed.
+    """
+    expected = set()
+    if os.path.isdir(source_dir):
+        for root, _, files in os.walk(source_dir):
+            for name in files:
+                relpath = os.path.relpath(os.path.join(root, name), source_dir)
+                expected.add(relpath)
+                sync_file(
+                    os.path.join(source_dir, relpath),
+                    os.path.join(target_dir, relpath),
+                    mode,
+                    stats,
                 )
-                with open(filename, 'rt') as f:
-                    self.state.nested_parse(
-                        ['``````{code-block} dart\n:lineno-start: 1\n'] +
-                        [line.rstrip() for line in f] +
-                        ['``````\n'], 0, result)
+    if os.path.isdir(target_dir):
+        for root, dirs, files in os.walk(target_dir, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                if not _is_expected(os.path.relpath(path, target_dir), expected):
+                    os.remove(path)
+                    stats.removed_files += 1
+            for name in dirs:
+                path = os.path.join(root, name)
+                if not os.listdir(path):
+                    os.rmdir(path)
+
+
+def _is_expected(name, expected):
+    # The compressed versions of the files, written by the `precompress`
+    # extension, are kept as long as the original files exist.
+    base, extension = os.path.splitext(name)
+    return name in expected or (extension in ['.gz', '.br'] and base in expected)
+
+
+def sync_file(source, target, mode, stats):
+    """
+    Copies the file `source` into `target`, unless the target already has the
+    same content. The `mode` can be 'copy', 'hardlink' (which falls back to
+    copying if both files are on different filesystems), or 'reflink' (a
+    copy-on-write clone, if the filesystem supports it).
+    """
+    size = os.path.getsize(source)
+    if os.path.isfile(target) and os.path.getsize(target) == size and \
+            (os.path.samefile(source, target) or hash_file(source) == hash_file(target)):
+        stats.skipped_files += 1
+        stats.skipped_bytes += size
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    if not (mode == 'hardlink' and _try_link(source, target) or
+            mode == 'reflink' and _try_reflink(source, target)):
+        shutil.copy2(source, target)
+    stats.copied_files += 1
+    stats.copied_bytes += size
+
+
+def _try_link(source, target):
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        return False
+
+
+def _try_reflink(source, target):
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, target)
+        return True
+    except OSError:
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+
+# Folder within `_static/apps/` with the assets shared by all apps
+BLOBS_DIR = '_blobs'
+
+# File in the app's folder that lists the shared assets used by the app
+ASSET_MAP_FILE = 'asset-map.json'
+
+
+class BlobStore:
+    """
+    Content-addressed store of the assets of the apps, in the `_static/apps/_blobs`
+    folder: each distinct file is stored once, under the name derived from the
+    hash of its content. Since the content of a blob never changes, the blobs can
+    be cached by the browsers indefinitely.
+
+    The apps find their assets through the map written into their `index.html`,
+    see `make_asset_loader()`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def add_tree(self, source_dir, prefix, mode, stats):
+        """
+        Adds all files from `source_dir` into the store, and returns the map
+        from their paths (relative to the app's folder, starting with `prefix`)
+        to the blobs (relative to the app's folder too).
+        """
+        result = {}
+        if os.path.isdir(source_dir):
+            for root, _, files in os.walk(source_dir):
+                for name in files:
+                    filename = os.path.join(root, name)
+                    path = os.path.relpath(filename, source_dir).replace(os.sep, '/')
+                    blob = self.add_file(filename, mode, stats)
+                    result[f'{prefix}/{path}'] = f'../{BLOBS_DIR}/{blob}'
         return result
 
+    def add_file(self, filename, mode, stats):
+        """
+        Adds the file into the store unless it is there already, and returns the
+        name of its blob.
+        """
+        extension = os.path.splitext(filename)[1]
+        name = hash_file(filename)[:32] + extension
+        blob = os.path.join(self.directory, name)
+        size = os.path.getsize(filename)
+        if os.path.isfile(blob) and os.path.getsize(blob) == size:
+            stats.skipped_files += 1
+            stats.skipped_bytes += size
+            return name
+        # The same blob may be written by several apps at once, so it should
+        # appear at its final location atomically.
+        temp_blob = f'{blob}.{os.getpid()}.{threading.get_ident()}.tmp'
+        sync_file(filename, temp_blob, mode, stats)
+        os.replace(temp_blob, blob)
+        return name
+
+    def collect_garbage(self, apps_dir):
+        """
+        Removes the blobs that are not used by any of the apps in `apps_dir`.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        used = set()
+        for name in os.listdir(apps_dir):
+            asset_map_file = os.path.join(apps_dir, name, ASSET_MAP_FILE)
+            if os.path.isfile(asset_map_file):
+                with open(asset_map_file, 'rt') as f:
+                    used.update(os.path.basename(blob) for blob in json.load(f).values())
+        for name in os.listdir(self.directory):
+            if not _is_expected(name, used):
+                os.remove(os.path.join(self.directory, name))
+        if not used:
+            os.rmdir(self.directory)
+
+
+def make_asset_loader(asset_map):
+    """
+    Returns the script for the app's `index.html`, which redirects the requests
+    for the app's assets into the shared blob store. Flutter loads its assets
+    (including the asset manifests, fonts, shaders and images) with `fetch()`
+    or `XMLHttpRequest`, so these are patched to look up the URLs in the
+    `asset_map`, and so is the `src` of the images created by the platform
+    views. The app has no copy of its own of the shared assets.
+    """
+    return (
+        '<script>\n'
+        '(function() {\n'
+        '  const assets = %s;\n'
+        '  function resolve(url) {\n'
+        '    const base = document.baseURI.replace(/[?#].*$/, "");\n'
+        '    const href = new URL(url, base).href;\n'
+        '    if (!href.startsWith(base)) return url;\n'
+        '    const path = decodeURIComponent(href.substring(base.length).replace(/[?#].*$/, ""));\n'
+        '    return path in assets ? new URL(assets[path], base).href : url;\n'
+        '  }\n'
+        '  const fetch = window.fetch;\n'
+        '  window.fetch = function(input, init) {\n'
+        '    if (input instanceof Request) {\n'
+        '      const url = resolve(input.url);\n'
+        '      if (url !== input.url) input = new Request(url, input);\n'
+        '    } else {\n'
+        '      input = resolve(String(input));\n'
+        '    }\n'
+        '    return fetch.call(this, input, init);\n'
+        '  };\n'
+        '  const open = XMLHttpRequest.prototype.open;\n'
+        '  XMLHttpRequest.prototype.open = function(method, url, ...args) {\n'
+        '    return open.call(this, method, resolve(String(url)), ...args);\n'
+        '  };\n'
+        '  const src = Object.getOwnPropertyDescriptor(HTMLImageElement.prototype, "src");\n'
+        '  Object.defineProperty(HTMLImageElement.prototype, "src", {\n'
+        '    ...src,\n'
+        '    set(url) { src.set.call(this, resolve(String(url))); },\n'
+        '  });\n'
+        '})();\n'
+        '</script>\n'
+    ) % json.dumps(asset_map, sort_keys=True)
+
+
+def hash_file(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_if_changed(filename, text):
+    """
+    Writes the `text` into the file, unless the file already has exactly this
+    content. Keeping the file untouched preserves its timestamp, which avoids
+    needless re-uploads and cache invalidations downstream.
+    """
+    if os.path.isfile(filename):
+        with open(filename, 'rt') as f:
+            if f.read() == text:
+                return
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wt') as f:
+        f.write(text)
+
+
+# ------------------------------------------------------------------------------
+# Build cache
+# ------------------------------------------------------------------------------
+
+class AppCache:
+    """
+    Persistent cache of compiled apps, shared by all builds on the machine.
+
+    Each entry is a directory with the `main.dart.js` file and the `assets` of
+    a compiled app, and is keyed by the fingerprint of the app's sources (see
+    `compute_fingerprint()`). The total size of the cache is bounded, with the
+    least recently used entries evicted first.
+    """
+    INSTANCE = None
+    FLUTTER_VERSION = None
+
+    @staticmethod
+    def get_instance(config):
+        """
+        Returns the cache configured by `flutter_app_cache_dir`, or None if the
+        cache is disabled.
+        """
+        if not config.flutter_app_cache_dir:
+            return None
+        if AppCache.INSTANCE is None or \
+                AppCache.INSTANCE.directory != config.flutter_app_cache_dir:
+            AppCache.INSTANCE = AppCache(
+                config.flutter_app_cache_dir, config.flutter_app_cache_size)
+        return AppCache.INSTANCE
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get(self, fingerprint):
+        """
+        Returns the directory of the cached build with the given fingerprint,
+        or None if there is no such entry.
+        """
+        path = os.path.join(self.directory, fingerprint)
+        if not os.path.isfile(os.path.join(path, 'main.dart.js')):
+            return None
+        # Touch the entry, so that its modification time reflects the last use
+        os.utime(path)
+        return path
+
+    def put(self, fingerprint, build_dir):
+        """
+        Saves the compiled app from `build_dir` into the cache, and returns the
+        directory of the new entry.
+        """
+        path = os.path.join(self.directory, fingerprint)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        shutil.copy2(os.path.join(build_dir, 'main.dart.js'), temp_path)
+        assets_dir = os.path.join(build_dir, 'assets')
+        if os.path.exists(assets_dir):
+            shutil.copytree(assets_dir, os.path.join(temp_path, 'assets'))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+        return path
+
+    def lock(self, fingerprint):
+        return FileLock(os.path.join(self.directory, fingerprint + '.lock'))
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits within
+        `max_size`.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path) or name.endswith('.tmp'):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, file))
+                for root, _, files in os.walk(path)
+                for file in files
+            )
+            entries.append((os.path.getmtime(path), size, path))
+            total_size += size
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            # Waits until the builds that use the entry have copied it
+            with self.lock(os.path.basename(path)):
+                shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+# Files and directories of an app that affect the result of its compilation, in
+# addition to the sources of a package (see `get_package_sources()`)
+FINGERPRINT_SOURCES = ['web', 'pubspec.lock']
+
+# Directories of a package that contain only the outputs of the build tools
+BUILD_OUTPUTS = ['build', '.dart_tool']
+
+# Digests of the source trees, computed at most once per build
+_tree_digests = {}
+_tree_digests_lock = threading.Lock()
+
+
+def compute_fingerprint(source_dir):
+    """
+    Returns a digest that changes whenever the result of compiling the app in
+    `source_dir` may change: it covers the app's sources and assets, its
+    resolved dependencies (including the local packages that it uses, such as
+    `packages/flame` within the workspace), and the Flutter version. Returns
+    None if the local packages that the app uses cannot be determined.
+    """
+    local_packages = find_local_packages(source_dir)
+    if local_packages is None:
+        return None
+    digest = hashlib.sha256()
+    digest.update(get_flutter_version().encode('utf-8'))
+    paths = [os.path.join(source_dir, name) for name in FINGERPRINT_SOURCES]
+    paths.extend(get_package_sources(source_dir))
+    lock_file = find_upwards(source_dir, 'pubspec.lock')
+    if lock_file:
+        paths.append(lock_file)
+    for package_dir in local_packages:
+        paths.extend(get_package_sources(package_dir))
+    for path in sorted(set(paths)):
+        # Relative paths keep the fingerprint the same across checkouts
+        relpath = os.path.relpath(path, source_dir)
+        digest.update(f'{relpath}\0{hash_tree(path)}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_package_sources(package_dir):
+    """
+    Returns the paths within the Dart package at `package_dir` that go into a
+    compiled app: the `lib` directory, the pubspec, and the assets, shaders
+    and fonts declared in the pubspec. If the pubspec cannot be read, the
+    whole package directory is returned instead.
+    """
+    pubspec_file = os.path.join(package_dir, 'pubspec.yaml')
+    if yaml is None:
+        return [package_dir]
+    try:
+        with open(pubspec_file, 'rt', encoding='utf-8') as f:
+            pubspec = yaml.safe_load(f)
+        flutter = pubspec.get('flutter') or {}
+        declared = list(flutter.get('assets') or [])
+        declared.extend(flutter.get('shaders') or [])
+        for family in flutter.get('fonts') or []:
+            declared.extend(font['asset'] for font in family.get('fonts') or [])
+    except (OSError, yaml.YAMLError, AttributeError, KeyError, TypeError):
+        # The pubspec is missing or malformed
+        return [package_dir]
+    result = [os.path.join(package_dir, 'lib'), pubspec_file]
+    for entry in declared:
+        # Newer versions of Flutter allow assets with options, such as flavors
+        path = entry.get('path') if isinstance(entry, dict) else entry
+        # Assets of other packages are covered by those packages
+        if isinstance(path, str) and not path.startswith('packages/'):
+            result.append(os.path.normpath(os.path.join(package_dir, path)))
+    return result
+
+
+def hash_tree(path):
+    with _tree_digests_lock:
+        if path in _tree_digests:
+            return _tree_digests[path]
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    elif os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            if root == path:
+                dirs[:] = [name for name in dirs if name not in BUILD_OUTPUTS]
+            dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+            for name in sorted(files):
+                filename = os.path.join(root, name)
+                with open(filename, 'rb') as f:
+                    content_digest = hashlib.sha256(f.read()).hexdigest()
+                relpath = os.path.relpath(filename, path)
+                digest.update(f'{relpath}\0{content_digest}\n'.encode('utf-8'))
+    result = digest.hexdigest()
+    with _tree_digests_lock:
+        _tree_digests[path] = result
+    return result
+
+
+def find_upwards(directory, name):
+    """
+    Returns the path to the file `name` in `directory` or in the nearest of its
+    parents, or None.
+    """
+    while True:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def find_local_packages(source_dir):
+    """
+    Returns the root directories of the local packages that the app depends on,
+    directly or transitively: the `path` dependencies, and the packages of the
+    pub workspace. The dependencies are read from the pubspecs, so that the
+    result does not depend on whether `pub get` has run. Returns None if some
+    pubspec cannot be read.
+    """
+    if yaml is None:
+        # Without the pubspecs, all local packages of the package config are used
+        config = read_package_config(source_dir)
+        return None if config is None else sorted(set(config.values()))
+    pubspec = read_pubspec(source_dir)
+    if pubspec is None:
+        return None
+    known = find_workspace_packages(source_dir)
+    if known is None:
+        return None
+    known.update(read_package_config(source_dir) or {})
+    overrides = pubspec.get('dependency_overrides') or {}
+    result = []
+    pending = [(source_dir, pubspec, True)]
+    while pending:
+        package_dir, pubspec, is_app = pending.pop()
+        dependencies = dict(pubspec.get('dependencies') or {})
+        if is_app:
+            dependencies.update(pubspec.get('dev_dependencies') or {})
+        for name, spec in dependencies.items():
+            spec = overrides.get(name, spec)
+            if isinstance(spec, dict) and isinstance(spec.get('path'), str):
+                base_dir = source_dir if name in overrides else package_dir
+                dependency_dir = os.path.normpath(os.path.join(base_dir, spec['path']))
+            elif name in known and not (isinstance(spec, dict) and 'sdk' in spec):
+                dependency_dir = known[name]
+            else:
+                # Hosted packages are covered by `pubspec.lock`
+                continue
+            if dependency_dir == source_dir or dependency_dir in result:
+                continue
+            dependency_pubspec = read_pubspec(dependency_dir)
+            if dependency_pubspec is None:
+                return None
+            result.append(dependency_dir)
+            pending.append((dependency_dir, dependency_pubspec, False))
+    return sorted(result)
+
+
+def read_pubspec(package_dir):
+    """
+    Returns the content of the pubspec of the package at `package_dir`, or
+    None if it is missing or malformed.
+    """
+    try:
+        with open(os.path.join(package_dir, 'pubspec.yaml'), 'rt', encoding='utf-8') as f:
+            pubspec = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError):
+        return None
+    return pubspec if isinstance(pubspec, dict) else None
+
+
+def find_workspace_packages(source_dir):
+    """
+    Returns the root directories of the packages of the pub workspace that
+    contains `source_dir`, by name. The result is empty if the app is not
+    within a workspace, and None if the pubspec of a member cannot be read.
+    """
+    directory = source_dir
+    while True:
+        pubspec = read_pubspec(directory)
+        if pubspec is not None and isinstance(pubspec.get('workspace'), list):
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return {}
+        directory = parent
+    result = {}
+    for member in pubspec['workspace']:
+        # The members may be given as glob patterns, such as `packages/**`
+        for member_dir in glob.glob(os.path.join(directory, member), recursive=True):
+            if not os.path.isfile(os.path.join(member_dir, 'pubspec.yaml')):
+                continue
+            member_pubspec = read_pubspec(member_dir)
+            if member_pubspec is None:
+                return None
+            result[member_pubspec.get('name')] = os.path.normpath(member_dir)
+    return result
+
+
+def read_package_config(source_dir):
+    """
+    Returns the root directories of the local packages listed in the package
+    config produced by `pub get`, by name, or None if there is no config.
+    """
+    config_file = find_upwards(source_dir, os.path.join('.dart_tool', 'package_config.json'))
+    if not config_file:
+        return None
+    with open(config_file, 'rt') as f:
+        config = json.load(f)
+    config_dir = os.path.dirname(config_file)
+    result = {}
+    for package in config.get('packages', []):
+        root_uri = package.get('rootUri', '')
+        # Hosted packages have absolute `file://` URIs into the pub cache, and
+        # are covered by `pubspec.lock`.
+        if '://' not in root_uri:
+            result[package.get('name')] = os.path.normpath(os.path.join(config_dir, root_uri))
+    return result
+
+
+def get_flutter_version():
+    """
+    Returns the version of the Flutter SDK, which is used for compiling apps.
+    """
+    if AppCache.FLUTTER_VERSION is None:
+        flutter_cmd = 'flutter.bat' if sys.platform == 'win32' else 'flutter'
+        try:
+            process = subprocess.run(
+                [flutter_cmd, '--version', '--machine'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            output = process.stdout.decode('utf-8')
+            try:
+                # Skip any messages that may precede the JSON output
+                info = json.loads(output[output.index('{'):])
+                AppCache.FLUTTER_VERSION = ' '.join(
+                    str(info[key])
+                    for key in ['frameworkVersion', 'frameworkRevision', 'engineRevision']
+                    if key in info
+                )
+            except ValueError:
+                AppCache.FLUTTER_VERSION = output.strip()
+        except (OSError, subprocess.CalledProcessError):
+            AppCache.FLUTTER_VERSION = 'unknown'
+    return AppCache.FLUTTER_VERSION
+
+
+def default_cache_dir():
+    directory = os.environ.get('FLUTTER_APP_CACHE_DIR')
+    if directory is None:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        directory = os.path.join(cache_home, 'flame-docs', 'flutter-apps')
+    return directory
+
+
+def write_manifest(apps):
+    """
+    Records which fingerprint produced each of the deployed `apps`, in the file
+    `_static/apps/manifest.json`.
+    """
+    apps_dir = os.path.abspath(os.path.join('..', '_build', 'html', '_static', 'apps'))
+    manifest_file = os.path.join(apps_dir, 'manifest.json')
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'rt') as f:
+            try:
+                manifest = json.load(f)
+            except ValueError:
+                pass
+    for name, entry in apps.items():
+        manifest[name] = {k: v for k, v in entry.items() if k != 'docnames'}
+    os.makedirs(apps_dir, exist_ok=True)
+    with open(manifest_file, 'wt') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def find_flutter_app_directives(filename):
+    """
+    Returns the options of all {flutter-app} directives in the markdown file
+    `filename`, including the indented ones and those within `:::` fences.
+    This is a quick textual scan that allows compiling the apps before the
+    documents are actually parsed.
+    """
+    rx_directive_start = re.compile(r'\s*(`{3,}|~{3,}|:{3,})\{flutter-app\}\s*')
+    rx_option = re.compile(r'\s*:(\w+):\s*(.*?)\s*')
+    result = []
+    options = None
+    with open(filename, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if options is not None:
+                match = re.fullmatch(rx_option, line)
+                if match:
+                    options[match.group(1)] = match.group(2)
+                    continue
+                result.append(options)
+                options = None
+            if re.fullmatch(rx_directive_start, line):
+                options = {}
+    if options is not None:
+        result.append(options)
+    return result
+
 
 def _doc_root():
     root = os.environ.get('PUBLISH_PATH', '')
@@ -268,21 +1320,40 @@ def _doc_root():
 # ------------------------------------------------------------------------------
 
 class IFrame(nodes.Element, nodes.General):
+    """
+    Iframe with an embedded app. Unless the app boots eagerly, this is rendered
+    as a placeholder, which flutter_app.js replaces with the actual iframe when
+    the app is scrolled into view or clicked.
+    """
+
     def visit(self, node):
-        attrs = {'src': node.attributes['src']}
+        attrs = {}
         if 'style' in node.attributes:
             attrs['style'] = node.attributes['style']
-        self.body.append(self.starttag(node, 'iframe', **attrs).strip())
+        boot = node.attributes.get('boot', 'eager')
+        if boot == 'eager':
+            attrs['src'] = node.attributes['src']
+            self.body.append(self.starttag(node, 'iframe', **attrs).strip())
+        else:
+            attrs['data-src'] = node.attributes['src']
+            attrs['data-boot'] = boot
+            attrs['title'] = 'Run'
+            self.body.append(self.starttag(
+                node, 'div', CLASS='flutter-app-placeholder', **attrs).strip())
 
-    def depart(self, _):
-        self.body.append('</iframe>')
+    def depart(self, node):
+        if node.attributes.get('boot', 'eager') == 'eager':
+            self.body.append('</iframe>')
+        else:
+            self.body.append('</div>')
 
 
 class Button(nodes.Element, nodes.General):
     def visit(self, node):
         attrs = {}
-        if 'onclick' in node.attributes:
-            attrs['onclick'] = node.attributes['onclick']
+        for name in ['onclick', 'onmouseenter']:
+            if name in node.attributes:
+                attrs[name] = node.attributes[name]
         self.body.append(self.starttag(node, 'button', **attrs).strip())
 
     def depart(self, _):
@@ -293,6 +1364,98 @@ class Button(nodes.Element, nodes.General):
 # Extension setup
 # ------------------------------------------------------------------------------
 
+# Emitted after the environment has determined the list of all added and
+# changed files and just before it reads them. All the apps used by these
+# documents start compiling here, so that they are built concurrently while the
+# documents are being read. In a parallel build, the compilations are completed
+# before the reader processes are forked, and the readers reuse their results.
+#
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-before-read-docs
+def on_env_before_read_docs(app, env, docnames):
+    if not hasattr(env, 'flutter_apps'):
+        env.flutter_apps = {}
+    if not hasattr(env, 'flutter_app_code'):
+        env.flutter_app_code = {}
+    for docname in docnames:
+        filename = env.doc2path(docname)
+        if not filename.endswith('.md'):
+            continue
+        for options in find_flutter_app_directives(filename):
+            modes = (options.get('show') or 'widget').split()
+            if not options.get('sources') or not ('widget' in modes or 'popup' in modes):
+                continue
+            source_dir = os.path.abspath(options['sources'])
+            if os.path.isdir(source_dir):
+                schedule_compilation(source_dir, env)
+    if app.parallel > 1 and FlutterAppDirective.COMPILING:
+        with span('flutter_app', 'precompile apps'):
+            # Errors are reported by the directives that use the failed apps
+            concurrent.futures.wait(FlutterAppDirective.COMPILING.values())
+        # Forking a process while other threads are running is unsafe
+        FlutterAppDirective.EXECUTOR.shutdown()
+        FlutterAppDirective.EXECUTOR = None
+
+
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-purge-doc
+def on_env_purge_doc(app, env, docname):
+    for table in [getattr(env, 'flutter_apps', {}), getattr(env, 'flutter_app_code', {})]:
+        for key in list(table):
+            table[key]['docnames'].discard(docname)
+            if not table[key]['docnames']:
+                del table[key]
+
+
+# Merges the apps deployed and the code listings registered by a parallel
+# reader process into the main environment.
+#
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-env-merge-info
+def on_env_merge_info(app, env, docnames, other):
+    for attr in ['flutter_apps', 'flutter_app_code']:
+        if not hasattr(env, attr):
+            setattr(env, attr, {})
+        table = getattr(env, attr)
+        for key, entry in getattr(other, attr, {}).items():
+            if key in table:
+                entry = dict(entry, docnames=entry['docnames'] | table[key]['docnames'])
+            table[key] = entry
+
+
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-config-inited
+def on_config_inited(app, config):
+    if config.flutter_app_boot not in BOOT_MODES:
+        raise ConfigError(
+            f'flutter_app_boot must be one of {", ".join(BOOT_MODES)}, '
+            f'not {config.flutter_app_boot!r}')
+    # The limit is read by flutter_app.js
+    app.add_js_file(None, body=f'var flutter_app_max_active = {config.flutter_app_max_active};')
+
+
+def on_build_finished(app, exc):
+    if FlutterAppDirective.EXECUTOR is not None:
+        FlutterAppDirective.EXECUTOR.shutdown()
+        FlutterAppDirective.EXECUTOR = None
+    FlutterAppDirective.COMPILING.clear()
+    listings = getattr(app.env, 'flutter_app_code', None)
+    if listings and not exc and hasattr(app.builder, 'highlighter'):
+        with span('flutter_app', 'write code listings'):
+            write_code_listings(app, listings)
+    SourceTree.INSTANCES.clear()
+    if CodeListings.INSTANCE is not None:
+        if not exc:
+            CodeListings.INSTANCE.evict()
+        CodeListings.INSTANCE = None
+    _tree_digests.clear()
+    apps = getattr(app.env, 'flutter_apps', None)
+    if apps:
+        write_manifest(apps)
+    apps_dir = os.path.abspath(os.path.join('..', '_build', 'html', '_static', 'apps'))
+    if not exc and os.path.isdir(apps_dir):
+        BlobStore(os.path.join(apps_dir, BLOBS_DIR)).collect_garbage(apps_dir)
+    cache = AppCache.get_instance(app.config)
+    if cache is not None and not exc:
+        cache.evict()
+
+
 def setup(app):
     base_dir = os.path.dirname(__file__)
     target_dir = os.path.abspath('../_build/html/_static/')
@@ -303,10 +1466,22 @@ def setup(app):
     app.add_node(IFrame, html=(IFrame.visit, IFrame.depart))
     app.add_node(Button, html=(Button.visit, Button.depart))
     app.add_directive('flutter-app', FlutterAppDirective)
+    app.add_config_value('flutter_app_jobs', min(4, os.cpu_count() or 1), '', int)
+    app.add_config_value('flutter_app_cache_dir', default_cache_dir(), '', str)
+    app.add_config_value('flutter_app_cache_size', 2 * 1024 * 1024 * 1024, '', int)
+    app.add_config_value('flutter_app_sync_mode', 'copy', '', str)
+    app.add_config_value('flutter_app_shared_assets', False, '', bool)
+    app.add_config_value('flutter_app_boot', 'eager', 'env', str)
+    app.add_config_value('flutter_app_max_active', 0, 'html', int)
+    app.connect('config-inited', on_config_inited)
+    app.connect('env-before-read-docs', on_env_before_read_docs)
+    app.connect('env-purge-doc', on_env_purge_doc)
+    app.connect('env-merge-info', on_env_merge_info)
+    app.connect('build-finished', on_build_finished)
     app.add_js_file('flutter_app.js')
     app.add_css_file('flutter_app.css')
     return {
-        'parallel_read_safe': False,
-        'parallel_write_safe': False,
-        'env_version': 1,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+        'env_version': 3,
     }
@@ -4,6 +4,8 @@ import shutil
 from docutils import nodes
 from sphinx.util.docutils import SphinxDirective
 
+from .profiler import span
+
 
 class PackageDirective(SphinxDirective):
     has_content = True
@@ -12,7 +14,8 @@ class PackageDirective(SphinxDirective):
 
     def run(self):
         pkg_name = self.arguments[0]
-        relative_path = self.find_package(pkg_name)
+        with span('package', 'find_package ' + pkg_name, doc=self.env.docname):
+            relative_path = self.find_package(pkg_name)
         link = []
         self.state.nested_parse([f"[{pkg_name}]({relative_path})"], 0, link)
         content = []
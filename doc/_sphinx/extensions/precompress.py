@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from sphinx.application import Sphinx
+from sphinx.util.logging import getLogger
+
+from .profiler import span
+
+try:
+    import brotli
+except ImportError:  # without brotli, only the .gz files are produced
+    brotli = None
+
+logger = getLogger('precompress')
+
+
+# ------------------------------------------------------------------------------
+# Compression
+# ------------------------------------------------------------------------------
+
+# Suffixes of the compressed files, by the compression format
+SUFFIXES = {'gzip': '.gz', 'brotli': '.br'}
+
+# Types of files that are worth compressing
+DEFAULT_EXTENSIONS = [
+    '.css', '.html', '.js', '.json', '.map', '.mjs', '.otf', '.svg', '.ttf', '.txt',
+    '.wasm', '.xml',
+]
+
+
+def compress_file(filename: str, previous: Optional[Dict[str, Any]],
+                  settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Writes the compressed versions of the file `filename` next to it (such as
+    `filename.gz`), in all formats given by the `settings`. The `previous` entry
+    describes the output of the previous build: if the file has not changed
+    since then and its compressed versions are still there, they are reused.
+
+    Returns the entry for the file: the digest of its content, its size, and
+    the sizes of the compressed files (or None for the formats where the
+    compressed file would not be smaller than the original).
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if previous is not None and previous['digest'] == digest and all(
+        size is None or _get_size(filename + SUFFIXES[fmt]) == size
+        for fmt, size in previous['compressed'].items()
+    ):
+        return dict(previous, reused=True)
+    compressed = {}
+    for fmt, suffix in SUFFIXES.items():
+        target = filename + suffix
+        if fmt not in settings['formats']:
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        if fmt == 'gzip':
+            # Zero mtime keeps the output reproducible
+            output = gzip.compress(data, compresslevel=settings['gzip_level'], mtime=0)
+        else:
+            output = brotli.compress(data, quality=settings['brotli_quality'])
+        if len(output) >= len(data):
+            compressed[fmt] = None
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        temp_target = f'{target}.{os.getpid()}.tmp'
+        with open(temp_target, 'wb') as f:
+            f.write(output)
+        os.replace(temp_target, target)
+        compressed[fmt] = len(output)
+    return {'digest': digest, 'size': len(data), 'compressed': compressed, 'reused': False}
+
+
+def _get_size(filename: str) -> Optional[int]:
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return None
+
+
+def find_compressible_files(outdir: str, extensions: List[str], min_size: int) -> List[str]:
+    """
+    Returns the paths (relative to `outdir`) of the files to be compressed.
+    """
+    result = []
+    for root, _, files in os.walk(outdir):
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            filename = os.path.join(root, name)
+            if os.path.getsize(filename) >= min_size:
+                result.append(os.path.relpath(filename, outdir))
+    result.sort()
+    return result
+
+
+def precompress(outdir: str, manifest_file: str, settings: Dict[str, Any],
+                jobs: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Compresses all eligible files in `outdir`, reusing the results of the
+    previous build recorded in the `manifest_file`. Returns the entries for all
+    compressed files, keyed by their paths relative to `outdir`.
+    """
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, 'rt') as f:
+            try:
+                manifest = json.load(f)
+            except ValueError:
+                pass
+    previous_files = manifest.get('files', {})
+    # The compressed files cannot be reused if they were produced differently
+    reusable_files = previous_files if manifest.get('settings') == settings else {}
+
+    paths = find_compressible_files(outdir, settings['extensions'], settings['min_size'])
+    files = {}
+    if jobs > 1 and len(paths) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                path: executor.submit(
+                    compress_file, os.path.join(outdir, path), reusable_files.get(path),
+                    settings)
+                for path in paths
+            }
+            for path, future in futures.items():
+                files[path] = future.result()
+    else:
+        for path in paths:
+            files[path] = compress_file(
+                os.path.join(outdir, path), reusable_files.get(path), settings)
+
+    # Remove the compressed versions of the files that no longer exist
+    for path in previous_files:
+        if path not in files:
+            for suffix in SUFFIXES.values():
+                filename = os.path.join(outdir, path + suffix)
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    with open(manifest_file, 'wt') as f:
+        json.dump({
+            'settings': settings,
+            'files': {
+                path: {k: v for k, v in entry.items() if k != 'reused'}
+                for path, entry in files.items()
+            },
+        }, f, indent=1, sort_keys=True)
+    return files
+
+
+def log_report(files: Dict[str, Dict[str, Any]], formats: List[str], elapsed: float) -> None:
+    reused = sum(1 for entry in files.values() if entry['reused'])
+    logger.info(
+        f'precompressed {len(files)} files in {elapsed:.2f}s '
+        f'({len(files) - reused} compressed, {reused} unchanged)'
+    )
+    for fmt in formats:
+        original_size = 0
+        compressed_size = 0
+        for entry in files.values():
+            size = entry['compressed'].get(fmt)
+            if size is not None:
+                original_size += entry['size']
+                compressed_size += size
+        if original_size:
+            logger.info(
+                f'  {fmt}: {original_size:,} -> {compressed_size:,} bytes '
+                f'({compressed_size / original_size:.1%})'
+            )
+    largest = sorted(files.items(), key=lambda item: -item[1]['size'])[:5]
+    for path, entry in largest:
+        ratios = ', '.join(
+            f'{fmt} {entry["compressed"][fmt] / entry["size"]:.1%}'
+            for fmt in formats
+            if entry['compressed'].get(fmt) is not None
+        )
+        logger.info(f'  {entry["size"]:>12,}  {path}  ({ratios or "incompressible"})')
+
+
+# ------------------------------------------------------------------------------
+# Event handlers
+# ------------------------------------------------------------------------------
+
+# Emitted when the build has finished. This runs after the handlers of other
+# extensions (see the priority in `setup()`), since some of them write more
+# files into the output folder at this point.
+#
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-build-finished
+def on_build_finished(app: Sphinx, exc) -> None:
+    config = app.config
+    if exc or not config.precompress_enabled or app.builder.format != 'html':
+        return
+    formats = [fmt for fmt in config.precompress_formats if fmt in SUFFIXES]
+    if 'brotli' in formats and brotli is None:
+        logger.info('precompress: the `brotli` module is not installed, skipping .br files')
+        formats.remove('brotli')
+    if not formats:
+        return
+    settings = {
+        'formats': formats,
+        'gzip_level': config.precompress_gzip_level,
+        'brotli_quality': config.precompress_brotli_quality,
+        'extensions': sorted(ext.lower() for ext in config.precompress_extensions),
+        'min_size': config.precompress_min_size,
+    }
+    manifest_file = os.path.join(app.doctreedir, 'precompress.json')
+    start_time = time.perf_counter()
+    with span('precompress', 'precompress ' + ', '.join(formats)):
+        files = precompress(app.outdir, manifest_file, settings, config.precompress_jobs)
+    log_report(files, formats, time.perf_counter() - start_time)
+
+
+def setup(app: Sphinx):
+    app.add_config_value('precompress_enabled', False, '', bool)
+    app.add_config_value('precompress_formats', ['gzip', 'brotli'], '', list)
+    app.add_config_value('precompress_gzip_level', 9, '', int)
+    app.add_config_value('precompress_brotli_quality', 11, '', int)
+    app.add_config_value('precompress_extensions', DEFAULT_EXTENSIONS, '', list)
+    app.add_config_value('precompress_min_size', 1024, '', int)
+    app.add_config_value('precompress_jobs', os.cpu_count() or 1, '', int)
+    app.connect('build-finished', on_build_finished, priority=900)
+    return {
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+        'env_version': 1,
+    }
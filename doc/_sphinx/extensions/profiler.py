@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+import contextlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sphinx.application import Sphinx
+from sphinx.util.logging import getLogger
+
+logger = getLogger('profiler')
+
+
+# ------------------------------------------------------------------------------
+# Profiler
+# ------------------------------------------------------------------------------
+
+class Profiler:
+    """
+    Collects the timings of the build, when profiling is enabled via the `profiler_enabled`
+    config value (or the DOCS_PROFILE environment variable).
+
+    Other extensions report the time spent in their code through `span()`, which does nothing
+    when profiling is disabled. Processes forked by Sphinx for parallel reading and writing
+    cannot send their timings back to the main process directly, so instead they append them to
+    a spool file, which the main process loads at the end of the build.
+    """
+    enabled = False
+    # Id of the process that runs the build
+    pid = 0
+    start_time = 0.0
+    # Events recorded in the main process
+    events: List[Dict[str, Any]] = []
+    # Directory for the events recorded in forked processes
+    spool_dir: Optional[str] = None
+    # Start times of the documents being read, keyed by docname
+    reading: Dict[str, float] = {}
+
+    @staticmethod
+    def record(event: Dict[str, Any]) -> None:
+        pid = os.getpid()
+        event['pid'] = pid
+        if pid == Profiler.pid or Profiler.spool_dir is None:
+            Profiler.events.append(event)
+        else:
+            spool_file = os.path.join(Profiler.spool_dir, f'{pid}.jsonl')
+            with open(spool_file, 'at') as f:
+                f.write(json.dumps(event) + '\n')
+
+    @staticmethod
+    def collect() -> List[Dict[str, Any]]:
+        """
+        Returns all events recorded during the build, including those from forked processes.
+        """
+        events = list(Profiler.events)
+        if Profiler.spool_dir and os.path.isdir(Profiler.spool_dir):
+            for name in sorted(os.listdir(Profiler.spool_dir)):
+                with open(os.path.join(Profiler.spool_dir, name), 'rt') as f:
+                    events.extend(json.loads(line) for line in f if line.strip())
+        return events
+
+
+@contextlib.contextmanager
+def span(category: str, name: str, doc: Optional[str] = None, subprocess: bool = False,
+         **args: Any):
+    """
+    Measures the time spent within the `with` block, when profiling is enabled.
+
+    The `category` is the name of the extension, and the `name` describes the work being done
+    (such as a directive instance). Spans that wait for an external program should be marked
+    with `subprocess=True`, and those that process a particular document should give its `doc`.
+    """
+    if not Profiler.enabled:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        Profiler.record({
+            'cat': category,
+            'name': name,
+            'doc': doc,
+            'subprocess': subprocess,
+            'start': start_time - Profiler.start_time,
+            'duration': end_time - start_time,
+            'args': args,
+        })
+
+
+# ------------------------------------------------------------------------------
+# Reports
+# ------------------------------------------------------------------------------
+
+def summarize(events: List[Dict[str, Any]], total_time: float) -> Dict[str, Any]:
+    """
+    Aggregates the `events` per extension, per directive instance (or other named span), and
+    per document.
+    """
+    def get_entry(table: Dict[str, Dict], key: str) -> Dict:
+        return table.setdefault(key, {'calls': 0, 'time': 0.0, 'subprocess_time': 0.0})
+
+    def add(table: Dict[str, Dict], key: str, event: Dict, nested: bool = False) -> None:
+        entry = get_entry(table, key)
+        if not nested:
+            entry['calls'] += 1
+            entry['time'] += event['duration']
+        if event['subprocess']:
+            entry['subprocess_time'] += event['duration']
+
+    extensions: Dict[str, Dict] = {}
+    spans: Dict[str, Dict] = {}
+    documents: Dict[str, Dict] = {}
+    # End time of the last outermost span of each extension in each process: the spans nested
+    # within it are not added to the extension's time again.
+    outer_end: Dict[Tuple[int, str], float] = {}
+    for event in sorted(events, key=lambda e: (e['start'], -e['duration'])):
+        end = event['start'] + event['duration']
+        key = (event['pid'], event['cat'])
+        nested = end <= outer_end.get(key, -1.0)
+        if not nested:
+            outer_end[key] = end
+        add(extensions, event['cat'], event, nested)
+        add(spans, f'{event["cat"]}: {event["name"]}', event)
+        if event['doc'] is None:
+            continue
+        if event['cat'] == 'sphinx':
+            # Reading a document includes all the directives within it, so this is tracked
+            # separately, and the documents are ranked by their reading time.
+            get_entry(documents, event['doc'])['read_time'] = event['duration']
+        else:
+            add(documents, event['doc'], event)
+
+    def by_time(table: Dict[str, Dict]) -> Dict[str, Dict]:
+        return dict(sorted(table.items(), key=lambda item: -item[1]['time']))
+
+    return {
+        'total_time': total_time,
+        'extensions': by_time(extensions),
+        'spans': by_time(spans),
+        'documents': dict(sorted(
+            documents.items(), key=lambda item: -item[1].get('read_time', item[1]['time'])
+        )),
+    }
+
+
+def make_trace(events: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Converts the `events` into the Chrome trace-event format, which can be opened in
+    `chrome://tracing` or https://ui.perfetto.dev.
+    """
+    trace_events = []
+    for event in events:
+        args = dict(event['args'])
+        if event['doc'] is not None:
+            args['doc'] = event['doc']
+        trace_events.append({
+            'name': event['name'],
+            'cat': event['cat'] + (',subprocess' if event['subprocess'] else ''),
+            'ph': 'X',
+            'ts': round(event['start'] * 1e6),
+            'dur': round(event['duration'] * 1e6),
+            'pid': event['pid'],
+            'tid': event['pid'],
+            'args': args,
+        })
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def log_top_entries(summary: Dict[str, Any], n: int) -> None:
+    def print_table(title: str, table: Dict[str, Dict], key: str) -> None:
+        logger.info(f'{title}:')
+        for name, entry in list(table.items())[:n]:
+            time_spent = entry.get(key, entry['time'])
+            line = f'  {time_spent:9.3f}s  {name}'
+            if entry['subprocess_time']:
+                line += f'  (subprocess: {entry["subprocess_time"]:.3f}s)'
+            logger.info(line)
+
+    logger.info(f'build profile: {summary["total_time"]:.2f}s in total')
+    print_table('time per extension', summary['extensions'], 'time')
+    print_table(f'top {n} slowest documents', summary['documents'], 'read_time')
+    spans = {
+        name: entry
+        for name, entry in summary['spans'].items()
+        if not name.startswith('sphinx: ')
+    }
+    print_table(f'top {n} slowest directives and operations', spans, 'time')
+
+
+# ------------------------------------------------------------------------------
+# Event handlers
+# ------------------------------------------------------------------------------
+
+def on_builder_inited(app: Sphinx) -> None:
+    Profiler.enabled = bool(app.config.profiler_enabled)
+    if not Profiler.enabled:
+        return
+    Profiler.pid = os.getpid()
+    Profiler.start_time = time.perf_counter()
+    Profiler.events = []
+    Profiler.reading = {}
+    Profiler.spool_dir = tempfile.mkdtemp(prefix='sphinx-profile-')
+
+
+# Emitted when a source file has been read; the end of its reading is marked by the event
+# `doctree-read` below.
+#
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-source-read
+def on_source_read(app: Sphinx, docname: str, _) -> None:
+    if Profiler.enabled:
+        Profiler.reading[docname] = time.perf_counter()
+
+
+# https://www.sphinx-doc.org/en/master/extdev/appapi.html#event-doctree-read
+def on_doctree_read(app: Sphinx, _) -> None:
+    start_time = Profiler.reading.pop(app.env.docname, None)
+    if start_time is not None:
+        Profiler.record({
+            'cat': 'sphinx',
+            'name': 'read ' + app.env.docname,
+            'doc': app.env.docname,
+            'subprocess': False,
+            'start': start_time - Profiler.start_time,
+            'duration': time.perf_counter() - start_time,
+            'args': {},
+        })
+
+
+def on_build_finished(app: Sphinx, exc) -> None:
+    if not Profiler.enabled:
+        return
+    total_time = time.perf_counter() - Profiler.start_time
+    events = Profiler.collect()
+    if Profiler.spool_dir:
+        shutil.rmtree(Profiler.spool_dir, ignore_errors=True)
+        Profiler.spool_dir = None
+    output_dir = app.config.profiler_output_dir or os.path.dirname(app.outdir)
+    os.makedirs(output_dir, exist_ok=True)
+    summary = summarize(events, total_time)
+    with open(os.path.join(output_dir, 'profile.json'), 'wt') as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(output_dir, 'profile-trace.json'), 'wt') as f:
+        json.dump(make_trace(events), f)
+    log_top_entries(summary, app.config.profiler_top)
+    logger.info(f'build profile saved into {os.path.abspath(output_dir)}')
+
+
+def setup(app: Sphinx):
+    app.add_config_value('profiler_enabled', bool(os.environ.get('DOCS_PROFILE')), '', bool)
+    app.add_config_value('profiler_output_dir', '', '', str)
+    app.add_config_value('profiler_top', 10, '', int)
+    app.connect('builder-inited', on_builder_inited)
+    app.connect('source-read', on_source_read)
+    app.connect('doctree-read', on_doctree_read)
+    app.connect('build-finished', on_build_finished)
+    return {
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+        'env_version': 1,
+    }
@@ -3,6 +3,8 @@ import shutil
 from pygments.lexer import RegexLexer, bygroups, default, include, words
 from pygments.token import *
 
+from .profiler import span
+
 
 class YarnLexer(RegexLexer):
     name = 'YarnSpinner'
@@ -191,6 +193,10 @@ class YarnLexer(RegexLexer):
         ],
     }
 
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        with span('yarn_lexer', 'highlight'):
+            yield from super().get_tokens_unprocessed(text, stack)
+
 
 def setup(app):
     base_dir = os.path.dirname(__file__)
@@ -0,0 +1,147 @@
+import io
+import os
+import sys
+from typing import Dict, List, Optional
+
+import pytest
+from sphinx.application import Sphinx
+from sphinx.util.docutils import docutils_namespace
+
+# Makes the `extensions` package importable, the same way as for `conf.py`
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from extensions import flutter_app  # noqa: E402
+
+FAKE_DARTDOC_JSON = os.path.join(os.path.dirname(__file__), 'fake_dartdoc_json.py')
+FAKE_FLUTTER = os.path.join(os.path.dirname(__file__), 'fake_flutter.py')
+
+
+@pytest.fixture
+def build_docs(tmp_path):
+    """
+    Returns a function that builds the html docs of a temporary project, with the `dart` domain
+    enabled. The Dart API data is injected into the domain directly, so neither Dart nor
+    `dartdoc_json` is needed.
+
+    The function takes the `documents` (markdown text keyed by docname), the `api_data` (lists
+    of declarations in the format of `dartdoc_json`, keyed by the file name relative to the root
+    of the package `test`), and overrides for the configuration. Alternatively, the `sources` of
+    Dart files can be given, which are then extracted by `dartdoc_json`.
+
+    Files from previous calls are kept, and the unchanged documents and sources are not written
+    again, so that consecutive builds are incremental unless `fresh` is given. Several independent projects can be built by giving them different
+    `project` names, they all share the same dartdoc cache. The `builder` is 'html' by default,
+    and 'dummy' may be used where the output is not needed. The number of processes is given by
+    `parallel`, as with `sphinx-build -j`. The function returns the Sphinx application after the
+    build, where the warnings are in `app.warnings`.
+
+    Each project mirrors the layout of the `doc` folder: the build runs from its `_sphinx` folder
+    and writes into `_build`, which is where the `flutter_app` extension expects the output.
+    """
+
+    def build(documents: Dict[str, str], api_data: Optional[Dict[str, List[Dict]]] = None,
+              sources: Optional[Dict[str, str]] = None, fresh: bool = False,
+              builder: str = 'html', project: str = '', parallel: int = 1,
+              **config) -> Sphinx:
+        project_dir = tmp_path / project
+        src_dir = project_dir / 'src'
+        lib_dir = project_dir / 'lib'
+        src_dir.mkdir(parents=True, exist_ok=True)
+        lib_dir.mkdir(exist_ok=True)
+        for docname, text in documents.items():
+            write_if_changed(src_dir / f'{docname}.md', text)
+        for name, text in (sources or {}).items():
+            write_if_changed(lib_dir / name, text)
+        file_jsons = {}
+        for name, declarations in (api_data or {}).items():
+            filename = str(lib_dir / name)
+            with open(filename, 'wt') as f:
+                f.write('// Stands in for the API data injected by the test\n')
+            file_jsons[filename] = {'source': filename, 'declarations': declarations}
+
+        def inject_api_data(_, env, __):
+            domain = env.get_domain('dart')
+            for filename, file_json in file_jsons.items():
+                domain.store_file_data(filename, file_json, os.path.getmtime(filename))
+
+        warnings = io.StringIO()
+        conf_dir = project_dir / '_sphinx'
+        conf_dir.mkdir(exist_ok=True)
+        cwd = os.getcwd()
+        os.chdir(conf_dir)
+        try:
+            with docutils_namespace():
+                app = Sphinx(
+                    srcdir=str(src_dir),
+                    confdir=None,
+                    outdir=str(project_dir / '_build' / 'html'),
+                    doctreedir=str(project_dir / '_build' / 'doctrees'),
+                    buildername=builder,
+                    confoverrides={
+                        'extensions': ['myst_parser', 'extensions.dart_domain'],
+                        'primary_domain': 'dart',
+                        'dartdoc_roots': {'test': str(lib_dir)},
+                        'dartdoc_cache_dir': str(tmp_path / 'cache'),
+                        **config,
+                    },
+                    status=None,
+                    warning=warnings,
+                    freshenv=fresh,
+                    parallel=parallel,
+                )
+                app.connect('env-before-read-docs', inject_api_data, priority=100)
+                app.build()
+        finally:
+            os.chdir(cwd)
+        app.warnings = warnings.getvalue()
+        return app
+
+    return build
+
+
+@pytest.fixture
+def fake_dartdoc_json(tmp_path, monkeypatch):
+    """
+    Puts the stand-in `dartdoc_json` tool on the PATH. It logs each of its runs into
+    `tmp_path/dartdoc_json.log`; the fixture returns a function that reads this log as pairs of
+    the pid of the run and the list of the extracted files.
+    """
+    install_command(tmp_path, monkeypatch, 'dartdoc_json', FAKE_DARTDOC_JSON)
+    log_file = tmp_path / 'dartdoc_json.log'
+    log_file.touch()
+    monkeypatch.setenv('FAKE_DARTDOC_JSON_LOG', str(log_file))
+    return lambda: [
+        (pid, files.split(' '))
+        for pid, files in (line.split(' ', 1) for line in log_file.read_text().splitlines())
+    ]
+
+
+@pytest.fixture
+def fake_flutter(tmp_path, monkeypatch):
+    """
+    Puts the stand-in `flutter` command on the PATH. It logs the directories of the compiled
+    apps into `tmp_path/flutter.log`; the fixture returns a function that reads this log.
+    """
+    install_command(tmp_path, monkeypatch, 'flutter', FAKE_FLUTTER)
+    log_file = tmp_path / 'flutter.log'
+    log_file.touch()
+    monkeypatch.setenv('FAKE_FLUTTER_LOG', str(log_file))
+    monkeypatch.setattr(flutter_app.AppCache, 'FLUTTER_VERSION', None)
+    return lambda: log_file.read_text().splitlines()
+
+
+def write_if_changed(path, text: str) -> None:
+    if not path.is_file() or path.read_text() != text:
+        path.write_text(text)
+
+
+def install_command(tmp_path, monkeypatch, name: str, script: str) -> None:
+    """
+    Makes the Python `script` available as the command `name`, for the duration of the test.
+    """
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir(exist_ok=True)
+    command = bin_dir / name
+    command.write_text(f'#!/bin/sh\nexec {sys.executable} {script} "$@"\n')
+    command.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Stand-in for the `dartdoc_json` tool, for testing without a Dart SDK.
+
+It takes the Dart files as command line arguments, and prints a JSON list with one entry per
+file, where only the classes, mixins and extensions of each file are extracted together with
+their doc-comments. If the environment variable `FAKE_DARTDOC_JSON_LOG` is set, the tool appends
+a line with its pid and the requested files to that file, and `FAKE_DARTDOC_JSON_DELAY` makes
+every run take that many seconds longer.
+"""
+import json
+import os
+import re
+import sys
+import time
+from typing import Dict
+
+DECLARATION_RX = re.compile(
+    r'((?:^[ \t]*///.*\n)*)^(?:abstract |base |sealed |final )*(class|mixin|extension) (\w+)',
+    re.MULTILINE,
+)
+
+
+def extract(filename: str) -> Dict:
+    with open(filename, 'rt', encoding='utf-8') as f:
+        text = f.read()
+    declarations = []
+    for match in DECLARATION_RX.finditer(text):
+        description = '\n'.join(
+            line.strip()[4:] for line in match.group(1).splitlines())
+        declarations.append({
+            'kind': match.group(2),
+            'name': match.group(3),
+            'description': description,
+            'members': [],
+        })
+    return {'source': filename, 'declarations': declarations}
+
+
+def main():
+    files = sys.argv[1:]
+    if files == ['--version']:
+        print('dartdoc_json 0.0.0-fake')
+        return
+    log_file = os.environ.get('FAKE_DARTDOC_JSON_LOG')
+    if log_file:
+        with open(log_file, 'at') as f:
+            f.write(f'{os.getpid()} {" ".join(files)}\n')
+    time.sleep(float(os.environ.get('FAKE_DARTDOC_JSON_DELAY', '0')))
+    try:
+        output = [extract(name) for name in files]
+    except OSError as e:
+        sys.stderr.write(f'{e}\n')
+        sys.exit(1)
+    sys.stdout.write(json.dumps(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+Stand-in for the `flutter` command, used by the tests of the `flutter_app` extension.
+
+It only supports `flutter --version --machine` and `flutter build web`. The build logs the
+app's directory into the file given by the `FAKE_FLUTTER_LOG` environment variable, takes
+`FAKE_FLUTTER_DELAY` seconds, and writes a `main.dart.js` together with copies of the app's
+`assets` folder into `build/web`.
+"""
+import json
+import os
+import shutil
+import sys
+import time
+
+
+def main():
+    if sys.argv[1:2] == ['--version']:
+        print(json.dumps({'frameworkVersion': '0.0.0-fake'}))
+        return
+    assert sys.argv[1:3] == ['build', 'web'], sys.argv
+    with open(os.environ['FAKE_FLUTTER_LOG'], 'at') as f:
+        f.write(os.getcwd() + '\n')
+    time.sleep(float(os.environ.get('FAKE_FLUTTER_DELAY', '0')))
+    target_dir = os.path.join('build', 'web')
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.makedirs(target_dir)
+    with open(os.path.join(target_dir, 'main.dart.js'), 'wt') as f:
+        f.write(f'// {os.getcwd()}\n')
+    if os.path.isdir('assets'):
+        shutil.copytree('assets', os.path.join(target_dir, 'assets', 'assets'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Golden-file test of the conversion of doc comments into markdown by the {dartdoc} directive.
+
+The corpus in `golden/augment_comment.json` was collected from the doc comments of the Flame
+packages. Each entry holds the comment together with the names known to the directive when
+rendering it, and the expected result. The members of each symbol are listed separately, since
+they are shared by all the comments within the symbol.
+
+The corpus can be re-collected from the current sources (with the expected results produced by
+the current implementation) by running this file as a script.
+"""
+import json
+import os
+import re
+import sys
+from typing import Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from extensions import dart_domain  # noqa: E402
+from extensions.dart_domain import DartdocDirective, tokenize_comment  # noqa: E402
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), 'golden', 'augment_comment.json')
+PACKAGES_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'packages')
+
+# Tricky inputs that are rare in the sources
+EDGE_CASES = [
+    'Unterminated [reference',
+    'Unterminated `code span with a [reference]',
+    'Unterminated [[link',
+    'Nested [outer [inner] outer] brackets',
+    'Brackets in ``code with ` and [x]`` and after it [x]',
+    'A run of ```` backticks ``` that ```` closes',
+    'Empty [] reference and `` empty code',
+    'Special characters in [a<b>*c*] and [[x`y]]',
+    '[Leading] and trailing [references]',
+    'Triple [[[brackets]]] and a [param] and a [member]',
+]
+
+
+def load_corpus() -> Dict:
+    with open(CORPUS_FILE, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def augment_comment(entry: Dict, members: List[str]) -> str:
+    """
+    Converts the comment of the corpus `entry` the same way as the {dartdoc} directive would.
+    """
+    directive = DartdocDirective.__new__(DartdocDirective)
+    directive.symbol = entry['symbol']
+    directive.member_set = set(members)
+    directive.param_set = set(entry['params'])
+    directive.links = entry['links']
+    directive._augment_context = None
+    return directive._augment_comment(entry['text'])
+
+
+def test_augment_comment():
+    corpus = load_corpus()
+    mismatches = [
+        entry['id']
+        for entry in corpus['comments']
+        if augment_comment(entry, corpus['members'][entry['symbol']]) != entry['expected']
+    ]
+    assert mismatches == []
+    assert len(corpus['comments']) > 1000
+
+
+def test_augment_comment_memo_is_bounded():
+    memo = dart_domain.augment_comment
+    max_size = memo.cache_info().maxsize
+    for i in range(max_size + 100):
+        memo(f'Comment {i} with a [reference].', frozenset(), 'Foo', frozenset(), ())
+    assert memo.cache_info().currsize == max_size
+
+
+def test_augment_comment_unknown_link(build_docs):
+    app = build_docs(
+        {'index': '# Index\n\n```{dartdoc}\n:package: test\n:symbol: Foo\n:file: test.dart\n```\n'},
+        {'test.dart': [{'kind': 'class', 'name': 'Foo', 'description': 'See [[Missing]].',
+                        'members': []}]},
+    )
+    assert 'Unexpected link Missing, please specify its target URL' in app.warnings
+
+
+# ------------------------------------------------------------------------------
+# Collection of the corpus
+# ------------------------------------------------------------------------------
+
+rx_doc_line = re.compile(r'^\s*/// ?(.*)$')
+rx_owner = re.compile(
+    r'^(?:(?:abstract|base|final|interface|sealed|mixin)\s+)*'
+    r'(?:class|mixin|extension|enum|extension type)\s+(\w+)'
+)
+rx_accessor = re.compile(r'\b(?:get|set)\s+(\w+)')
+rx_function = re.compile(r'(\w+)\s*(?:<[^>]*>)?\s*\(')
+rx_variable = re.compile(r'(\w+)\s*(?:=|;)')
+rx_parameter = re.compile(r'(\w+)\s*(?:=[^,)\]}]*)?\s*[,)\]}]')
+
+
+def collect_doc_comments(filename: str) -> List[Dict]:
+    """
+    Collects the doc comments of the Dart file `filename`, each with the names known to the
+    directive when rendering it: the owner symbol and its documented members, the parameters of
+    the commented declaration, and links for all `[[NAME]]` references.
+    """
+    with open(filename, 'rt', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    comments = []
+    owner = None
+    i = 0
+    while i < len(lines):
+        match = rx_owner.match(lines[i])
+        if match:
+            owner = match.group(1)
+        if not rx_doc_line.match(lines[i]):
+            i += 1
+            continue
+        doc_lines = []
+        while i < len(lines) and rx_doc_line.match(lines[i]):
+            doc_lines.append(rx_doc_line.match(lines[i]).group(1))
+            i += 1
+        while i < len(lines) and lines[i].strip().startswith('@'):
+            i += 1
+        declaration = '\n'.join(lines[i:i + 5])
+        symbol = owner
+        name = None
+        params = []
+        match = rx_owner.match(lines[i]) if i < len(lines) else None
+        if match:
+            symbol = match.group(1)
+        else:
+            first_line = lines[i] if i < len(lines) else ''
+            match = rx_accessor.search(first_line) or rx_function.search(first_line) or \
+                rx_variable.search(first_line)
+            if match:
+                name = match.group(1)
+            if '(' in first_line:
+                arguments = declaration[declaration.index('('):].split(')')[0] + ')'
+                params = sorted(set(rx_parameter.findall(arguments)))
+        comments.append({
+            'text': '\n'.join(doc_lines),
+            'symbol': symbol or os.path.splitext(os.path.basename(filename))[0],
+            'name': name,
+            'params': params,
+        })
+    members = {}
+    for comment in comments:
+        if comment['name']:
+            members.setdefault(comment['symbol'], set()).add(comment['name'])
+    for comment in comments:
+        comment['members'] = sorted(members.get(comment['symbol'], ()))
+        comment['links'] = {
+            target: f'https://example.com/{target}'
+            for num_brackets, target in tokenize_comment(comment['text'])
+            if num_brackets >= 2
+        }
+        del comment['name']
+    return comments
+
+
+def collect_corpus(packages_dir: str) -> Dict:
+    members = {}
+    comments = []
+    for directory, subdirs, files in os.walk(packages_dir):
+        subdirs[:] = sorted(subdir for subdir in subdirs if not subdir.startswith('.'))
+        if f'{os.sep}lib' not in directory:
+            continue
+        for name in sorted(files):
+            if not name.endswith('.dart'):
+                continue
+            filename = os.path.join(directory, name)
+            for comment in collect_doc_comments(filename):
+                # Only the comments with references exercise the conversion
+                if '[' not in comment['text']:
+                    continue
+                path = os.path.relpath(filename, packages_dir).replace(os.sep, '/')
+                symbol_members = comment.pop('members')
+                # Symbols declared in several files (such as extensions) get all their members
+                members[comment['symbol']] = sorted(
+                    set(members.get(comment['symbol'], [])) | set(symbol_members))
+                comments.append({'id': f'{path}#{len(comments)}', **comment})
+    members['Edge'] = ['member']
+    for i, text in enumerate(EDGE_CASES):
+        comments.append({
+            'id': f'edge-case#{i}',
+            'text': text,
+            'symbol': 'Edge',
+            'params': ['param'],
+            'links': {
+                target: f'https://example.com/{i}'
+                for num_brackets, target in tokenize_comment(text)
+                if num_brackets >= 2
+            },
+        })
+    return {'members': members, 'comments': comments}
+
+
+def main():
+    corpus = collect_corpus(os.path.abspath(PACKAGES_DIR))
+    for entry in corpus['comments']:
+        entry['expected'] = augment_comment(entry, corpus['members'][entry['symbol']])
+    with open(CORPUS_FILE, 'wt', encoding='utf-8') as f:
+        json.dump(corpus, f, indent=1, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+    print(f'Saved {len(corpus["comments"])} doc comments into {CORPUS_FILE}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+import gc
+import importlib.util
+import os
+import time
+
+import myst_parser
+import pytest
+from docutils import nodes
+from myst_parser.mocking import MockState
+
+from extensions import dart_domain
+from extensions.dart_domain import DartDomain, DartdocDirective
+
+DIRECTIVE = '```{dartdoc}\n:package: test\n:symbol: %s\n:file: test.dart\n```\n'
+
+
+def make_class(name, description, members=()):
+    return {'kind': 'class', 'name': name, 'description': description, 'members': list(members)}
+
+
+def read_html(app, docname='index'):
+    """
+    Returns the body of the generated html page.
+    """
+    with open(f'{app.outdir}/{docname}.html', 'rt') as f:
+        html = f.read()
+    return html[html.index('<body'):]
+
+
+# ------------------------------------------------------------------------------
+# Extraction
+# ------------------------------------------------------------------------------
+
+def test_extraction_splits_long_command_lines(tmp_path, fake_dartdoc_json, monkeypatch):
+    files = []
+    for i in range(10):
+        filename = tmp_path / f'file{i}.dart'
+        filename.write_text(f'class Class{i} {{}}\n')
+        files.append(str(filename))
+    max_length = 3 * (len(files[0]) + 3) + len('dartdoc_json')
+    monkeypatch.setattr(dart_domain, 'MAX_COMMAND_LENGTH', max_length)
+    result = dart_domain.run_dartdoc_json(files)
+    assert list(result) == files
+    assert [result[file]['declarations'][0]['name'] for file in files] == \
+        [f'Class{i}' for i in range(10)]
+    runs = [run_files for _, run_files in fake_dartdoc_json()]
+    assert [len(run_files) for run_files in runs] == [3, 3, 3, 1]
+    assert [file for run_files in runs for file in run_files] == files
+
+
+def test_extraction_runs_concurrently(tmp_path, fake_dartdoc_json, monkeypatch):
+    files = []
+    for i in range(4):
+        filename = tmp_path / f'file{i}.dart'
+        filename.write_text(f'class Class{i} {{}}\n')
+        files.append(str(filename))
+    monkeypatch.setenv('FAKE_DARTDOC_JSON_DELAY', '1')
+    start_time = time.perf_counter()
+    result = dart_domain.run_dartdoc_json_parallel(files, jobs=4)
+    # Running the processes one after another would take at least 4 seconds
+    assert time.perf_counter() - start_time < 3
+    assert sorted(result) == files
+    runs = fake_dartdoc_json()
+    assert len({pid for pid, _ in runs}) == 4
+    assert sorted(file for _, run_files in runs for file in run_files) == files
+
+
+def test_extraction_of_all_documents_up_front(build_docs, fake_dartdoc_json):
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{
+            f'page{i}': f'# Page {i}\n\n' + DIRECTIVE.replace('test.dart', f'file{i}.dart')
+            % f'Class{i}'
+            for i in range(4)
+        },
+    }
+    sources = {f'file{i}.dart': f'/// Class {i}.\nclass Class{i} {{}}\n' for i in range(4)}
+    app = build_docs(documents, sources=sources, dartdoc_jobs=2)
+    assert app.warnings == ''
+    # The files of all documents are extracted before the documents are read, by a pool of
+    # `dartdoc_jobs` processes
+    runs = fake_dartdoc_json()
+    assert [len(run_files) for _, run_files in runs] == [2, 2]
+    assert sorted(os.path.basename(file) for _, run_files in runs for file in run_files) == \
+        [f'file{i}.dart' for i in range(4)]
+    for i in range(4):
+        assert f'Class {i}.' in read_html(app, f'page{i}')
+
+
+def test_extraction_output_is_matched_by_source():
+    files = ['/src/a.dart', '/src/b.dart']
+    output = [{'source': '/src/b.dart', 'declarations': []},
+              {'source': '/src/a.dart', 'declarations': []}]
+    result = dart_domain.match_dartdoc_json_output(files, output)
+    assert {file: entry['source'] for file, entry in result.items()} == \
+        {'/src/a.dart': '/src/a.dart', '/src/b.dart': '/src/b.dart'}
+    with pytest.raises(TypeError, match='without the `source`'):
+        dart_domain.match_dartdoc_json_output(files, [{'declarations': []}] * 2)
+    with pytest.raises(TypeError, match='/src/b.dart'):
+        dart_domain.match_dartdoc_json_output(files, [output[1], output[1]])
+
+
+def test_package_indices_are_merged_by_time():
+    def index(timestamp):
+        return {'root': '/src', 'timestamp': timestamp, 'files': {}, 'symbols': {}}
+
+    domain = DartDomain.__new__(DartDomain)
+    domain.data = {'objects': {}, 'xrefs': {}, 'docs': {}, 'files': {},
+                   'packages': {'old': index(1.0), 'new': index(2.0)}}
+    domain.merge_domaindata([], {'objects': {}, 'docs': {}, 'files': {},
+                                 'packages': {'old': index(3.0), 'new': index(1.5),
+                                              'other': index(1.0)}})
+    assert {package: index['timestamp'] for package, index in domain.data['packages'].items()} \
+        == {'old': 3.0, 'new': 2.0, 'other': 1.0}
+
+
+def test_deleted_files_are_purged(build_docs, fake_dartdoc_json, tmp_path):
+    documents = {'index': '# Index\n\n```{dartdoc}\n:package: test\n:symbol: Foo\n```\n'}
+    sources = {'a.dart': '/// Foo.\nclass Foo {}\n', 'b.dart': '/// Bar.\nclass Bar {}\n'}
+    app = build_docs(documents, sources=sources)
+    assert app.warnings == ''
+    deleted = str(tmp_path / 'lib' / 'b.dart')
+    assert deleted in app.env.domaindata['dart']['files']
+    os.remove(deleted)
+    app = build_docs(documents)
+    assert app.warnings == ''
+    data = app.env.domaindata['dart']
+    assert deleted not in data['files']
+    assert deleted not in data['packages']['test']['files']
+    assert 'Bar' not in data['packages']['test']['symbols']
+    assert 'Foo' in data['packages']['test']['symbols']
+
+
+def test_docs_index_and_outdated_check(build_docs, fake_dartdoc_json, tmp_path, monkeypatch):
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{f'page{i}': f'# Page {i}\n\n' + DIRECTIVE % name for i, name in enumerate('ABC')},
+    }
+    source = ''.join(f'/// Class {name}.\nclass {name} {{}}\n' for name in 'ABC')
+    app = build_docs(documents, sources={'test.dart': source})
+    assert app.warnings == ''
+    filename = str(tmp_path / 'lib' / 'test.dart')
+    docs = app.env.domaindata['dart']['docs']
+    assert docs['page1'] == {'symbols': [('test', 'B')], 'files': [filename]}
+    # The file shared by all pages is checked only once
+    getmtime = os.path.getmtime
+    checked = []
+
+    def counting_getmtime(path):
+        if path == filename:
+            checked.append(path)
+        return getmtime(path)
+
+    monkeypatch.setattr(os.path, 'getmtime', counting_getmtime)
+    build_docs(documents)
+    assert len(checked) == 1
+    # Purging a page drops its symbols and only those
+    (tmp_path / 'src' / 'page1.md').unlink()
+    del documents['page1']
+    app = build_docs(documents)
+    data = app.env.domaindata['dart']
+    assert sorted(data['docs']) == ['page0', 'page2']
+    assert sorted(data['objects']['test']) == ['A', 'C']
+
+
+def test_only_pages_with_changed_declarations_are_reread(build_docs, fake_dartdoc_json,
+                                                         tmp_path):
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{f'page{i}': f'# Page {i}\n\n' + DIRECTIVE % name for i, name in enumerate('AB')},
+    }
+    filename = tmp_path / 'lib' / 'test.dart'
+    app = build_docs(documents, sources={'test.dart': '/// A.\nclass A {}\n/// B.\nclass B {}\n'})
+    assert app.warnings == ''
+
+    def rebuild():
+        read_times = dict(app.env.all_docs)
+        # A newer modification time, as after a checkout
+        mtime = filename.stat().st_mtime + 10
+        os.utime(filename, (mtime, mtime))
+        new_app = build_docs(documents)
+        assert new_app.warnings == ''
+        return new_app, sorted(
+            docname for docname in documents
+            if new_app.env.all_docs[docname] != read_times[docname]
+        )
+
+    app, reread = rebuild()
+    assert reread == []
+    filename.write_text('/// A.\nclass A {}\n\n/// B changed.\nclass B {}\n')
+    app, reread = rebuild()
+    assert reread == ['page1']
+    assert 'B changed.' in read_html(app, 'page1')
+
+
+# ------------------------------------------------------------------------------
+# Disk cache
+# ------------------------------------------------------------------------------
+
+def test_disk_cache_entry_evicted_during_get(tmp_path, monkeypatch):
+    cache = dart_domain.DartdocCache(str(tmp_path), max_size=1024)
+    cache.put('ab12', {'declarations': []})
+    utime = os.utime
+
+    def evict_then_utime(path, *args):
+        os.remove(path)  # as if another process evicted the entry right after it was read
+        utime(path, *args)
+
+    monkeypatch.setattr(os, 'utime', evict_then_utime)
+    assert cache.get('ab12') is None
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_disk_cache_entry_evicted_during_evict(tmp_path, monkeypatch):
+    cache = dart_domain.DartdocCache(str(tmp_path), max_size=0)
+    for key in ['ab12', 'cd34']:
+        cache.put(key, {'declarations': []})
+    remove = os.remove
+
+    def remove_twice(path):
+        remove(path)  # as if another process evicted the entry at the same time
+        remove(path)
+
+    monkeypatch.setattr(os, 'remove', remove_twice)
+    cache.evict()
+    assert cache.get('ab12') is None and cache.get('cd34') is None
+
+
+def test_disk_cache_requires_serialization():
+    with pytest.raises(TypeError):
+        dart_domain.DiskCache('cache', max_size=0)
+
+
+# ------------------------------------------------------------------------------
+# Render cache
+# ------------------------------------------------------------------------------
+
+def test_render_cache_restores_tree(build_docs):
+    api_data = {'test.dart': [
+        make_class('Foo', 'The [Bar] class is related.'),
+        make_class('Bar', 'See [Foo].'),
+    ]}
+    documents = {'index': '# Index\n\n' + DIRECTIVE % 'Foo' + '\n' + DIRECTIVE % 'Bar'}
+    app = build_docs(documents, api_data)
+    cache = app.env.get_domain('dart').render_cache
+    assert (cache.hits, cache.misses) == (0, 2)
+    html = read_html(app)
+
+    app = build_docs(documents, api_data, fresh=True)
+    cache = app.env.get_domain('dart').render_cache
+    assert (cache.hits, cache.misses) == (2, 0)
+    assert read_html(app) == html
+    assert 'href="#Bar"' in html
+    assert app.warnings == ''
+
+
+def test_render_cache_key_includes_parser_versions(build_docs, monkeypatch):
+    api_data = {'test.dart': [make_class('Foo', 'Description.')]}
+    documents = {'index': '# Index\n\n' + DIRECTIVE % 'Foo'}
+    build_docs(documents, api_data)
+    monkeypatch.setattr(myst_parser, '__version__', myst_parser.__version__ + '.test')
+    app = build_docs(documents, api_data, fresh=True)
+    cache = app.env.get_domain('dart').render_cache
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_render_cache_skips_descriptions_with_targets(build_docs):
+    description = 'Intro.\n\n(foo-usage)=\n## Usage\n\nText.\n'
+    api_data = {'test.dart': [make_class('Foo', description)]}
+    documents = {
+        'index': '# Index\n\n```{toctree}\nother\n```\n\n' + DIRECTIVE % 'Foo',
+        'other': '# Other\n\nSee {std:ref}`foo-usage` and [](index.md#usage).\n',
+    }
+    for _ in range(2):
+        app = build_docs(documents, api_data, fresh=True, myst_heading_anchors=2)
+        cache = app.env.get_domain('dart').render_cache
+        assert cache.hits == 0
+        html = read_html(app, 'other')
+        assert '<a class="reference internal" href="index.html#foo-usage">' in html
+        assert '<a class="reference internal" href="index.html#usage">' in html
+        assert 'WARNING' not in app.warnings
+
+
+def test_render_cache_skips_descriptions_with_warnings(build_docs):
+    api_data = {'test.dart': [make_class('Foo', 'Uses {nosuchrole}`x`.')]}
+    documents = {'index': '# Index\n\n' + DIRECTIVE % 'Foo'}
+    for fresh in [False, True]:
+        app = build_docs(documents, api_data, fresh=fresh)
+        cache = app.env.get_domain('dart').render_cache
+        assert (cache.hits, cache.misses) == (0, 1)
+        # The warning is reported by every build, as needed for `sphinx-build -W`
+        assert 'nosuchrole' in app.warnings
+
+
+def test_render_cache_is_per_project(build_docs):
+    api_data = {'test.dart': [make_class('Foo', 'Description.')]}
+    documents = {'index': '# Index\n\n' + DIRECTIVE % 'Foo'}
+    app = build_docs(documents, api_data, project='one')
+    assert app.env.get_domain('dart').render_cache.directory.startswith(str(app.doctreedir))
+    app = build_docs(documents, api_data, project='two')
+    cache = app.env.get_domain('dart').render_cache
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+# ------------------------------------------------------------------------------
+# Class members
+# ------------------------------------------------------------------------------
+
+def load_benchmark():
+    """
+    Loads the benchmark script as a module, for its generator of synthetic declarations.
+    """
+    filename = os.path.join(os.path.dirname(__file__), '..', 'benchmark-dart-domain.py')
+    spec = importlib.util.spec_from_file_location('benchmark_dart_domain', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_rendering_scales_linearly(build_docs, monkeypatch):
+    benchmark = load_benchmark()
+    render_times = []
+    render = DartdocDirective._render
+
+    def timed_render(self):
+        gc.collect()
+        start_time = time.perf_counter()
+        result = render(self)
+        render_times.append(time.perf_counter() - start_time)
+        return result
+
+    monkeypatch.setattr(DartdocDirective, '_render', timed_render)
+
+    def time_rendering(n_members):
+        name = f'Synthetic{n_members}'
+        declaration = benchmark.generate_declaration(
+            name, n_members, n_parameters=2, description_length=40, density=0.1, seed=1)
+        build_docs(
+            {'index': '# Index\n\n' + DIRECTIVE % name}, {'test.dart': [declaration]},
+            fresh=True, builder='dummy', dartdoc_cache_dir='',
+        )
+        return render_times[-1]
+
+    small = min(time_rendering(1000) for _ in range(3))
+    large = time_rendering(10000)
+    # A linear implementation takes about 10x longer (plus the garbage collector's overhead),
+    # while a single quadratic pass over the members would make it 100x.
+    assert large < 25 * small
+
+
+def test_descriptions_fall_back_to_separate_parsing(build_docs, monkeypatch):
+    fallback_calls = []
+    nested_parse = MockState.nested_parse
+
+    def escaping_nested_parse(self, block, input_offset, node, *args, **kwargs):
+        if 'description' in node['classes']:
+            fallback_calls.append(block)
+        result = nested_parse(self, block, input_offset, node, *args, **kwargs)
+        if block[0].endswith('{container}'):
+            # As if some description had escaped its fence in the batch
+            node += nodes.paragraph(text='Escaped text.')
+        return result
+
+    monkeypatch.setattr(MockState, 'nested_parse', escaping_nested_parse)
+    members = [
+        {'kind': 'method', 'name': f'method{i}', 'returns': 'void',
+         'parameters': {'all': []}, 'description': f'Description of method {i}.'}
+        for i in range(3)
+    ]
+    api_data = {'test.dart': [make_class('Foo', 'Description of Foo.', members)]}
+    app = build_docs({'index': '# Index\n\n' + DIRECTIVE % 'Foo'}, api_data)
+    assert len(fallback_calls) == 4
+    html = read_html(app)
+    assert 'Escaped text.' not in html
+    assert '<div class="description doc1 docutils container">\n<p>Description of Foo.</p>' \
+        in html
+    for i in range(3):
+        assert f'id="Foo-method{i}"' in html
+        assert f'<div class="description doc2 docutils container">\n' \
+            f'<p>Description of method {i}.</p>' in html
+
+
+# ------------------------------------------------------------------------------
+# Cross-references
+# ------------------------------------------------------------------------------
+
+def test_external_xref_uses_indexed_kind(build_docs, fake_dartdoc_json, monkeypatch):
+    def load_declaration(*_):
+        raise AssertionError('The declaration should not be loaded')
+
+    monkeypatch.setattr(DartDomain, 'load_declaration', load_declaration)
+    app = build_docs(
+        {'index': '# Index\n\nSee {ref}`Foo` and {ref}`Bar-baz`.\n'},
+        sources={
+            'foo.dart': '/// Foo.\nclass Foo {}\n',
+            'bar.dart': '/// Bar.\nmixin Bar {}\n',
+        },
+        dartdoc_external_url='https://example.com/{package}/{kind}/{symbol}#{member}',
+    )
+    html = read_html(app)
+    assert 'href="https://example.com/test/class/Foo#"' in html
+    assert 'href="https://example.com/test/mixin/Bar#baz"' in html
+    assert app.warnings == ''
+
+
+def test_xrefs_resolve_through_index(build_docs, tmp_path):
+    members = [{'kind': 'method', 'name': 'run', 'returns': 'void',
+                'parameters': {'all': []}, 'description': 'Runs.'}]
+    api_data = {'test.dart': [make_class('Foo', 'Description of Foo.', members)]}
+    toctree = '```{toctree}\n:hidden:\n\napi\n```\n\n'
+    documents = {
+        'index': '# Index\n\n' + toctree +
+                 'See {ref}`Foo`, {any}`Foo`, {ref}`Foo-run` and {ref}`Foo-toString`.\n',
+        'api': '# API\n\n' + DIRECTIVE % 'Foo',
+    }
+    app = build_docs(documents, api_data)
+    assert app.warnings == ''
+    html = read_html(app)
+    assert html.count('href="api.html#Foo"') == 2
+    assert 'href="api.html#Foo-run"' in html
+    # A member that is not rendered on the page links to the page of its owner
+    assert 'href="api.html#Foo-toString"' in html
+    assert app.env.domaindata['dart']['xrefs'] == \
+        {'Foo': ('api', 'Foo'), 'Foo-run': ('api', 'Foo-run')}
+    # The targets are removed together with their page
+    (tmp_path / 'src' / 'api.md').unlink()
+    app = build_docs({'index': '# Index\n'})
+    assert app.env.domaindata['dart']['xrefs'] == {}
@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+
+import pytest
+
+from extensions.filelock import FileLock
+
+requires_fork = pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork()')
+
+
+def run_in_processes(target, n_processes):
+    """
+    Runs `target(i)` in `n_processes` forked processes at the same time, and checks that all of
+    them succeeded.
+    """
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(n_processes)
+
+    def run(i):
+        barrier.wait()
+        target(i)
+
+    processes = [context.Process(target=run, args=(i,)) for i in range(n_processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+
+@requires_fork
+def test_lock_is_exclusive(tmp_path):
+    counter_file = tmp_path / 'counter'
+    counter_file.write_text('0')
+    lock_file = str(tmp_path / 'counter.lock')
+
+    def increment(_):
+        for _ in range(20):
+            with FileLock(lock_file):
+                value = int(counter_file.read_text())
+                time.sleep(0.001)
+                counter_file.write_text(str(value + 1))
+
+    run_in_processes(increment, 4)
+    assert counter_file.read_text() == '80'
+    assert not os.path.exists(lock_file)
+
+
+@requires_fork
+def test_cache_key_extracted_once(build_docs, fake_dartdoc_json, monkeypatch):
+    # Long enough for all builds to look up the cache before the first extraction finishes
+    monkeypatch.setenv('FAKE_DARTDOC_JSON_DELAY', '0.5')
+    sources = {
+        'shared.dart': '/// Shared by all builds.\nclass Shared {}\n',
+        'other.dart': '/// Also shared.\nclass Other {}\n',
+    }
+    documents = {
+        'index': (
+            '# Index\n\n'
+            '```{dartdoc}\n:package: test\n:symbol: Shared\n:file: shared.dart\n```\n\n'
+            '```{dartdoc}\n:package: test\n:symbol: Other\n:file: other.dart\n```\n'
+        ),
+    }
+
+    def build(i):
+        # Separate projects, as if several builds were running at the same time on one machine
+        app = build_docs(
+            documents, sources=sources, project=f'project{i}', builder='dummy')
+        assert app.warnings == ''
+
+    run_in_processes(build, 4)
+    extracted = Counter(
+        os.path.basename(filename)
+        for _, files in fake_dartdoc_json()
+        for filename in files
+    )
+    assert extracted == {'shared.dart': 1, 'other.dart': 1}
@@ -0,0 +1,410 @@
+import json
+import os
+import re
+import textwrap
+import threading
+
+import pytest
+
+from extensions import flutter_app
+
+DOCUMENT = textwrap.dedent('''
+    # Game
+
+    ```{flutter-app}
+    :sources: ../app
+    :show: popup
+    ```
+''')
+
+
+def make_package(directory, pubspec, files):
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / 'pubspec.yaml').write_text(textwrap.dedent(pubspec))
+    for name, text in files.items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_text(text)
+
+
+@pytest.fixture
+def game(tmp_path):
+    """
+    Creates an app in `tmp_path/app` which depends on the local package `tmp_path/dep`, both
+    with their own assets, shaders and fonts.
+    """
+    make_package(tmp_path / 'app', '''
+        name: app
+        dependencies:
+          dep:
+            path: ../dep
+        flutter:
+          assets:
+            - assets/
+          shaders:
+            - shaders/app.frag
+    ''', {
+        'lib/main.dart': 'void main() {}\n',
+        'assets/level.json': '{}\n',
+        'shaders/app.frag': '// app shader\n',
+        '.dart_tool/package_config.json': json.dumps({'packages': [
+            {'name': 'app', 'rootUri': '../'},
+            {'name': 'dep', 'rootUri': '../../dep'},
+        ]}),
+    })
+    make_package(tmp_path / 'dep', '''
+        name: dep
+        flutter:
+          assets:
+            - images/
+            - path: data/config.json
+          shaders:
+            - shaders/dep.frag
+          fonts:
+            - family: Pixel
+              fonts:
+                - asset: fonts/pixel.ttf
+    ''', {
+        'lib/dep.dart': 'class Dep {}\n',
+        'images/tile.png': 'tile',
+        'data/config.json': '{}\n',
+        'shaders/dep.frag': '// dep shader\n',
+        'fonts/pixel.ttf': 'font',
+        'README.md': '# dep\n',
+        'build/web/main.dart.js': '// stale output\n',
+    })
+    return tmp_path
+
+
+@pytest.mark.parametrize('filename, recompiled', [
+    ('dep/images/tile.png', True),
+    ('dep/data/config.json', True),
+    ('dep/shaders/dep.frag', True),
+    ('dep/fonts/pixel.ttf', True),
+    ('dep/lib/dep.dart', True),
+    ('app/shaders/app.frag', True),
+    ('dep/README.md', False),
+    ('dep/build/web/main.dart.js', False),
+])
+def test_changed_sources_recompile_the_app(build_docs, fake_flutter, game, filename,
+                                           recompiled):
+    def build():
+        app = build_docs(
+            {'index': DOCUMENT}, fresh=True,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(game / 'app-cache'))
+        assert app.warnings == ''
+        return app
+
+    build()
+    assert fake_flutter() == [str(game / 'app')]
+    build()
+    assert len(fake_flutter()) == 1
+    with open(game / filename, 'at') as f:
+        f.write('changed')
+    app = build()
+    assert len(fake_flutter()) == (2 if recompiled else 1)
+    assert (game / '_build' / 'html' / '_static' / 'apps' / 'app' / 'main.dart.js').is_file()
+    assert app.env.flutter_apps['app']['compiled'] == recompiled
+
+
+def test_parallel_build(build_docs, fake_flutter, game, monkeypatch):
+    make_package(game / 'other', 'name: other\n', {'lib/main.dart': 'void main() {}\n'})
+    monkeypatch.setenv('FAKE_FLUTTER_DELAY', '0.5')
+    locks = []
+
+    class RecordingLock(flutter_app.FileLock):
+        def acquire(self):
+            locks.append(self.filename)
+            super().acquire()
+
+    monkeypatch.setattr(flutter_app, 'FileLock', RecordingLock)
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{f'page{i}': DOCUMENT.replace('../app', '../other' if i % 2 else '../app')
+           for i in range(8)},
+    }
+    app = build_docs(
+        documents, parallel=4,
+        extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+        flutter_app_cache_dir=str(game / 'app-cache'))
+    assert app.warnings == ''
+    assert app.is_parallel_allowed('read') and app.is_parallel_allowed('write')
+    # Every app is compiled once, even though it is used by documents in several processes
+    assert sorted(fake_flutter()) == [str(game / 'app'), str(game / 'other')]
+    apps = app.env.flutter_apps
+    assert apps['app']['docnames'] == {'page0', 'page2', 'page4', 'page6'}
+    assert apps['other']['docnames'] == {'page1', 'page3', 'page5', 'page7'}
+    outdir = game / '_build' / 'html'
+    for docname, name in [('page0', 'app'), ('page1', 'other')]:
+        assert (outdir / '_static' / 'apps' / name / 'index.html').is_file()
+        assert f'_static/apps/{name}/index.html' in (outdir / f'{docname}.html').read_text()
+    # The lock files of the deployed apps are not published, even while they exist
+    assert locks and not any(filename.startswith(str(outdir)) for filename in locks)
+
+
+def test_shared_assets_are_stored_once(build_docs, fake_flutter, game):
+    asset = 'x' * 100000
+    (game / 'app' / 'assets' / 'level.json').write_text(asset)
+    make_package(game / 'other', 'name: other\n', {
+        'lib/main.dart': 'void main() {}\n',
+        'assets/level.json': asset,
+    })
+    documents = {'index': DOCUMENT + DOCUMENT.replace('../app', '../other')}
+    app = build_docs(
+        documents,
+        extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+        flutter_app_cache_dir=str(game / 'app-cache'),
+        flutter_app_shared_assets=True, flutter_app_sync_mode='copy')
+    assert app.warnings == ''
+    apps_dir = game / '_build' / 'html' / '_static' / 'apps'
+    blobs = list((apps_dir / '_blobs').iterdir())
+    # Both apps have the same asset, which is stored once
+    assert len(blobs) == 1
+    for name in ['app', 'other']:
+        asset_map = json.loads((apps_dir / name / 'asset-map.json').read_text())
+        assert asset_map == {'assets/assets/level.json': f'../_blobs/{blobs[0].name}'}
+        assert blobs[0].name in (apps_dir / name / 'index.html').read_text()
+        assert not (apps_dir / name / 'assets').exists()
+    total_size = sum(path.stat().st_size for path in apps_dir.rglob('*') if path.is_file())
+    assert len(asset) < total_size < 1.5 * len(asset)
+
+
+def test_local_packages_without_package_config(build_docs, fake_flutter, game):
+    (game / 'app' / '.dart_tool' / 'package_config.json').unlink()
+    assert flutter_app.find_local_packages(str(game / 'app')) == [str(game / 'dep')]
+
+    def build():
+        app = build_docs(
+            {'index': DOCUMENT}, fresh=True,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(game / 'app-cache'))
+        assert app.warnings == ''
+
+    build()
+    with open(game / 'dep' / 'lib' / 'dep.dart', 'at') as f:
+        f.write('changed')
+    build()
+    assert len(fake_flutter()) == 2
+
+
+def test_local_packages_of_workspace(tmp_path):
+    make_package(tmp_path, '''
+        name: _
+        workspace:
+          - app
+          - packages/**
+    ''', {})
+    make_package(tmp_path / 'app', '''
+        name: app
+        resolution: workspace
+        dependencies:
+          a: ^1.0.0
+          flutter:
+            sdk: flutter
+        dev_dependencies:
+          lints: ^1.0.0
+    ''', {})
+    make_package(tmp_path / 'packages' / 'a', 'name: a\ndependencies:\n  b: ^1.0.0\n', {})
+    make_package(tmp_path / 'packages' / 'b', 'name: b\ndev_dependencies:\n  c: any\n', {})
+    make_package(tmp_path / 'packages' / 'c', 'name: c\n', {})
+    # Only the transitive dependencies of the app are fingerprinted, without the dev
+    # dependencies of the packages
+    assert flutter_app.find_local_packages(str(tmp_path / 'app')) == \
+        [str(tmp_path / 'packages' / 'a'), str(tmp_path / 'packages' / 'b')]
+    (tmp_path / 'packages' / 'a' / 'pubspec.yaml').write_text('name: [a\n')
+    # A malformed pubspec leaves the app without a fingerprint, so the cache is not used
+    assert flutter_app.compute_fingerprint(str(tmp_path / 'app')) is None
+
+
+def test_app_cache_entry_is_locked_while_used(build_docs, fake_flutter, game, monkeypatch):
+    cache_dir = game / 'app-cache'
+    copy_compiled = flutter_app.FlutterApp._copy_compiled
+    lock_files = []
+
+    def record_lock(self, build_dir):
+        lock_files.append(build_dir + '.lock')
+        assert os.path.isfile(build_dir + '.lock')
+        copy_compiled(self, build_dir)
+
+    monkeypatch.setattr(flutter_app.FlutterApp, '_copy_compiled', record_lock)
+    for _ in range(2):
+        build_docs(
+            {'index': DOCUMENT}, fresh=True,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(cache_dir))
+    assert len(lock_files) == 2 and not os.path.exists(lock_files[0])
+    # The eviction waits until the entry is not in use anymore
+    fingerprint = os.path.basename(lock_files[0])[:-len('.lock')]
+    cache = flutter_app.AppCache(str(cache_dir), max_size=0)
+    with cache.lock(fingerprint):
+        thread = threading.Thread(target=cache.evict)
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        assert (cache_dir / fingerprint / 'main.dart.js').is_file()
+    thread.join()
+    assert not (cache_dir / fingerprint).exists()
+
+
+def test_boot_modes(build_docs, fake_flutter, game):
+    def directive(boot):
+        option = f':boot: {boot}\n' if boot else ''
+        return f'```{{flutter-app}}\n:sources: ../app\n{option}:height: 200\n```\n\n'
+
+    documents = {'index': '# Game\n\n' + ''.join(
+        directive(boot) for boot in ['eager', 'visible', 'click', None, 'lazy'])}
+    app = build_docs(
+        documents,
+        extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+        flutter_app_cache_dir=str(game / 'app-cache'), flutter_app_boot='visible')
+    assert 'Invalid :boot: value lazy' in app.warnings
+    html = (game / '_build' / 'html' / 'index.html').read_text()
+    src = '/_static/apps/app/index.html?'
+    iframes = re.findall(r'<iframe[^>]*>', html)
+    assert len(iframes) == 1
+    assert f'src="{src}"' in iframes[0] and 'style="height: 200px"' in iframes[0]
+    placeholders = re.findall(r'<div[^>]*flutter-app-placeholder[^>]*>', html)
+    # The apps without the :boot: option use the `flutter_app_boot` of the site
+    assert [re.search(r'data-boot="(\w+)"', tag).group(1) for tag in placeholders] == \
+        ['visible', 'click', 'visible']
+    for tag in placeholders:
+        assert f'data-src="{src}"' in tag and 'style="height: 200px"' in tag
+        assert ' src=' not in tag
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'reflink'])
+def test_sync_tree(tmp_path, mode):
+    source_dir = tmp_path / 'source'
+    target_dir = tmp_path / 'target'
+    for name, text in {'a.png': 'aaaa', 'data/b.json': 'bb', 'data/c.json': 'cc'}.items():
+        (source_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        (source_dir / name).write_text(text)
+    stats = flutter_app.SyncStats()
+    flutter_app.sync_tree(str(source_dir), str(target_dir), mode, stats)
+    assert (stats.copied_files, stats.copied_bytes, stats.skipped_files) == (3, 8, 0)
+    assert (target_dir / 'data' / 'b.json').read_text() == 'bb'
+    if mode == 'hardlink':
+        assert (target_dir / 'a.png').samefile(source_dir / 'a.png')
+    # Only the changed files are copied, and the stale files are removed (except for the
+    # compressed versions of the files that still exist). The build replaces the files rather
+    # than writing into them, which would change the hardlinked targets too.
+    (source_dir / 'data' / 'b.json').unlink()
+    (source_dir / 'data' / 'b.json').write_text('BB')
+    (source_dir / 'data' / 'c.json').unlink()
+    (target_dir / 'a.png.gz').write_text('compressed')
+    (target_dir / 'data' / 'c.json.gz').write_text('compressed')
+    stats = flutter_app.SyncStats()
+    flutter_app.sync_tree(str(source_dir), str(target_dir), mode, stats)
+    assert (stats.copied_files, stats.skipped_files, stats.skipped_bytes) == (1, 1, 4)
+    assert stats.removed_files == 2
+    assert (target_dir / 'data' / 'b.json').read_text() == 'BB'
+    assert sorted(path.name for path in target_dir.rglob('*')) == \
+        ['a.png', 'a.png.gz', 'b.json', 'data']
+
+
+def test_unchanged_app_is_not_written_again(build_docs, fake_flutter, game):
+    def build():
+        app = build_docs(
+            {'index': DOCUMENT}, fresh=True,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(game / 'app-cache'))
+        assert app.warnings == ''
+
+    build()
+    app_dir = game / '_build' / 'html' / '_static' / 'apps' / 'app'
+    mtimes = {path: path.stat().st_mtime_ns for path in app_dir.rglob('*') if path.is_file()}
+    assert {path.name for path in mtimes} >= {'index.html', 'main.dart.js', 'level.json'}
+    build()
+    assert {path: path.stat().st_mtime_ns for path in mtimes} == mtimes
+
+
+def test_code_listings_are_highlighted_once(build_docs, fake_flutter, game, monkeypatch):
+    (game / 'app' / 'lib' / 'src').mkdir()
+    (game / 'app' / 'lib' / 'src' / 'world.dart').write_text('class World {}\n')
+    code = DOCUMENT.replace(':show: popup', ':show: code')
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{f'page{i}': code for i in range(3)},
+    }
+    highlighted = []
+    scanned = []
+    highlight = flutter_app.CodeListings._highlight
+    source_tree = flutter_app.SourceTree.__init__
+
+    def counting_highlight(self, text, lexer, location):
+        highlighted.append(text)
+        return highlight(self, text, lexer, location)
+
+    def counting_source_tree(self, source_dir):
+        scanned.append(source_dir)
+        source_tree(self, source_dir)
+
+    monkeypatch.setattr(flutter_app.CodeListings, '_highlight', counting_highlight)
+    monkeypatch.setattr(flutter_app.SourceTree, '__init__', counting_source_tree)
+
+    def build():
+        app = build_docs(
+            documents, fresh=True,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(game / 'app-cache'))
+        assert app.warnings == ''
+        return app
+
+    app = build()
+    # The app is scanned and each of its files is highlighted once, for all the directives
+    assert len(scanned) == 1
+    assert sorted(highlighted) == ['class World {}', 'void main() {}']
+    listings_dir = game / '_build' / 'doctrees' / 'flutter-app-listings'
+    stale_entry = listings_dir / 'stale.html'
+    stale_entry.write_text('')
+    os.utime(stale_entry, (0, 0))
+    # Unchanged files are not highlighted again, even in a fresh build
+    highlighted.clear()
+    build()
+    assert highlighted == []
+    (game / 'app' / 'lib' / 'src' / 'world.dart').write_text('class World2 {}\n')
+    build()
+    assert highlighted == ['class World2 {}']
+    # The entries that were not used for a long time are removed
+    assert not stale_entry.exists()
+
+
+def test_code_listings_are_fetched_on_demand(build_docs, fake_flutter, game):
+    (game / 'app' / 'lib' / 'main.dart').write_text('void runGame() {}\n')
+    documents = {'index': DOCUMENT.replace(':show: popup', ':show: code')}
+
+    def build():
+        app = build_docs(
+            documents,
+            extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+            flutter_app_cache_dir=str(game / 'app-cache'))
+        assert app.warnings == ''
+
+    build()
+    outdir = game / '_build' / 'html'
+    html = (outdir / 'index.html').read_text()
+    assert 'open_code_listings(&quot;app-source-lib&quot;, ' \
+        '&quot;/_static/apps/app/code/lib.html&quot;)' in html
+    assert 'runGame' not in html and 'highlight-dart' not in html
+    listings_file = outdir / '_static' / 'apps' / 'app' / 'code' / 'lib.html'
+    listings = listings_file.read_text()
+    assert '<div class="filename docutils container">\nmain.dart</div>' in listings
+    assert 'highlight-dart' in listings and 'runGame' in listings
+    # The listings are kept up to date even when the page is not read again
+    (game / 'app' / 'lib' / 'main.dart').write_text('void startGame() {}\n')
+    build()
+    assert 'startGame' in listings_file.read_text()
+    assert (outdir / 'index.html').read_text() == html
+
+
+def test_popup_button_prefetches_app(build_docs, fake_flutter, game):
+    app = build_docs(
+        {'index': DOCUMENT},
+        extensions=['myst_parser', 'extensions.dart_domain', 'extensions.flutter_app'],
+        flutter_app_cache_dir=str(game / 'app-cache'))
+    assert app.warnings == ''
+    html = (game / '_build' / 'html' / 'index.html').read_text()
+    [button] = re.findall(r'<button[^>]*flutter-app-button[^>]*>', html)
+    url = '&quot;/_static/apps/app/index.html?&quot;'
+    assert f'onclick="run_flutter_app({url})"' in button
+    assert f'onmouseenter="prefetch_flutter_app({url})"' in button
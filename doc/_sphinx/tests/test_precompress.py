@@ -0,0 +1,75 @@
+import os
+
+from extensions import precompress
+
+SETTINGS = {
+    'formats': ['gzip'],
+    'gzip_level': 9,
+    'brotli_quality': 11,
+    'extensions': ['.html', '.js'],
+    'min_size': 100,
+}
+
+
+def write_site(outdir, files):
+    for name, data in files.items():
+        (outdir / name).parent.mkdir(parents=True, exist_ok=True)
+        (outdir / name).write_bytes(data)
+
+
+def test_unchanged_files_are_reused(tmp_path):
+    outdir = tmp_path / 'html'
+    manifest_file = str(tmp_path / 'doctrees' / 'precompress.json')
+    write_site(outdir, {'index.html': b'<p>index</p>' * 100, 'app.js': b'main();' * 100})
+    files = precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    assert sorted(files) == ['app.js', 'index.html']
+    assert not any(entry['reused'] for entry in files.values())
+    (outdir / 'app.js').write_bytes(b'main(2);' * 100)
+    files = precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    assert {path: entry['reused'] for path, entry in files.items()} == \
+        {'app.js': False, 'index.html': True}
+    # A compressed file that has gone missing is written again
+    os.remove(outdir / 'index.html.gz')
+    files = precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    assert not files['index.html']['reused']
+    assert (outdir / 'index.html.gz').is_file()
+    # Nothing is reused once the settings change
+    settings = dict(SETTINGS, gzip_level=1)
+    files = precompress.precompress(str(outdir), manifest_file, settings, jobs=1)
+    assert not any(entry['reused'] for entry in files.values())
+
+
+def test_stale_compressed_files_are_removed(tmp_path):
+    outdir = tmp_path / 'html'
+    manifest_file = str(tmp_path / 'doctrees' / 'precompress.json')
+    write_site(outdir, {'index.html': b'<p>index</p>' * 100, 'old.html': b'<p>old</p>' * 100})
+    precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    assert (outdir / 'old.html.gz').is_file()
+    os.remove(outdir / 'old.html')
+    files = precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    assert list(files) == ['index.html']
+    assert not (outdir / 'old.html.gz').exists()
+    assert (outdir / 'index.html.gz').is_file()
+
+
+def test_incompressible_files_are_skipped(tmp_path):
+    outdir = tmp_path / 'html'
+    manifest_file = str(tmp_path / 'doctrees' / 'precompress.json')
+    write_site(outdir, {'random.js': os.urandom(1000), 'small.js': b'x' * 10})
+    files = precompress.precompress(str(outdir), manifest_file, SETTINGS, jobs=1)
+    # Files below the minimum size are not considered at all
+    assert list(files) == ['random.js']
+    assert files['random.js']['compressed'] == {'gzip': None}
+    assert not (outdir / 'random.js.gz').exists()
+    assert not (outdir / 'small.js.gz').exists()
+
+
+def test_disabled_by_default(build_docs):
+    extensions = ['myst_parser', 'extensions.dart_domain', 'extensions.precompress']
+    documents = {'index': '# Index\n\n' + 'Text of the page. ' * 200 + '\n'}
+    app = build_docs(documents, extensions=extensions)
+    assert not os.path.exists(os.path.join(app.outdir, 'index.html.gz'))
+    app = build_docs(documents, fresh=True, extensions=extensions, precompress_enabled=True,
+                     precompress_formats=['gzip'])
+    assert app.warnings == ''
+    assert os.path.isfile(os.path.join(app.outdir, 'index.html.gz'))
@@ -0,0 +1,91 @@
+import json
+
+from extensions import profiler
+from extensions.profiler import Profiler, span
+
+
+def make_event(category, name, start, duration, doc=None, subprocess=False, pid=1):
+    return {'cat': category, 'name': name, 'doc': doc, 'subprocess': subprocess,
+            'start': start, 'duration': duration, 'args': {}, 'pid': pid}
+
+
+def test_span_is_noop_when_disabled(monkeypatch):
+    monkeypatch.setattr(Profiler, 'enabled', False)
+    monkeypatch.setattr(Profiler, 'events', [])
+    with span('test', 'work'):
+        pass
+    assert Profiler.events == []
+
+
+def test_span_records_event(monkeypatch):
+    monkeypatch.setattr(Profiler, 'enabled', True)
+    monkeypatch.setattr(Profiler, 'events', [])
+    monkeypatch.setattr(Profiler, 'spool_dir', None)
+    with span('test', 'work', doc='index', subprocess=True, line=3):
+        pass
+    [event] = Profiler.events
+    assert {k: event[k] for k in ['cat', 'name', 'doc', 'subprocess', 'args']} == \
+        {'cat': 'test', 'name': 'work', 'doc': 'index', 'subprocess': True, 'args': {'line': 3}}
+    assert event['duration'] >= 0
+
+
+def test_summary_does_not_count_nested_spans_twice():
+    events = [
+        make_event('dart_domain', 'dartdoc Foo', 0.0, 2.0, doc='api'),
+        make_event('dart_domain', 'extract', 0.5, 1.0, doc='api', subprocess=True),
+        make_event('dart_domain', 'dartdoc Bar', 3.0, 1.0, doc='other'),
+        # The same time span in another process is not nested
+        make_event('dart_domain', 'dartdoc Baz', 0.5, 1.0, doc='third', pid=2),
+        make_event('sphinx', 'read api', 0.0, 2.5, doc='api'),
+        make_event('sphinx', 'read other', 2.9, 1.2, doc='other'),
+    ]
+    summary = profiler.summarize(events, total_time=5.0)
+    assert summary['extensions']['dart_domain'] == \
+        {'calls': 3, 'time': 4.0, 'subprocess_time': 1.0}
+    assert summary['spans']['dart_domain: extract'] == \
+        {'calls': 1, 'time': 1.0, 'subprocess_time': 1.0}
+    # The documents are ranked by their reading time
+    assert list(summary['documents']) == ['api', 'other', 'third']
+    assert summary['documents']['api']['read_time'] == 2.5
+
+
+def test_trace_format():
+    events = [make_event('flutter_app', 'flutter build web app', 0.25, 1.5, doc='index',
+                         subprocess=True)]
+    assert profiler.make_trace(events) == {
+        'traceEvents': [{
+            'name': 'flutter build web app',
+            'cat': 'flutter_app,subprocess',
+            'ph': 'X',
+            'ts': 250000,
+            'dur': 1500000,
+            'pid': 1,
+            'tid': 1,
+            'args': {'doc': 'index'},
+        }],
+        'displayTimeUnit': 'ms',
+    }
+
+
+def test_parallel_build_profile(build_docs, tmp_path, monkeypatch):
+    # The profiler state is global, so it is restored for the other tests
+    monkeypatch.setattr(Profiler, 'enabled', False)
+    documents = {
+        'index': '# Index\n\n```{toctree}\n:glob:\n\npage*\n```\n',
+        **{f'page{i}': f'# Page {i}\n' for i in range(8)},
+    }
+    output_dir = tmp_path / 'profile'
+    app = build_docs(
+        documents, parallel=2,
+        extensions=['myst_parser', 'extensions.dart_domain', 'extensions.profiler'],
+        profiler_enabled=True, profiler_output_dir=str(output_dir))
+    assert app.warnings == ''
+    summary = json.loads((output_dir / 'profile.json').read_text())
+    # The documents read by the forked processes are included too
+    assert sorted(summary['documents']) == sorted(documents)
+    assert all('read_time' in entry for entry in summary['documents'].values())
+    trace = json.loads((output_dir / 'profile-trace.json').read_text())
+    names = {event['name'] for event in trace['traceEvents']}
+    assert {f'read {docname}' for docname in documents} <= names
+    assert len({event['pid'] for event in trace['traceEvents']}) > 1
+    assert Profiler.spool_dir is None